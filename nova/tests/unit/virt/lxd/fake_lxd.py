@@ -0,0 +1,998 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import base64
+import collections
+import copy
+import datetime
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+
+import fixtures
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse
+
+from nova.virt.lxd import tracing
+
+API_EXTENSIONS = [
+    'storage', 'container_last_used_at', 'id_map', 'network',
+    'profile_usedby', 'container_full', 'resources']
+_WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_ACTIONS = {
+    # action: (statuses it is allowed from, resulting status, event,
+    #          description of the operation)
+    'start': (('Stopped',), 'Running', 'container-started',
+              'Starting container'),
+    'stop': (('Running', 'Frozen'), 'Stopped', 'container-stopped',
+             'Stopping container'),
+    'restart': (('Running',), 'Running', 'container-restarted',
+                'Restarting container'),
+    'freeze': (('Running',), 'Frozen', 'container-paused',
+               'Freezing container'),
+    'unfreeze': (('Frozen',), 'Running', 'container-resumed',
+                 'Unfreezing container'),
+}
+_STATUS_CODES = {
+    'Running': 103, 'Stopped': 102, 'Frozen': 110,
+    'Success': 200, 'Failure': 400, 'Cancelled': 401,
+}
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class FakeLXDError(Exception):
+    """An error of the LXD API, with the HTTP status it is returned with."""
+
+    def __init__(self, code, message):
+        super(FakeLXDError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class _Failure(object):
+
+    def __init__(self, code, message, times, operation):
+        self.code = code
+        self.message = message
+        self.times = times
+        self.operation = operation
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Hand the requests of a connection to the FakeLXD serving it."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Unix socket peers have no address to log.
+        pass
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send(self, code, body, content_type='application/json',
+             headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        self.server.lxd.handle(self)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+
+class FakeLXD(object):
+    """Serve the LXD REST API from memory, on a unix socket.
+
+    Containers, profiles, images, operations, storage pools and the
+    events websocket behave like those of LXD, closely enough for the
+    driver to run against them through an unmodified pylxd client.
+    Containers and images are only records, nothing is run.
+
+    Every request is counted in `calls`, under its method and the path
+    with the names of objects replaced by '*', as in tracing, e.g.
+    'GET /1.0/containers/*/state'. The same names are used to add
+    latency to requests, in `latency`, and to make them fail with
+    `fail`. Operations run for `operation_latency` seconds.
+    """
+
+    def __init__(self, directory, storage='dir'):
+        self.socket_path = os.path.join(directory, 'unix.socket')
+        self.storage = storage
+        self.containers = {}
+        self.profiles = {}
+        self.images = {}
+        self.aliases = {}
+        self.operations = {}
+        self.storage_pools = {}
+        self.calls = collections.Counter()
+        self.latency = {}
+        self.default_latency = 0
+        self.operation_latency = 0
+        self._failures = {}
+        self._operation_failure = None
+        self._done = {}
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._server = None
+        self._routes = [
+            ('GET', '', self._get_root),
+            ('GET', '1.0', self._get_host),
+            ('GET', '1.0/events', self._get_events),
+            ('GET', '1.0/containers', self._list_containers),
+            ('POST', '1.0/containers', self._create_container),
+            ('GET', '1.0/containers/*', self._get_container),
+            ('PUT', '1.0/containers/*', self._update_container),
+            ('POST', '1.0/containers/*', self._rename_container),
+            ('DELETE', '1.0/containers/*', self._delete_container),
+            ('GET', '1.0/containers/*/state', self._get_state),
+            ('PUT', '1.0/containers/*/state', self._change_state),
+            ('GET', '1.0/containers/*/files', self._get_file),
+            ('POST', '1.0/containers/*/files', self._put_file),
+            ('GET', '1.0/containers/*/snapshots', self._list_snapshots),
+            ('POST', '1.0/containers/*/snapshots', self._create_snapshot),
+            ('GET', '1.0/containers/*/snapshots/*', self._get_snapshot),
+            ('DELETE', '1.0/containers/*/snapshots/*',
+             self._delete_snapshot),
+            ('GET', '1.0/profiles', self._list_profiles),
+            ('POST', '1.0/profiles', self._create_profile),
+            ('GET', '1.0/profiles/*', self._get_profile),
+            ('PUT', '1.0/profiles/*', self._update_profile),
+            ('POST', '1.0/profiles/*', self._rename_profile),
+            ('DELETE', '1.0/profiles/*', self._delete_profile),
+            ('GET', '1.0/images', self._list_images),
+            ('POST', '1.0/images', self._create_image),
+            ('GET', '1.0/images/aliases', self._list_aliases),
+            ('POST', '1.0/images/aliases', self._create_alias),
+            ('GET', '1.0/images/aliases/*', self._get_alias),
+            ('DELETE', '1.0/images/aliases/*', self._delete_alias),
+            ('GET', '1.0/images/*', self._get_image),
+            ('PUT', '1.0/images/*', self._update_image),
+            ('DELETE', '1.0/images/*', self._delete_image),
+            ('GET', '1.0/images/*/export', self._export_image),
+            ('GET', '1.0/operations', self._list_operations),
+            ('GET', '1.0/operations/*', self._get_operation),
+            ('DELETE', '1.0/operations/*', self._cancel_operation),
+            ('GET', '1.0/operations/*/wait', self._wait_operation),
+            ('GET', '1.0/storage-pools', self._list_pools),
+            ('GET', '1.0/storage-pools/*', self._get_pool),
+            ('GET', '1.0/storage-pools/*/resources', self._get_resources),
+        ]
+        self.add_profile('default', devices={
+            'root': {'type': 'disk', 'path': '/', 'pool': 'default'}})
+        self.add_storage_pool('default')
+
+    # Setting up
+
+    @property
+    def endpoint(self):
+        """The endpoint to give pylxd.Client for this daemon."""
+        return 'http+unix://{}'.format(parse.quote(self.socket_path, safe=''))
+
+    def start(self):
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.lxd = self
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        with self._lock:
+            listeners, self._listeners = self._listeners, []
+        for listener in listeners:
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def add_container(self, name, status='Stopped', config=None,
+                      devices=None, profiles=('default',)):
+        with self._lock:
+            self.containers[name] = {
+                'name': name,
+                'architecture': 'x86_64',
+                'config': dict(config or {}),
+                'devices': dict(devices or {}),
+                'ephemeral': False,
+                'profiles': list(profiles),
+                'description': '',
+                'stateful': False,
+                'created_at': _now(),
+                'last_used_at': _now(),
+                'status': status,
+                'status_code': _STATUS_CODES[status],
+                'snapshots': {},
+                'files': {},
+            }
+        return self.containers[name]
+
+    def add_profile(self, name, config=None, devices=None):
+        with self._lock:
+            self.profiles[name] = {
+                'name': name,
+                'description': '',
+                'config': dict(config or {}),
+                'devices': dict(devices or {}),
+            }
+        return self.profiles[name]
+
+    def add_image(self, data=b'image', alias=None, properties=None):
+        fingerprint = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.images[fingerprint] = {
+                'fingerprint': fingerprint,
+                'filename': '',
+                'size': len(data),
+                'architecture': 'x86_64',
+                'public': False,
+                'auto_update': False,
+                'cached': False,
+                'properties': dict(properties or {}),
+                'created_at': _now(),
+                'uploaded_at': _now(),
+                'expires_at': '1970-01-01T00:00:00Z',
+                'last_used_at': '1970-01-01T00:00:00Z',
+                'data': data,
+            }
+            if alias:
+                self.aliases[alias] = {
+                    'name': alias, 'target': fingerprint, 'description': ''}
+        return fingerprint
+
+    def add_storage_pool(self, name, driver='dir', total=100 * 2 ** 30,
+                         used=0):
+        with self._lock:
+            self.storage_pools[name] = {
+                'name': name, 'driver': driver, 'config': {},
+                'total': total, 'used': used}
+
+    def fail(self, name, code=500, message='Injected failure', times=1,
+             operation=False):
+        """Make the next `times` requests `name` fail.
+
+        With `operation`, the request succeeds, and the operation it
+        starts fails instead. A `times` of None fails every request.
+        """
+        self._failures[name] = _Failure(code, message, times, operation)
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    # Events
+
+    def emit(self, event_type, metadata):
+        """Send an event to the clients of the events websocket."""
+        message = json.dumps({
+            'type': event_type,
+            'timestamp': _now(),
+            'metadata': metadata,
+        }).encode('utf-8')
+        if len(message) < 126:
+            header = struct.pack('!BB', 0x81, len(message))
+        elif len(message) < 2 ** 16:
+            header = struct.pack('!BBH', 0x81, 126, len(message))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(message))
+        with self._lock:
+            for listener in list(self._listeners):
+                try:
+                    listener.sendall(header + message)
+                except socket.error:
+                    self._listeners.remove(listener)
+
+    def _lifecycle(self, action, name):
+        self.emit('lifecycle', {
+            'action': action,
+            'source': '/1.0/containers/{}'.format(name),
+            'context': {},
+        })
+
+    def _get_events(self, request, params, body):
+        key = request.headers.get('Sec-WebSocket-Key')
+        if not key:
+            raise FakeLXDError(400, 'Not a websocket upgrade')
+        accept = base64.b64encode(hashlib.sha1(
+            (key + _WEBSOCKET_GUID).encode('ascii')).digest())
+        request.send_response(101)
+        request.send_header('Upgrade', 'websocket')
+        request.send_header('Connection', 'Upgrade')
+        request.send_header('Sec-WebSocket-Accept', accept.decode('ascii'))
+        request.end_headers()
+        request.wfile.flush()
+        connection = request.connection
+        with self._lock:
+            self._listeners.append(connection)
+        try:
+            # Nothing is expected from the client but its close frame.
+            while True:
+                data = connection.recv(4096)
+                if not data or six.indexbytes(data, 0) & 0x0f == 0x8:
+                    break
+            connection.sendall(b'\x88\x00')
+        except socket.error:
+            pass
+        finally:
+            with self._lock:
+                if connection in self._listeners:
+                    self._listeners.remove(connection)
+            request.close_connection = True
+        return None
+
+    # Requests
+
+    def handle(self, request):
+        url = parse.urlparse(request.path)
+        segments = [s for s in url.path.split('/') if s]
+        params = dict(parse.parse_qsl(url.query))
+        body = request._body()
+        name = '{} /{}'.format(request.command,
+                               tracing.api_name(segments))
+        with self._lock:
+            self.calls[name] += 1
+            failure = self._failures.get(name)
+            if failure is not None and failure.times is not None:
+                failure.times -= 1
+                if failure.times <= 0:
+                    del self._failures[name]
+        time.sleep(self.latency.get(name, self.default_latency))
+
+        path = tracing.api_name(segments)
+        handler = self._route(request.command, path)
+        # The names of the objects the request is about.
+        objects = [parse.unquote(segment) for segment, word
+                   in zip(segments, path.split('/')) if word == '*']
+        try:
+            if handler is None:
+                raise FakeLXDError(404, 'not found')
+            if failure is not None and not failure.operation:
+                raise FakeLXDError(failure.code, failure.message)
+            if handler in (self._get_events, self._wait_operation):
+                # These block, and take the lock as they need it.
+                result = handler(request, params, body, *objects)
+            else:
+                with self._lock:
+                    self._operation_failure = failure
+                    result = handler(request, params, body, *objects)
+        except FakeLXDError as e:
+            request.send(e.code, json.dumps({
+                'type': 'error',
+                'error': e.message,
+                'error_code': e.code,
+            }).encode('utf-8'))
+            return
+        if result is not None:
+            request.send(*result)
+
+    def _route(self, method, path):
+        for route_method, route_path, handler in self._routes:
+            if route_method == method and route_path == path:
+                return handler
+        return None
+
+    def _sync(self, metadata, code=200):
+        return code, json.dumps({
+            'type': 'sync',
+            'status': 'Success',
+            'status_code': 200,
+            'metadata': metadata,
+        }).encode('utf-8')
+
+    def _urls(self, collection, names):
+        return ['/1.0/{}/{}'.format(collection, name)
+                for name in sorted(names)]
+
+    def _json(self, body):
+        try:
+            return json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise FakeLXDError(400, 'Invalid JSON')
+
+    # Operations
+
+    def _operation(self, description, resources, action):
+        """Start an operation, which calls action when it finishes.
+
+        action returns the metadata of the operation, or raises
+        FakeLXDError to make it fail.
+        """
+        operation_id = str(uuid.uuid4())
+        operation = {
+            'id': operation_id,
+            'class': 'task',
+            'description': description,
+            'created_at': _now(),
+            'updated_at': _now(),
+            'status': 'Running',
+            'status_code': 103,
+            'resources': resources,
+            'metadata': None,
+            'may_cancel': True,
+            'err': '',
+        }
+        self.operations[operation_id] = operation
+        self._done[operation_id] = threading.Event()
+        failure = self._operation_failure
+        self.emit('operation', operation)
+
+        def _run():
+            time.sleep(self.operation_latency)
+            with self._lock:
+                if operation['status'] != 'Running':
+                    return
+                try:
+                    if failure is not None:
+                        raise FakeLXDError(failure.code, failure.message)
+                    operation['metadata'] = action()
+                    operation['status'] = 'Success'
+                except FakeLXDError as e:
+                    operation['status'] = 'Failure'
+                    operation['err'] = e.message
+                self._finish(operation)
+
+        thread = threading.Thread(target=_run)
+        thread.daemon = True
+        thread.start()
+        return 202, json.dumps({
+            'type': 'async',
+            'status': 'Operation created',
+            'status_code': 100,
+            'operation': '/1.0/operations/{}'.format(operation_id),
+            'metadata': operation,
+        }).encode('utf-8')
+
+    def _finish(self, operation):
+        operation['status_code'] = _STATUS_CODES[operation['status']]
+        operation['may_cancel'] = False
+        operation['updated_at'] = _now()
+        self._done[operation['id']].set()
+        self.emit('operation', operation)
+
+    def _operation_of(self, operation_id):
+        if operation_id not in self.operations:
+            raise FakeLXDError(404, 'not found')
+        return self.operations[operation_id]
+
+    def _list_operations(self, request, params, body):
+        statuses = collections.defaultdict(list)
+        for operation in self.operations.values():
+            statuses[operation['status'].lower()].append(
+                '/1.0/operations/{}'.format(operation['id']))
+        return self._sync(dict(statuses))
+
+    def _get_operation(self, request, params, body, operation_id):
+        return self._sync(self._operation_of(operation_id))
+
+    def _cancel_operation(self, request, params, body, operation_id):
+        operation = self._operation_of(operation_id)
+        if not operation['may_cancel']:
+            raise FakeLXDError(400, 'This operation can\'t be cancelled')
+        operation['status'] = 'Cancelled'
+        operation['err'] = 'Operation cancelled'
+        self._finish(operation)
+        return self._sync({})
+
+    def _wait_operation(self, request, params, body, operation_id):
+        with self._lock:
+            self._operation_of(operation_id)
+            done = self._done[operation_id]
+        timeout = float(params.get('timeout', -1))
+        done.wait(timeout if timeout >= 0 else None)
+        with self._lock:
+            return self._sync(self.operations[operation_id])
+
+    # Host
+
+    def _get_root(self, request, params, body):
+        return self._sync(['/1.0'])
+
+    def _get_host(self, request, params, body):
+        return self._sync({
+            'api_extensions': list(API_EXTENSIONS),
+            'api_status': 'stable',
+            'api_version': '1.0',
+            'auth': 'trusted',
+            'public': False,
+            'config': {},
+            'environment': {
+                'architectures': ['x86_64', 'i686'],
+                'driver': 'lxc',
+                'driver_version': '2.0.8',
+                'kernel': 'Linux',
+                'kernel_architecture': 'x86_64',
+                'kernel_version': '4.4.0-87-generic',
+                'server': 'lxd',
+                'server_pid': os.getpid(),
+                'server_version': '2.17',
+                'storage': self.storage,
+                'storage_version': '',
+            },
+        })
+
+    # Containers
+
+    def _container_of(self, name):
+        if name not in self.containers:
+            raise FakeLXDError(404, 'not found')
+        return self.containers[name]
+
+    def _expanded(self, container):
+        config = {}
+        devices = {}
+        for profile in container['profiles']:
+            if profile in self.profiles:
+                config.update(self.profiles[profile]['config'])
+                devices.update(self.profiles[profile]['devices'])
+        config.update(container['config'])
+        devices.update(container['devices'])
+        return config, devices
+
+    def _container(self, container):
+        result = dict((key, copy.deepcopy(value))
+                      for key, value in container.items()
+                      if key not in ('snapshots', 'files'))
+        result['expanded_config'], result['expanded_devices'] = (
+            self._expanded(container))
+        return result
+
+    def _state(self, container):
+        running = container['status'] != 'Stopped'
+        return {
+            'status': container['status'],
+            'status_code': container['status_code'],
+            'cpu': {'usage': 0},
+            'disk': {},
+            'memory': {
+                'usage': 64 * 2 ** 20 if running else 0,
+                'usage_peak': 128 * 2 ** 20 if running else 0,
+                'swap_usage': 0,
+                'swap_usage_peak': 0,
+            },
+            'network': {},
+            'pid': 1000 if running else 0,
+            'processes': 10 if running else 0,
+        }
+
+    def _resources(self, name):
+        return {'containers': ['/1.0/containers/{}'.format(name)]}
+
+    def _list_containers(self, request, params, body):
+        recursion = int(params.get('recursion', 0))
+        if not recursion:
+            return self._sync(self._urls('containers', self.containers))
+        containers = []
+        for name in sorted(self.containers):
+            container = self._container(self.containers[name])
+            if recursion > 1:
+                container['state'] = self._state(self.containers[name])
+                container['snapshots'] = None
+            containers.append(container)
+        return self._sync(containers)
+
+    def _create_container(self, request, params, body):
+        config = self._json(body)
+        name = config['name']
+        if name in self.containers:
+            raise FakeLXDError(409, 'Container \'{}\' already exists'.format(
+                name))
+        profiles = config.get('profiles') or ['default']
+        for profile in profiles:
+            if profile not in self.profiles:
+                raise FakeLXDError(400, 'Requested profile \'{}\' doesn\'t '
+                                        'exist'.format(profile))
+        source = config.get('source') or {'type': 'none'}
+
+        def create():
+            if source['type'] == 'image':
+                target = source.get('fingerprint')
+                if target is None:
+                    alias = self.aliases.get(source.get('alias'))
+                    target = alias and alias['target']
+                if target not in self.images:
+                    raise FakeLXDError(404, 'not found')
+            elif source['type'] == 'copy':
+                self._container_of(source['source'].split('/')[0])
+            if name in self.containers:
+                raise FakeLXDError(409, 'Container \'{}\' already '
+                                        'exists'.format(name))
+            self.add_container(name, config=config.get('config'),
+                               devices=config.get('devices'),
+                               profiles=profiles)
+            self.containers[name]['ephemeral'] = bool(
+                config.get('ephemeral'))
+            self._lifecycle('container-created', name)
+            return {}
+
+        return self._operation(
+            'Creating container', self._resources(name), create)
+
+    def _get_container(self, request, params, body, name):
+        return self._sync(self._container(self._container_of(name)))
+
+    def _update_container(self, request, params, body, name):
+        container = self._container_of(name)
+        update = self._json(body)
+
+        def save():
+            for key in ('config', 'devices', 'profiles', 'ephemeral',
+                        'description'):
+                if key in update:
+                    container[key] = update[key]
+            self._lifecycle('container-updated', name)
+            return {}
+
+        return self._operation(
+            'Updating container', self._resources(name), save)
+
+    def _rename_container(self, request, params, body, name):
+        container = self._container_of(name)
+        new_name = self._json(body).get('name')
+        if new_name is None:
+            raise FakeLXDError(501, 'Migration is not supported')
+        if container['status'] != 'Stopped':
+            raise FakeLXDError(400, 'Renaming of running container not '
+                                    'allowed')
+
+        def rename():
+            if new_name in self.containers:
+                raise FakeLXDError(409, 'Name \'{}\' already in use'.format(
+                    new_name))
+            del self.containers[name]
+            container['name'] = new_name
+            self.containers[new_name] = container
+            self._lifecycle('container-renamed', name)
+            return {}
+
+        return self._operation(
+            'Renaming container', self._resources(name), rename)
+
+    def _delete_container(self, request, params, body, name):
+        container = self._container_of(name)
+        if container['status'] != 'Stopped':
+            raise FakeLXDError(400, 'container is running')
+
+        def delete():
+            self.containers.pop(name, None)
+            self._lifecycle('container-deleted', name)
+            return {}
+
+        return self._operation(
+            'Deleting container', self._resources(name), delete)
+
+    def _get_state(self, request, params, body, name):
+        return self._sync(self._state(self._container_of(name)))
+
+    def _change_state(self, request, params, body, name):
+        container = self._container_of(name)
+        action = self._json(body).get('action')
+        if action not in _ACTIONS:
+            raise FakeLXDError(400, 'Unknown action {}'.format(action))
+        allowed, status, event, description = _ACTIONS[action]
+
+        def change():
+            if container['status'] not in allowed:
+                raise FakeLXDError(400, 'The container is already {}'.format(
+                    container['status'].lower()))
+            container['status'] = status
+            container['status_code'] = _STATUS_CODES[status]
+            container['last_used_at'] = _now()
+            self._lifecycle(event, name)
+            return {}
+
+        return self._operation(description, self._resources(name), change)
+
+    def _get_file(self, request, params, body, name):
+        container = self._container_of(name)
+        path = params.get('path')
+        if path not in container['files']:
+            raise FakeLXDError(404, 'not found')
+        return 200, container['files'][path], 'application/octet-stream', {
+            'X-LXD-uid': '0', 'X-LXD-gid': '0', 'X-LXD-mode': '0644',
+            'X-LXD-type': 'file'}
+
+    def _put_file(self, request, params, body, name):
+        container = self._container_of(name)
+        container['files'][params['path']] = body
+        return self._sync({})
+
+    def _list_snapshots(self, request, params, body, name):
+        container = self._container_of(name)
+        return self._sync(self._urls(
+            'containers/{}/snapshots'.format(name), container['snapshots']))
+
+    def _create_snapshot(self, request, params, body, name):
+        container = self._container_of(name)
+        snapshot_name = self._json(body)['name']
+
+        def create():
+            container['snapshots'][snapshot_name] = {
+                'name': '{}/{}'.format(name, snapshot_name),
+                'architecture': container['architecture'],
+                'config': dict(container['config']),
+                'devices': dict(container['devices']),
+                'profiles': list(container['profiles']),
+                'ephemeral': False,
+                'stateful': False,
+                'created_at': _now(),
+            }
+            return {}
+
+        return self._operation(
+            'Snapshotting container', self._resources(name), create)
+
+    def _snapshot_of(self, name, snapshot_name):
+        snapshots = self._container_of(name)['snapshots']
+        if snapshot_name not in snapshots:
+            raise FakeLXDError(404, 'not found')
+        return snapshots[snapshot_name]
+
+    def _get_snapshot(self, request, params, body, name, snapshot_name):
+        return self._sync(self._snapshot_of(name, snapshot_name))
+
+    def _delete_snapshot(self, request, params, body, name, snapshot_name):
+        self._snapshot_of(name, snapshot_name)
+
+        def delete():
+            self.containers[name]['snapshots'].pop(snapshot_name, None)
+            return {}
+
+        return self._operation(
+            'Deleting snapshot', self._resources(name), delete)
+
+    # Profiles
+
+    def _profile_of(self, name):
+        if name not in self.profiles:
+            raise FakeLXDError(404, 'not found')
+        return self.profiles[name]
+
+    def _used_by(self, name):
+        return self._urls('containers', [
+            container['name'] for container in self.containers.values()
+            if name in container['profiles']])
+
+    def _profile(self, profile):
+        result = copy.deepcopy(profile)
+        result['used_by'] = self._used_by(profile['name'])
+        return result
+
+    def _list_profiles(self, request, params, body):
+        if not int(params.get('recursion', 0)):
+            return self._sync(self._urls('profiles', self.profiles))
+        return self._sync([self._profile(self.profiles[name])
+                           for name in sorted(self.profiles)])
+
+    def _create_profile(self, request, params, body):
+        profile = self._json(body)
+        if profile['name'] in self.profiles:
+            raise FakeLXDError(409, 'The profile already exists')
+        self.add_profile(profile['name'], profile.get('config'),
+                         profile.get('devices'))
+        self.profiles[profile['name']]['description'] = profile.get(
+            'description', '')
+        return self._sync({})
+
+    def _get_profile(self, request, params, body, name):
+        return self._sync(self._profile(self._profile_of(name)))
+
+    def _update_profile(self, request, params, body, name):
+        profile = self._profile_of(name)
+        update = self._json(body)
+        profile['config'] = update.get('config') or {}
+        profile['devices'] = update.get('devices') or {}
+        profile['description'] = update.get('description', '')
+        return self._sync({})
+
+    def _rename_profile(self, request, params, body, name):
+        profile = self._profile_of(name)
+        new_name = self._json(body)['name']
+        if new_name in self.profiles:
+            raise FakeLXDError(409, 'Name \'{}\' already in use'.format(
+                new_name))
+        del self.profiles[name]
+        profile['name'] = new_name
+        self.profiles[new_name] = profile
+        return self._sync({})
+
+    def _delete_profile(self, request, params, body, name):
+        self._profile_of(name)
+        if self._used_by(name):
+            raise FakeLXDError(400, 'Profile is currently in use')
+        del self.profiles[name]
+        return self._sync({})
+
+    # Images
+
+    def _image_of(self, fingerprint):
+        matches = [f for f in self.images if f.startswith(fingerprint)]
+        if len(matches) != 1:
+            raise FakeLXDError(404, 'not found')
+        return self.images[matches[0]]
+
+    def _image(self, image):
+        result = dict((key, copy.deepcopy(value))
+                      for key, value in image.items() if key != 'data')
+        result['aliases'] = [
+            {'name': alias['name'], 'description': alias['description']}
+            for alias in self.aliases.values()
+            if alias['target'] == image['fingerprint']]
+        return result
+
+    def _list_images(self, request, params, body):
+        if not int(params.get('recursion', 0)):
+            return self._sync(self._urls('images', self.images))
+        return self._sync([self._image(self.images[fingerprint])
+                           for fingerprint in sorted(self.images)])
+
+    def _create_image(self, request, params, body):
+        content_type = request.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            source = self._json(body).get('source') or {}
+            if source.get('type') not in ('container', 'snapshot'):
+                raise FakeLXDError(501, 'Only publishing containers is '
+                                        'supported')
+            name = source.get('name', '')
+            data = name.encode('utf-8') + str(uuid.uuid4()).encode('ascii')
+            parent = name.split('/')[0]
+            if source['type'] == 'snapshot':
+                self._snapshot_of(parent, name.split('/')[-1])
+            else:
+                self._container_of(parent)
+            resources = self._resources(parent)
+        else:
+            data = body
+            resources = {}
+        public = request.headers.get('X-LXD-Public') == '1'
+
+        def create():
+            fingerprint = self.add_image(data)
+            self.images[fingerprint]['public'] = public
+            return {'fingerprint': fingerprint, 'size': len(data)}
+
+        return self._operation('Downloading image', resources, create)
+
+    def _get_image(self, request, params, body, fingerprint):
+        return self._sync(self._image(self._image_of(fingerprint)))
+
+    def _update_image(self, request, params, body, fingerprint):
+        image = self._image_of(fingerprint)
+        update = self._json(body)
+        for key in ('auto_update', 'properties', 'public'):
+            if key in update:
+                image[key] = update[key]
+        return self._sync({})
+
+    def _delete_image(self, request, params, body, fingerprint):
+        image = self._image_of(fingerprint)
+
+        def delete():
+            self.images.pop(image['fingerprint'], None)
+            for name, alias in list(self.aliases.items()):
+                if alias['target'] == image['fingerprint']:
+                    del self.aliases[name]
+            return {}
+
+        return self._operation('Deleting image', {}, delete)
+
+    def _export_image(self, request, params, body, fingerprint):
+        image = self._image_of(fingerprint)
+        return 200, image['data'], 'application/octet-stream', {
+            'Content-Disposition': 'attachment; filename={}.tar.xz'.format(
+                image['fingerprint'])}
+
+    def _list_aliases(self, request, params, body):
+        return self._sync(self._urls('images/aliases', self.aliases))
+
+    def _create_alias(self, request, params, body):
+        alias = self._json(body)
+        if alias['name'] in self.aliases:
+            raise FakeLXDError(409, 'Alias \'{}\' already exists'.format(
+                alias['name']))
+        image = self._image_of(alias['target'])
+        self.aliases[alias['name']] = {
+            'name': alias['name'],
+            'target': image['fingerprint'],
+            'description': alias.get('description', ''),
+        }
+        return self._sync({})
+
+    def _get_alias(self, request, params, body, name):
+        if name not in self.aliases:
+            raise FakeLXDError(404, 'not found')
+        return self._sync(self.aliases[name])
+
+    def _delete_alias(self, request, params, body, name):
+        if self.aliases.pop(name, None) is None:
+            raise FakeLXDError(404, 'not found')
+        return self._sync({})
+
+    # Storage pools
+
+    def _pool_of(self, name):
+        if name not in self.storage_pools:
+            raise FakeLXDError(404, 'not found')
+        return self.storage_pools[name]
+
+    def _list_pools(self, request, params, body):
+        return self._sync(self._urls('storage-pools', self.storage_pools))
+
+    def _get_pool(self, request, params, body, name):
+        pool = self._pool_of(name)
+        return self._sync({
+            'name': pool['name'],
+            'driver': pool['driver'],
+            'config': pool['config'],
+            'used_by': [],
+        })
+
+    def _get_resources(self, request, params, body, name):
+        pool = self._pool_of(name)
+        return self._sync({
+            'space': {'total': pool['total'], 'used': pool['used']},
+            'inodes': {'total': 0, 'used': 0},
+        })
+
+
+class FakeLXDFixture(fixtures.Fixture):
+    """Run a FakeLXD where pylxd.Client() looks for the LXD daemon.
+
+    LXD_DIR is pointed at the directory of its socket, so that the
+    driver and the deprecated pylxd API connect to it without any
+    change. pylxd.Client(endpoint=lxd.endpoint) reaches it too.
+    """
+
+    def setUp(self):
+        super(FakeLXDFixture, self).setUp()
+        directory = self.useFixture(fixtures.TempDir()).path
+        self.lxd = FakeLXD(directory)
+        self.lxd.start()
+        self.addCleanup(self.lxd.stop)
+        self.useFixture(fixtures.EnvironmentVariable('LXD_DIR', directory))
@@ -0,0 +1,123 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+
+import fixtures
+import mock
+from nova import test
+
+from nova.virt.lxd import cgroup
+
+
+class CgroupSamplerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.cgroup.CgroupSampler."""
+
+    def setUp(self):
+        super(CgroupSamplerTest, self).setUp()
+        self.root = self.useFixture(fixtures.TempDir()).path
+        self.sampler = cgroup.CgroupSampler(10, root=self.root)
+
+    def _write(self, path, files):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, content in files.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(content)
+
+    def _v1(self, name, cpu_time_ns=5000, limit='9223372036854771712'):
+        self._write(os.path.join('cpu,cpuacct', 'lxc', name),
+                    {'cpuacct.usage': '%d\n' % cpu_time_ns})
+        self._write(os.path.join('memory', 'lxc', name),
+                    {'memory.usage_in_bytes': '4096\n',
+                     'memory.limit_in_bytes': limit + '\n'})
+
+    def _v2(self, name, limit='max'):
+        self._write('', {'cgroup.controllers': 'cpu memory\n'})
+        self._write('lxc.payload.' + name,
+                    {'cpu.stat': 'usage_usec 5\nuser_usec 3\n',
+                     'memory.current': '8192\n',
+                     'memory.max': limit + '\n'})
+
+    def test_v1(self):
+        self._v1('instance-a', limit='1048576')
+
+        self.assertFalse(self.sampler.unified)
+        self.assertEqual(cgroup.Usage(5000, 4, 1024),
+                         self.sampler.get('instance-a'))
+
+    def test_v1_unlimited(self):
+        self._v1('instance-a')
+
+        self.assertIsNone(self.sampler.get('instance-a').max_memory_kb)
+
+    def test_v2(self):
+        self._v2('instance-a', limit='2097152')
+
+        self.assertTrue(self.sampler.unified)
+        self.assertEqual(cgroup.Usage(5000, 8, 2048),
+                         self.sampler.get('instance-a'))
+
+    def test_v2_unlimited(self):
+        self._v2('instance-a')
+
+        self.assertIsNone(self.sampler.get('instance-a').max_memory_kb)
+
+    def test_not_running(self):
+        self.assertIsNone(self.sampler.get('instance-a'))
+
+    @mock.patch('time.time')
+    def test_batched(self, time):
+        """Samples are reused within an interval, then read together."""
+        time.return_value = 100
+        self._v1('instance-a', cpu_time_ns=1)
+        self._v1('instance-b', cpu_time_ns=2)
+        self.sampler.get('instance-a')
+        self.sampler.get('instance-b')
+        self._v1('instance-a', cpu_time_ns=3)
+        self._v1('instance-b', cpu_time_ns=4)
+
+        time.return_value = 105
+        self.assertEqual(1, self.sampler.get('instance-a').cpu_time_ns)
+
+        time.return_value = 110
+        with mock.patch.object(
+                self.sampler, '_read_usage',
+                wraps=self.sampler._read_usage) as read_usage:
+            self.assertEqual(3, self.sampler.get('instance-a').cpu_time_ns)
+            self.assertEqual(4, self.sampler.get('instance-b').cpu_time_ns)
+        self.assertEqual(2, read_usage.call_count)
+
+    @mock.patch('time.time')
+    def test_stopped(self, time):
+        """The cgroup of a container is resolved again once it is gone."""
+        time.return_value = 100
+        self._v1('instance-a')
+        self.sampler.get('instance-a')
+        os.remove(os.path.join(
+            self.root, 'cpu,cpuacct', 'lxc', 'instance-a', 'cpuacct.usage'))
+
+        time.return_value = 110
+        self.assertIsNone(self.sampler.get('instance-a'))
+        self.assertEqual({}, self.sampler._paths)
+
+    def test_forget(self):
+        self._v1('instance-a')
+        self.sampler.get('instance-a')
+
+        self.sampler.forget('instance-a')
+
+        self.assertEqual({}, self.sampler._paths)
+        self.assertEqual({}, self.sampler._samples)
@@ -0,0 +1,66 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import mock
+from nova import test
+
+from nova.virt.lxd import commitment
+from nova.virt.lxd import flavor
+
+
+def _profile(name, cpu, memory):
+    return {'name': name,
+            'config': {'environment.product_name': 'OpenStack Nova',
+                       'limits.cpu': cpu,
+                       'limits.memory': memory}}
+
+
+class CommitmentTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.commitment.Commitment."""
+
+    def setUp(self):
+        super(CommitmentTest, self).setUp()
+        self.client = mock.MagicMock()
+        self.client.api.profiles.get.return_value.json.return_value = {
+            'metadata': [
+                {'name': 'default', 'config': {'limits.cpu': '8'}},
+                _profile('instance-a', '2', '512MB'),
+                _profile('instance-b', '1', '256MB'),
+            ]}
+        self.commitment = commitment.Commitment()
+
+    def test_totals(self):
+        self.assertEqual(flavor.Limits(3, 768),
+                         self.commitment.totals(self.client))
+        self.commitment.totals(self.client)
+
+        self.client.api.profiles.get.assert_called_once_with(
+            params={'recursion': 1})
+
+    def test_incremental(self):
+        self.commitment.totals(self.client)
+
+        self.commitment.set('instance-c', flavor.Limits(4, 1024))
+        self.commitment.set('instance-a', flavor.Limits(1, 128))
+        self.commitment.remove('instance-b')
+
+        self.assertEqual(flavor.Limits(5, 1152),
+                         self.commitment.totals(self.client))
+
+    def test_set_before_load(self):
+        """Profiles recorded before the first listing are not reread."""
+        self.commitment.set('instance-a', flavor.Limits(4, 1024))
+
+        self.assertEqual(flavor.Limits(5, 1280),
+                         self.commitment.totals(self.client))
@@ -12,6 +12,10 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import threading
+import time
+
+import eventlet
 import mock
 
 from nova import context
@@ -19,6 +23,7 @@ from nova import test
 from nova.tests.unit import fake_instance
 
 from nova.virt.lxd import common
+from nova.virt.lxd import tracing
 
 
 class InstanceAttributesTest(test.NoDBTestCase):
@@ -67,3 +72,171 @@ class InstanceAttributesTest(test.NoDBTestCase):
         self.assertEqual(
             '/i/instance-00000001/storage',
             attributes.storage_path)
+
+
+class SingleFlightTest(test.NoDBTestCase):
+    """Tests for SingleFlight."""
+
+    def setUp(self):
+        super(SingleFlightTest, self).setUp()
+        self.flight = common.SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.results = []
+
+    def _slow(self, result):
+        self.started.set()
+        self.release.wait()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _call(self, function, *args):
+        try:
+            self.results.append(self.flight.do('key', function, *args))
+        except Exception as e:
+            self.results.append(e)
+
+    def _run_concurrently(self, function, *args):
+        threads = [threading.Thread(target=self._call, args=(function,) + args)
+                   for _ in range(5)]
+        threads[0].start()
+        self.started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while self.flight.in_flight('key') < len(threads) - 1:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+    def test_do(self):
+        function = mock.Mock(return_value='result')
+
+        self.assertEqual('result', self.flight.do('key', function, 'arg'))
+        function.assert_called_once_with('arg')
+        self.assertEqual(0, self.flight.in_flight('key'))
+
+    def test_do_coalesces(self):
+        function = mock.Mock(side_effect=self._slow)
+
+        self._run_concurrently(function, 'result')
+
+        function.assert_called_once_with('result')
+        self.assertEqual(['result'] * 5, self.results)
+
+    def test_do_shares_exception(self):
+        error = ValueError('failed')
+
+        self._run_concurrently(self._slow, error)
+
+        self.assertEqual([error] * 5, self.results)
+        self.assertEqual(0, self.flight.in_flight('key'))
+
+    def test_do_again(self):
+        function = mock.Mock(side_effect=['first', 'second'])
+
+        self.assertEqual('first', self.flight.do('key', function))
+        self.assertEqual('second', self.flight.do('key', function))
+
+
+class TaskGraphTest(test.NoDBTestCase):
+    """Tests for TaskGraph."""
+
+    def test_run(self):
+        steps = common.TaskGraph()
+        steps.add('a', lambda x: x, 1)
+        steps.add('b', lambda: steps.results['a'] + 1, requires=('a',))
+
+        self.assertEqual({'a': 1, 'b': 2}, steps.run())
+
+    def test_run_traced(self):
+        """The steps are tagged with the method running them."""
+        steps = common.TaskGraph()
+        steps.add('a', lambda: tracing.TRACER.context)
+
+        with tracing.TRACER.tagged('spawn', 'instance-uuid'):
+            results = steps.run()
+
+        self.assertEqual(('spawn', 'instance-uuid'), results['a'])
+
+    def test_run_concurrently(self):
+        started = eventlet.event.Event()
+
+        def wait_for_b():
+            with eventlet.Timeout(5, AssertionError('b did not start')):
+                started.wait()
+            return 'a'
+
+        steps = common.TaskGraph()
+        steps.add('a', wait_for_b)
+        steps.add('b', started.send, 'b')
+
+        self.assertEqual({'a': 'a', 'b': None}, steps.run())
+
+    def test_run_failure(self):
+        release = eventlet.event.Event()
+        dependent = mock.Mock()
+
+        def fail():
+            release.send()
+            raise ValueError()
+
+        steps = common.TaskGraph()
+        steps.add('slow', release.wait)
+        steps.add('fail', fail)
+        steps.add('dependent', dependent, requires=('fail',))
+
+        self.assertRaises(ValueError, steps.run)
+        self.assertEqual({'slow': None}, steps.results)
+        self.assertFalse(dependent.called)
+
+    def test_add_unknown_requirement(self):
+        steps = common.TaskGraph()
+
+        self.assertRaises(
+            ValueError, steps.add, 'a', mock.Mock(), requires=('b',))
+
+
+class ListContainersTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.common.list_containers."""
+
+    def setUp(self):
+        super(ListContainersTest, self).setUp()
+        self.client = mock.MagicMock()
+        self.containers = [
+            {'name': 'instance-a', 'config': {}},
+            {'name': 'nova-lxd-warm-1', 'config': {}},
+        ]
+        self.client.api.containers.get.return_value.json.return_value = {
+            'metadata': self.containers}
+
+    def test_list(self):
+        self.assertEqual(
+            self.containers, common.list_containers(self.client))
+        self.client.api.containers.get.assert_called_once_with(
+            params={'recursion': 1})
+
+    def test_list_state(self):
+        self.containers[0]['state'] = {'status_code': 103}
+
+        containers = common.list_containers(self.client, state=True)
+
+        self.client.api.containers.get.assert_called_once_with(
+            params={'recursion': 2})
+        self.assertEqual({'status_code': 103}, containers[0]['state'])
+        self.assertFalse(
+            self.client.api.containers.__getitem__.called)
+
+    def test_list_state_backfill(self):
+        """LXD releases without state in the listing are asked for it."""
+        state = self.client.api.containers.__getitem__.return_value.state
+        state.get.return_value.json.return_value = {
+            'metadata': {'status_code': 102}}
+
+        containers = common.list_containers(self.client, state=True)
+
+        self.client.api.containers.__getitem__.assert_called_once_with(
+            'instance-a')
+        self.assertEqual({'status_code': 102}, containers[0]['state'])
+        self.assertNotIn('state', containers[1])
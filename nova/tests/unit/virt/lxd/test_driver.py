@@ -15,10 +15,15 @@
 import collections
 import json
 import base64
-from contextlib import closing
+import os
+import tarfile
+import tempfile
 
 import eventlet
+import fixtures
 from oslo_config import cfg
+from oslo_utils import units
+from oslo_utils import fileutils
 import mock
 from nova import context
 from nova import exception
@@ -33,6 +38,7 @@ import six
 
 from nova.virt.lxd import common
 from nova.virt.lxd import driver
+from nova.virt.lxd import privsep
 
 MockResponse = collections.namedtuple('Response', ['status_code'])
 
@@ -123,6 +129,24 @@ class LXDDriverTest(test.NoDBTestCase):
         self.CONF.instances_path = '/path/to/instances'
         self.CONF.my_ip = '0.0.0.0'
         self.CONF.config_drive_format = 'iso9660'
+        self.CONF.lxd.max_concurrent_image_downloads = 0
+        self.CONF.lxd.image_download_bandwidth_mb = 0
+        self.CONF.lxd.image_staging_dir = None
+        self.CONF.lxd.warm_pool = {}
+        self.CONF.lxd.clone_from_golden = False
+        self.CONF.lxd.config_drive_direct = False
+        self.CONF.lxd.metadata_delivery = 'configdrive'
+        self.CONF.lxd.watch_events = False
+        self.CONF.lxd.cgroup_sample_interval = 10
+        self.CONF.lxd.host_sample_interval = 0
+        self.CONF.lxd.operation_timeouts = {}
+        self.CONF.lxd.timeout = -1
+        self.CONF.lxd.trace_sample_rate = 0.0
+        self.CONF.lxd.trace_metrics_file = None
+        self.CONF.lxd.profile_dir = None
+        self.CONF.lxd.profile_modes = ['cprofile']
+        self.CONF.lxd.profile_enabled = False
+        self.CONF.lxd.profile_signal = None
 
         # XXX: rockstar (03 Nov 2016) - This should be removed once
         # everything is where it should live.
@@ -138,6 +162,7 @@ class LXDDriverTest(test.NoDBTestCase):
         after_reboot_patcher = mock.patch(
             'nova.virt.lxd.driver.LXDDriver._after_reboot')
         self.patchers.append(after_reboot_patcher)
+        self.after_reboot_patcher = after_reboot_patcher
         self.after_reboot = after_reboot_patcher.start()
 
         bdige_patcher = mock.patch(
@@ -160,6 +185,13 @@ class LXDDriverTest(test.NoDBTestCase):
             'mac_address': '00:11:22:33:44:55', 'bridge': 'qbr0123456789a',
         }
 
+        image_cache_patcher = mock.patch(
+            'nova.virt.lxd.driver.imagecache.ImageCacheManager')
+        self.patchers.append(image_cache_patcher)
+        self.ImageCacheManager = image_cache_patcher.start()
+        self.image_cache = mock.Mock()
+        self.ImageCacheManager.return_value = self.image_cache
+
         # NOTE: mock out fileutils to ensure that unit tests don't try
         #       to manipulate the filesystem (breaks in package builds).
         driver.fileutils = mock.Mock()
@@ -199,6 +231,8 @@ class LXDDriverTest(test.NoDBTestCase):
             ctx, name='test', memory_mb=0)
         lxd_driver = driver.LXDDriver(None)
         lxd_driver.init_host(None)
+        lxd_driver.cgroups = mock.Mock()
+        lxd_driver.cgroups.get.return_value = None
 
         info = lxd_driver.get_info(instance)
 
@@ -208,10 +242,205 @@ class LXDDriverTest(test.NoDBTestCase):
         self.assertEqual(1, info.num_cpu)
         self.assertEqual(0, info.cpu_time_ns)
 
+    def test_get_info_cgroups(self):
+        """Running containers are accounted from their cgroups."""
+        container = mock.Mock()
+        container.state.return_value = MockContainerState(
+            'Running', {'usage': 4000, 'usage_peak': 4500}, 100)
+        self.client.containers.get.return_value = container
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=512)
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        lxd_driver.cgroups = mock.Mock()
+        lxd_driver.cgroups.get.return_value = driver.cgroup.Usage(
+            cpu_time_ns=5000, memory_kb=100, max_memory_kb=None)
+
+        info = lxd_driver.get_info(instance)
+
+        lxd_driver.cgroups.get.assert_called_once_with('test')
+        self.assertEqual(100, info.mem_kb)
+        self.assertEqual(512 * 1024, info.max_mem_kb)
+        self.assertEqual(5000, info.cpu_time_ns)
+
+    def test_get_info_cached(self):
+        """A synced state cache answers without querying LXD."""
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        lxd_driver.state_cache._synced = True
+        lxd_driver.state_cache._states[instance.name] = (
+            driver.events.CachedState(
+                102, {'usage': 4000, 'usage_peak': 4500}, {}))
+
+        info = lxd_driver.get_info(instance)
+
+        self.assertEqual(power_state.SHUTDOWN, info.state)
+        self.assertEqual(3, info.mem_kb)
+        self.assertFalse(self.client.containers.get.called)
+
+    def test_get_info_not_found(self):
+        self.client.containers.get.side_effect = (
+            lxdcore_exceptions.NotFound(MockResponse(404)))
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+
+        self.assertRaises(
+            exception.InstanceNotFound, lxd_driver.get_info, instance)
+
+    def test_init_host_tracks_operations(self):
+        """Operations waited for by pylxd go through the tracker."""
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.operations = mock.Mock()
+
+        lxd_driver.init_host(None)
+        lxd_driver.client.operations.wait_for_operation('/1.0/operations/a')
+
+        lxd_driver.operations.wait.assert_called_once_with(
+            self.client, '/1.0/operations/a')
+
+    @mock.patch('nova.virt.lxd.tracing.TRACER')
+    def test_init_host_exports_stats(self, tracer):
+        """The stats go to the metrics file, even without tracing."""
+        self.CONF.lxd.trace_metrics_file = '/tmp/metrics.json'
+        tracer.enabled = False
+        lxd_driver = driver.LXDDriver(None)
+
+        lxd_driver.init_host(None)
+
+        tracer.add_stats.assert_any_call(
+            'image_transfers', lxd_driver.image_transfers.stats)
+        tracer.add_stats.assert_any_call(
+            'warm_pool', lxd_driver.warm_pool.stats)
+        tracer.add_stats.assert_any_call('privsep_calls', privsep.stats)
+        tracer.start_dumping.assert_called_once_with('/tmp/metrics.json')
+
+    def test_init_host_watch_events(self):
+        self.CONF.lxd.watch_events = True
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.events = mock.Mock()
+
+        lxd_driver.init_host(None)
+
+        lxd_driver.events.start.assert_called_once_with(self.client)
+
+    @mock.patch('nova.virt.lxd.driver.objects.InstanceList.get_by_host')
+    def test_instance_uuid(self, get_by_host):
+        """The uuid is read from the profile of the container."""
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.state_cache = mock.Mock()
+        lxd_driver.state_cache.get.return_value = driver.events.CachedState(
+            103, {}, {'user.nova-lxd.instance-uuid': 'uuid-a'})
+
+        self.assertEqual('uuid-a', lxd_driver._instance_uuid('instance-a'))
+        self.assertEqual('uuid-a', lxd_driver._instance_uuid('instance-a'))
+        lxd_driver.state_cache.get.assert_called_once_with(
+            None, 'instance-a')
+        self.assertFalse(get_by_host.called)
+
+    @mock.patch('nova.virt.lxd.driver.objects.InstanceList.get_by_host')
+    def test_instance_uuid_old_profile(self, get_by_host):
+        """Without a uuid in the profile, the instances are looked up."""
+        instance = mock.Mock(uuid='uuid-a')
+        instance.name = 'instance-a'
+        get_by_host.return_value = [instance]
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.state_cache = mock.Mock()
+        lxd_driver.state_cache.get.return_value = driver.events.CachedState(
+            103, {}, {})
+
+        self.assertEqual('uuid-a', lxd_driver._instance_uuid('instance-a'))
+        self.assertEqual('uuid-a', lxd_driver._instance_uuid('instance-a'))
+        self.assertIsNone(lxd_driver._instance_uuid('instance-b'))
+        self.assertIsNone(lxd_driver._instance_uuid('instance-b'))
+        self.assertEqual(2, get_by_host.call_count)
+        self.assertEqual(2, lxd_driver.state_cache.get.call_count)
+
+    def test_instance_uuid_rescue(self):
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.state_cache = mock.Mock()
+
+        self.assertIsNone(lxd_driver._instance_uuid('instance-a-rescue'))
+        self.assertFalse(lxd_driver.state_cache.get.called)
+
+    def test_power_off_invalidates_state(self):
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        lxd_driver.state_cache = mock.Mock()
+
+        lxd_driver.power_off(instance)
+
+        lxd_driver.state_cache.invalidate.assert_called_once_with(
+            instance.name)
+
+    def test_list_instance_uuids(self):
+        nova_config = {'environment.product_name': 'OpenStack Nova'}
+        self.client.api.containers.get.return_value.json.return_value = {
+            'metadata': [
+                {'name': 'instance-a', 'expanded_config': dict(
+                    nova_config, **{'user.nova-lxd.instance-uuid': 'a'})},
+                {'name': 'instance-a-rescue', 'expanded_config': dict(
+                    nova_config, **{'user.nova-lxd.instance-uuid': 'a'})},
+                {'name': 'other', 'expanded_config': {}},
+            ]}
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+
+        self.assertEqual(['a'], lxd_driver.list_instance_uuids())
+        self.client.api.containers.get.assert_called_once_with(
+            params={'recursion': 1})
+
+    def test_list_instance_uuids_old_profile(self):
+        """Containers without a uuid in their profile cannot be listed."""
+        self.client.api.containers.get.return_value.json.return_value = {
+            'metadata': [
+                {'name': 'instance-a', 'expanded_config': {
+                    'environment.product_name': 'OpenStack Nova'}},
+            ]}
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+
+        self.assertRaises(
+            NotImplementedError, lxd_driver.list_instance_uuids)
+
+    @mock.patch('nova.virt.lxd.driver.objects.InstanceList.get_by_host')
+    def test_after_reboot(self, get_by_host):
+        """Only stopped instances are plugged."""
+        instances = []
+        for name, vm_state in (('instance-a', 'stopped'),
+                               ('instance-b', 'active')):
+            instance = mock.Mock(vm_state=vm_state)
+            instance.name = name
+            instances.append(instance)
+        get_by_host.return_value = instances
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver.plug_vifs = mock.Mock()
+        lxd_driver.network_api = mock.Mock()
+        network_info = lxd_driver.network_api.get_instance_nw_info.return_value
+
+        self.after_reboot_patcher.stop()
+        self.patchers.remove(self.after_reboot_patcher)
+        lxd_driver._after_reboot()
+
+        lxd_driver.plug_vifs.assert_called_once_with(
+            instances[0], network_info)
+
     def test_list_instances(self):
         self.client.containers.all.return_value = [
             MockContainer('mock-instance-1'),
             MockContainer('mock-instance-2'),
+            MockContainer('nova-lxd-warm-0123'),
         ]
         lxd_driver = driver.LXDDriver(None)
         lxd_driver.init_host(None)
@@ -220,9 +449,10 @@ class LXDDriverTest(test.NoDBTestCase):
 
         self.assertEqual(['mock-instance-1', 'mock-instance-2'], instances)
 
+    @mock.patch('nova.virt.lxd.driver.lxd_image.upload')
     @mock.patch('nova.virt.lxd.driver.IMAGE_API')
     @mock.patch('nova.virt.lxd.driver.lockutils.lock')
-    def test_spawn_unified_image(self, lock, IMAGE_API=None):
+    def test_spawn_unified_image(self, lock, IMAGE_API, upload):
         def image_get(*args, **kwargs):
             raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
         self.client.images.get_by_alias.side_effect = image_get
@@ -241,11 +471,158 @@ class LXDDriverTest(test.NoDBTestCase):
                           '4lVVopF28cZKp33elCWn2VpTjuWWy4e5L/2NmqcpX5Z91zdawD'\
                           'HqT/kHrf/E+Xo0Vrtu9fTn+QMAAAAAAAAAAAAAAADYrgfk/3zn'\
                           'ACgAAA=='
-            with closing(open(kwargs['dest_path'], 'wb+')) as img:
-                img.write(base64.b64decode(unified_tgz))
+            kwargs['data'].write(base64.b64decode(unified_tgz))
         IMAGE_API.download = download_unified
         self.test_spawn()
 
+        # The unified image is streamed to LXD without explicit metadata.
+        self.assertEqual(1, upload.call_count)
+        self.assertNotIn('metadata', upload.call_args[1])
+        upload.return_value.add_alias.assert_called_once_with(
+            self.client.images.get_by_alias.call_args[0][0], '')
+        self.image_cache.register.assert_called_once_with(
+            self.client.images.get_by_alias.call_args[0][0],
+            upload.return_value, checksum=None)
+
+    @mock.patch('nova.virt.lxd.driver.lxd_image.upload')
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    @mock.patch('nova.virt.lxd.driver.lockutils.lock')
+    def test_sync_glance_image_scheduled(self, lock, IMAGE_API, upload):
+        """The download runs inside a throttled transfer slot."""
+        self.client.images.get_by_alias.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        self.client.images.exists.return_value = False
+        IMAGE_API.get.return_value = {'disk_format': 'raw'}
+        transfers = mock.Mock()
+
+        def download(context, image_ref, data):
+            transfers.transfer.return_value.__enter__.assert_called_once_with()
+            data.write(b'image data')
+            transfers.throttle.assert_called_once_with(10)
+        IMAGE_API.download.side_effect = download
+        ctx = context.get_admin_context()
+
+        driver._sync_glance_image_to_lxd(
+            self.client, ctx, 'image-ref', self.image_cache, transfers)
+
+        transfers.transfer.assert_called_once_with('image-ref')
+        transfers.transfer.return_value.__exit__.assert_called_once_with(
+            None, None, None)
+
+    @mock.patch('nova.virt.lxd.driver.lxd_image.upload')
+    @mock.patch('nova.virt.lxd.driver.tempfile.mkstemp')
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    @mock.patch('nova.virt.lxd.driver.lockutils.lock')
+    def test_sync_glance_image_staging_dir(
+            self, lock, IMAGE_API, mkstemp, upload):
+        """Images are staged in image_staging_dir with an in memory
+        manifest.
+        """
+        staging_dir = self.useFixture(fixtures.TempDir()).path
+        self.CONF.lxd.image_staging_dir = staging_dir
+        mkstemp.side_effect = lambda dir: tempfile.mkstemp(dir=dir)
+        self.client.images.get_by_alias.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        self.client.images.exists.return_value = False
+        IMAGE_API.get.return_value = {'disk_format': 'raw', 'size': 10}
+        IMAGE_API.download.side_effect = (
+            lambda context, image_ref, data: data.write(b'image data'))
+        ctx = context.get_admin_context()
+
+        driver._sync_glance_image_to_lxd(
+            self.client, ctx, 'image-ref', self.image_cache, mock.Mock())
+
+        mkstemp.assert_called_once_with(dir=staging_dir)
+        self.assertEqual([], os.listdir(staging_dir))
+        manifest = tarfile.open(
+            fileobj=upload.call_args[1]['metadata'], mode='r:gz')
+        self.assertEqual(['metadata.yaml'], manifest.getnames())
+
+    @mock.patch('nova.virt.lxd.driver.lxd_image.free_space')
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    @mock.patch('nova.virt.lxd.driver.lockutils.lock')
+    def test_sync_glance_image_no_space(self, lock, IMAGE_API, free_space):
+        """Images that cannot fit in the staging dir are not downloaded."""
+        free_space.return_value = 1024
+        self.client.images.get_by_alias.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        self.client.images.exists.return_value = False
+        IMAGE_API.get.return_value = {'disk_format': 'raw', 'size': 4096}
+        ctx = context.get_admin_context()
+
+        self.assertRaises(
+            exception.ImageUnacceptable,
+            driver._sync_glance_image_to_lxd,
+            self.client, ctx, 'image-ref', self.image_cache, mock.Mock())
+        self.assertFalse(IMAGE_API.download.called)
+
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    @mock.patch('nova.virt.lxd.driver.lockutils.lock')
+    def test_sync_glance_image_known_sha256(self, lock, IMAGE_API):
+        """No download happens when glance knows the LXD fingerprint."""
+        self.client.images.get_by_alias.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        self.client.images.exists.return_value = True
+        IMAGE_API.get.return_value = {
+            'disk_format': 'raw', 'checksum': 'md5',
+            'os_hash_algo': 'sha256', 'os_hash_value': 'abcdef'}
+        ctx = context.get_admin_context()
+
+        image = driver._sync_glance_image_to_lxd(
+            self.client, ctx, 'image-ref', self.image_cache,
+            mock.Mock())
+
+        self.client.images.exists.assert_called_once_with('abcdef')
+        self.client.images.get.assert_called_once_with('abcdef')
+        self.assertEqual(self.client.images.get.return_value, image)
+        image.add_alias.assert_called_once_with('image-ref', '')
+        self.image_cache.register.assert_called_once_with(
+            'image-ref', image, checksum='md5')
+        self.assertFalse(IMAGE_API.download.called)
+
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    @mock.patch('nova.virt.lxd.driver.lockutils.lock')
+    def test_sync_glance_image_known_checksum(self, lock, IMAGE_API):
+        """No download happens when the checksum was imported before."""
+        self.client.images.get_by_alias.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        self.client.images.exists.return_value = True
+        self.image_cache.lookup.return_value = 'abcdef'
+        IMAGE_API.get.return_value = {'disk_format': 'raw', 'checksum': 'md5'}
+        ctx = context.get_admin_context()
+
+        driver._sync_glance_image_to_lxd(
+            self.client, ctx, 'image-ref', self.image_cache,
+            mock.Mock())
+
+        self.image_cache.lookup.assert_called_once_with('md5')
+        self.client.images.exists.assert_called_once_with('abcdef')
+        self.assertFalse(IMAGE_API.download.called)
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_cached_image(self, configdrive):
+        """Spawning from an image LXD already has marks it as used."""
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        configdrive.return_value = False
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0, image_ref='image-ref')
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), mock.Mock(), mock.Mock(), [_VIF],
+            mock.Mock())
+
+        self.client.images.get_by_alias.assert_called_once_with('image-ref')
+        self.image_cache.touch.assert_called_once_with('image-ref')
+        self.assertFalse(self.image_cache.register.called)
+
     @mock.patch('nova.virt.configdrive.required_by')
     def test_spawn(self, configdrive, neutron_failure=None):
         def container_get(*args, **kwargs):
@@ -284,6 +661,9 @@ class LXDDriverTest(test.NoDBTestCase):
         fd.apply_instance_filter.assert_called_once_with(
             instance, network_info)
         container.start.assert_called_once_with(wait=True)
+        self.assertEqual(
+            driver.flavor.instance_limits(instance),
+            lxd_driver.commitment._limits[instance.name])
 
     def test_spawn_already_exists(self):
         """InstanceExists is raised if the container already exists."""
@@ -344,6 +724,35 @@ class LXDDriverTest(test.NoDBTestCase):
         configdrive.assert_called_once_with(instance)
         lxd_driver.client.profiles.get.assert_called_once_with(instance.name)
 
+    @mock.patch('nova.virt.lxd.driver.storage.attach_ephemeral')
+    @mock.patch('nova.virt.configdrive.required_by', return_value=True)
+    def test_spawn_configdrive_after_ephemeral(self, configdrive,
+                                               attach_ephemeral):
+        """The steps which rewrite the profile do not overlap."""
+        self.client.containers.get.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        order = []
+
+        def ephemeral(*args):
+            eventlet.sleep(0.01)
+            order.append('ephemeral')
+        attach_ephemeral.side_effect = ephemeral
+
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        lxd_driver = driver.LXDDriver(
+            manager.ComputeVirtAPI(mock.MagicMock()))
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver._attach_configdrive = mock.Mock(
+            side_effect=lambda *args: order.append('configdrive'))
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), [], 'password', [_VIF], None)
+
+        self.assertEqual(['ephemeral', 'configdrive'], order)
+
     @mock.patch('nova.virt.configdrive.required_by')
     def test_spawn_profile_fail(self, configdrive, neutron_failure=None):
         """Cleanup is called when profile creation fails."""
@@ -444,6 +853,242 @@ class LXDDriverTest(test.NoDBTestCase):
         lxd_driver.cleanup.assert_called_once_with(
             ctx, instance, network_info, block_device_info)
 
+    @mock.patch('nova.virt.lxd.driver.utils.spawn_n')
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_warm_pool(self, configdrive, spawn_n):
+        """A container is claimed from the warm pool when possible."""
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        configdrive.return_value = False
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver.warm_pool = mock.Mock()
+        container = lxd_driver.warm_pool.claim.return_value
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), mock.Mock(), mock.Mock(),
+            [_VIF], mock.Mock())
+
+        lxd_driver.warm_pool.claim.assert_called_once_with(
+            self.client, instance.image_ref, instance.name,
+            self.client.profiles.create.return_value, config=None)
+        self.assertFalse(self.client.containers.create.called)
+        container.start.assert_called_once_with(wait=True)
+        spawn_n.assert_called_once_with(lxd_driver._refill_warm_pool)
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_clone_from_golden(self, configdrive):
+        """Containers are copied from a golden container when enabled."""
+        self.CONF.lxd.clone_from_golden = True
+
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        configdrive.return_value = False
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver.golden = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), mock.Mock(), mock.Mock(),
+            [_VIF], mock.Mock())
+
+        lxd_driver.golden.clone.assert_called_once_with(
+            self.client, instance.image_ref, instance.name,
+            self.client.profiles.create.return_value, config=None)
+        self.assertFalse(self.client.containers.create.called)
+        lxd_driver.golden.clone.return_value.start.assert_called_once_with(
+            wait=True)
+
+    @mock.patch('nova.virt.lxd.driver.instance_metadata.InstanceMetadata')
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_cloud_init_keys(self, configdrive, InstanceMetadata):
+        """Metadata is set on the container instead of a config drive."""
+        self.CONF.lxd.metadata_delivery = 'cloud-init'
+        InstanceMetadata.return_value.lookup.return_value = json.dumps(
+            {'uuid': 'fake-uuid', 'hostname': 'test'}).encode('utf-8')
+        InstanceMetadata.return_value.userdata_raw = None
+
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        configdrive.return_value = True
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0,
+            system_metadata={'image_lxd_nocloud': 'true'})
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver._add_configdrive = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), [], None,
+            [_VIF], mock.Mock())
+
+        config = self.client.containers.create.call_args[0][0]['config']
+        self.assertIn('instance-id: "fake-uuid"\n', config['user.meta-data'])
+        self.assertIn('user.network-config', config)
+        self.assertFalse(lxd_driver._add_configdrive.called)
+        InstanceMetadata.assert_called_once_with(
+            instance, network_info=[_VIF], request_context=ctx)
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_cloud_init_keys_unsupported(self, configdrive):
+        """Images which do not opt in to NoCloud get a config drive."""
+        self.CONF.lxd.metadata_delivery = 'cloud-init'
+        self.client.containers.get.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        configdrive.return_value = True
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0, system_metadata={})
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver._add_configdrive = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), [], None, [_VIF], mock.Mock())
+
+        self.assertNotIn(
+            'config', self.client.containers.create.call_args[0][0])
+        lxd_driver._add_configdrive.assert_called_once_with(
+            ctx, instance, [], None, [_VIF])
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_cloud_init_keys_injected_files(self, configdrive):
+        """Injected files still need a config drive."""
+        self.CONF.lxd.metadata_delivery = 'cloud-init'
+
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        configdrive.return_value = True
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        injected_files = [('/etc/motd', 'hello')]
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver._add_configdrive = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), injected_files, mock.Mock(),
+            [_VIF], mock.Mock())
+
+        self.assertNotIn(
+            'config', self.client.containers.create.call_args[0][0])
+        lxd_driver._add_configdrive.assert_called_once_with(
+            ctx, instance, injected_files, mock.ANY, [_VIF])
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_cloud_init_keys_admin_password(self, configdrive):
+        """The admin password still needs a config drive."""
+        self.CONF.lxd.metadata_delivery = 'cloud-init'
+        self.client.containers.get.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(404)))
+        configdrive.return_value = True
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver._add_configdrive = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), [], 'password', [_VIF], mock.Mock())
+
+        self.assertNotIn(
+            'config', self.client.containers.create.call_args[0][0])
+        lxd_driver._add_configdrive.assert_called_once_with(
+            ctx, instance, [], 'password', [_VIF])
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_start_fail_destroys(self, configdrive):
+        """A container that was created is destroyed when spawn fails."""
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        container = self.client.containers.create.return_value
+        container.start.side_effect = (
+            lxdcore_exceptions.LXDAPIException(MockResponse(500)))
+        configdrive.return_value = False
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        network_info = [_VIF]
+        block_device_info = mock.Mock()
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+        lxd_driver.cleanup = mock.Mock()
+        lxd_driver.destroy = mock.Mock()
+
+        self.assertRaises(
+            lxdcore_exceptions.LXDAPIException,
+            lxd_driver.spawn,
+            ctx, instance, mock.Mock(), mock.Mock(), mock.Mock(),
+            network_info, block_device_info)
+        lxd_driver.destroy.assert_called_once_with(
+            ctx, instance, network_info, block_device_info)
+        self.assertFalse(lxd_driver.cleanup.called)
+
+    @mock.patch('nova.virt.configdrive.required_by')
+    def test_spawn_creates_container_while_plugging(self, configdrive):
+        """The container is created without waiting for the network."""
+        def container_get(*args, **kwargs):
+            raise lxdcore_exceptions.LXDAPIException(MockResponse(404))
+        self.client.containers.get.side_effect = container_get
+        created = eventlet.event.Event()
+        self.client.containers.create.side_effect = (
+            lambda *args, **kwargs: created.send(mock.Mock()))
+
+        def plug(*args):
+            with eventlet.Timeout(5, AssertionError('not created')):
+                created.wait()
+        self.vif_driver.plug.side_effect = plug
+        configdrive.return_value = False
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+        virtapi = manager.ComputeVirtAPI(mock.MagicMock())
+
+        lxd_driver = driver.LXDDriver(virtapi)
+        lxd_driver.init_host(None)
+        lxd_driver.firewall_driver = mock.Mock()
+
+        lxd_driver.spawn(
+            ctx, instance, mock.Mock(), mock.Mock(), mock.Mock(),
+            [_VIF], mock.Mock())
+
+        self.vif_driver.plug.assert_called_once_with(instance, _VIF)
+
     def _test_spawn_instance_with_network_events(self, neutron_failure=None):
         generated_events = []
 
@@ -559,17 +1204,88 @@ class LXDDriverTest(test.NoDBTestCase):
         lxd_driver.cleanup.assert_called_once_with(
             ctx, instance, network_info, None)
 
+    @mock.patch('nova.virt.lxd.driver.fileutils', fileutils)
+    @mock.patch.object(driver, 'privsep')
+    @mock.patch('nova.virt.lxd.driver.instance_metadata.InstanceMetadata')
+    def test_add_configdrive_direct(self, InstanceMetadata, privsep):
+        """The config drive is written without root commands."""
+        self.CONF.lxd.config_drive_direct = True
+        self.CONF2.instances_path = self.useFixture(fixtures.TempDir()).path
+        inst_md = InstanceMetadata.return_value
+        inst_md.metadata_for_config_drive.return_value = [
+            ('openstack/latest/meta_data.json', u'{"uuid": "x"}'),
+            ('ec2/latest/user-data', b'#!/bin/sh\n'),
+        ]
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        configdrive_dir = lxd_driver._add_configdrive(
+            ctx, instance, [], 'password', [_VIF])
+
+        self.assertEqual(
+            os.path.join(
+                self.CONF2.instances_path, instance.name, 'configdrive'),
+            configdrive_dir)
+        InstanceMetadata.assert_called_once_with(
+            instance, content=[], extra_md={'admin_pass': 'password'},
+            network_info=[_VIF], request_context=ctx)
+        meta_data = os.path.join(
+            configdrive_dir, 'openstack', 'latest', 'meta_data.json')
+        with open(meta_data, 'rb') as f:
+            self.assertEqual(b'{"uuid": "x"}', f.read())
+        self.assertEqual(0o644, os.stat(meta_data).st_mode & 0o777)
+        self.assertEqual(
+            0o755, os.stat(os.path.join(configdrive_dir, 'ec2')).st_mode &
+            0o777)
+        self.assertEqual([], privsep.method_calls)
+        self.assertFalse(self.client.containers.get.called)
+
+    @mock.patch('shutil.copytree')
+    @mock.patch('os.listdir', return_value=['ec2', 'openstack'])
+    @mock.patch.object(driver.utils, 'tempdir')
+    @mock.patch.object(driver, 'privsep')
+    @mock.patch('nova.virt.lxd.driver.configdrive.ConfigDriveBuilder')
+    @mock.patch('nova.virt.lxd.driver.instance_metadata.InstanceMetadata')
+    def test_add_configdrive_iso(self, InstanceMetadata, ConfigDriveBuilder,
+                                 privsep, tempdir, listdir, copytree):
+        """The ISO contents are copied out and chowned once."""
+        container = self.client.containers.get.return_value
+        container.config = {
+            'volatile.last_state.idmap':
+                '[{"Isuid":true,"Isgid":false,"Hostid":100000,'
+                '"Nsid":0,"Maprange":65536}]'}
+        tempdir.return_value.__enter__.return_value = '/tmp/iso'
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        configdrive_dir = lxd_driver._add_configdrive(
+            ctx, instance, [], None, [_VIF])
+
+        self.assertEqual(2, copytree.call_count)
+        self.assertEqual([
+            mock.call.mount(
+                mock.ANY, '/tmp/iso',
+                options='loop,uid=%d,gid=%d' % (os.getuid(), os.getgid())),
+            mock.call.chmod(configdrive_dir, 0o775, recursive=True),
+            mock.call.chown(configdrive_dir, uid=100000, recursive=True),
+            mock.call.umount('/tmp/iso'),
+        ], privsep.method_calls)
+
     @mock.patch('nova.virt.lxd.driver.network')
     @mock.patch('os.path.exists', mock.Mock(return_value=True))
-    @mock.patch('pwd.getpwuid')
+    @mock.patch('os.getgid', mock.Mock(return_value=1234))
+    @mock.patch('os.getuid', mock.Mock(return_value=1234))
     @mock.patch('shutil.rmtree')
-    @mock.patch.object(driver.utils, 'execute')
-    def test_cleanup(self, execute, rmtree, getpwuid, _):
+    @mock.patch.object(driver, 'privsep')
+    def test_cleanup(self, privsep, rmtree, _):
         mock_profile = mock.Mock()
         self.client.profiles.get.return_value = mock_profile
-        pwuid = mock.Mock()
-        pwuid.pw_name = 'user'
-        getpwuid.return_value = pwuid
 
         ctx = context.get_admin_context()
         instance = fake_instance.fake_instance_obj(
@@ -588,8 +1304,8 @@ class LXDDriverTest(test.NoDBTestCase):
             instance, network_info[0])
         lxd_driver.firewall_driver.unfilter_instance.assert_called_once_with(
             instance, network_info)
-        execute.assert_called_once_with(
-            'chown', '-R', 'user:user', instance_dir, run_as_root=True)
+        privsep.chown.assert_called_once_with(
+            instance_dir, 1234, 1234, recursive=True)
         rmtree.assert_called_once_with(instance_dir)
         mock_profile.delete.assert_called_once_with()
 
@@ -606,24 +1322,21 @@ class LXDDriverTest(test.NoDBTestCase):
         self.client.containers.get.assert_called_once_with(instance.name)
 
     @mock.patch('nova.virt.lxd.driver.network')
-    @mock.patch('pwd.getpwuid', mock.Mock(return_value=mock.Mock(pw_uid=1234)))
-    @mock.patch('os.getuid', mock.Mock())
+    @mock.patch('os.getgid', mock.Mock(return_value=1234))
+    @mock.patch('os.getuid', mock.Mock(return_value=1234))
     @mock.patch('os.path.exists', mock.Mock(return_value=True))
     @mock.patch('six.moves.builtins.open')
-    @mock.patch.object(driver.utils, 'execute')
-    def test_get_console_output(self, execute, _open, _):
+    @mock.patch.object(driver, 'privsep')
+    def test_get_console_output(self, privsep, _open, _):
         ctx = context.get_admin_context()
         instance = fake_instance.fake_instance_obj(
             ctx, name='test', memory_mb=0)
         expected_calls = [
-            mock.call(
-                'chown', '1234:1234', '/var/log/lxd/{}/console.log'.format(
-                    instance.name),
-                run_as_root=True),
-            mock.call(
-                'chmod', '755', '/lxd/containers/{}'.format(
-                    instance.name),
-                run_as_root=True),
+            mock.call.chown(
+                '/var/log/lxd/{}/console.log'.format(instance.name),
+                1234, 1234),
+            mock.call.chmod(
+                '/lxd/containers/{}'.format(instance.name), 0o755),
         ]
         _open.return_value.__enter__.return_value = six.BytesIO(b'output')
 
@@ -632,7 +1345,7 @@ class LXDDriverTest(test.NoDBTestCase):
         contents = lxd_driver.get_console_output(context, instance)
 
         self.assertEqual(b'output', contents)
-        self.assertEqual(expected_calls, execute.call_args_list)
+        self.assertEqual(expected_calls, privsep.method_calls)
 
     def test_get_host_ip_addr(self):
         lxd_driver = driver.LXDDriver(None)
@@ -1092,7 +1805,7 @@ class LXDDriverTest(test.NoDBTestCase):
             'local_gb': 1000,
             'local_gb_used': 500,
             'memory_mb': 10000,
-            'memory_mb_used': 8000,
+            'memory_mb_used': 512,
             'numa_topology': None,
             'supported_instances': [
                 ('i686', 'lxd', 'exe'),
@@ -1100,7 +1813,7 @@ class LXDDriverTest(test.NoDBTestCase):
                 ('i686', 'lxc', 'exe'),
                 ('x86_64', 'lxc', 'exe')],
             'vcpus': 200,
-            'vcpus_used': 0}
+            'vcpus_used': 2}
 
         execute.return_value = (
             'Model name:          Fake CPU\n'
@@ -1131,6 +1844,14 @@ class LXDDriverTest(test.NoDBTestCase):
         lxd_driver = driver.LXDDriver(None)
         lxd_driver.client = mock.MagicMock()
         lxd_driver.client.host_info = lxd_config
+        profiles = lxd_driver.client.api.profiles.get.return_value
+        profiles.json.return_value = {'metadata': [
+            {'name': 'default', 'config': {}},
+            {'name': 'instance-a',
+             'config': {'environment.product_name': 'OpenStack Nova',
+                        'limits.cpu': '2',
+                        'limits.memory': '512MB'}},
+        ]}
         value = lxd_driver.get_available_resource(None)
         # This is funky, but json strings make for fragile tests.
         value['cpu_info'] = json.loads(value['cpu_info'])
@@ -1139,8 +1860,10 @@ class LXDDriverTest(test.NoDBTestCase):
 
     @mock.patch('socket.gethostname', mock.Mock(return_value='fake_hostname'))
     @mock.patch('nova.virt.lxd.driver.open')
+    @mock.patch.object(driver.privsep, 'zpool_attribute')
     @mock.patch.object(driver.utils, 'execute')
-    def test_get_available_resource_zfs(self, execute, open):
+    def test_get_available_resource_zfs(self, execute, zpool_attribute,
+                                        open):
         expected = {
             'cpu_info': {
                 "features": "fake flag goes here",
@@ -1154,7 +1877,7 @@ class LXDDriverTest(test.NoDBTestCase):
             'local_gb': 2222,
             'local_gb_used': 200,
             'memory_mb': 10000,
-            'memory_mb_used': 8000,
+            'memory_mb_used': 0,
             'numa_topology': None,
             'supported_instances': [
                 ('i686', 'lxd', 'exe'),
@@ -1171,6 +1894,8 @@ class LXDDriverTest(test.NoDBTestCase):
              'Core(s) per socket:  5\n'
              'Thread(s) per core:  4\n\n',
              None),
+        ]
+        zpool_attribute.side_effect = [
             ('2.17T\n', None),
             ('200.4G\n', None),
             ('1.8T\n', None)
@@ -1200,12 +1925,57 @@ class LXDDriverTest(test.NoDBTestCase):
         lxd_driver = driver.LXDDriver(None)
         lxd_driver.client = mock.MagicMock()
         lxd_driver.client.host_info = lxd_config
+        profiles = lxd_driver.client.api.profiles.get.return_value
+        profiles.json.return_value = {'metadata': []}
         value = lxd_driver.get_available_resource(None)
         # This is funky, but json strings make for fragile tests.
         value['cpu_info'] = json.loads(value['cpu_info'])
 
         self.assertEqual(expected, value)
 
+    def test_get_local_disk_info_storage_pool(self):
+        """The configured pool is read from the storage pool API."""
+        self.CONF.lxd.pool = 'ceph'
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.client = mock.MagicMock()
+        lxd_driver.client.host_info = {
+            'api_extensions': ['storage'],
+            'environment': {'storage': 'zfs'},
+            'config': {},
+        }
+        pools = lxd_driver.client.api.__getitem__.return_value
+        pool = pools.__getitem__.return_value
+        pool.resources.get.return_value.json.return_value = {
+            'metadata': {'space': {'total': 3 * units.Gi,
+                                   'used': units.Gi}}}
+
+        info = lxd_driver._get_local_disk_info()
+
+        self.assertEqual(
+            {'total': 3 * units.Gi, 'used': units.Gi,
+             'available': 2 * units.Gi}, info)
+        lxd_driver.client.api.__getitem__.assert_called_once_with(
+            'storage-pools')
+        pools.__getitem__.assert_called_once_with('ceph')
+
+    def test_get_storage_pool_info_all_pools(self):
+        """Without a configured pool, every pool is added up."""
+        client = mock.MagicMock()
+        pools = client.api.__getitem__.return_value
+        pools.get.return_value.json.return_value = {
+            'metadata': ['/1.0/storage-pools/a', '/1.0/storage-pools/b']}
+        pool = pools.__getitem__.return_value
+        pool.resources.get.return_value.json.return_value = {
+            'metadata': {'space': {'total': 100, 'used': 10}}}
+
+        info = driver._get_storage_pool_info(client)
+
+        self.assertEqual(
+            {'total': 200, 'used': 20, 'available': 180}, info)
+        self.assertEqual(
+            [mock.call('a'), mock.call('b')],
+            pools.__getitem__.call_args_list)
+
     def test_refresh_instance_security_rules(self):
         ctx = context.get_admin_context()
         instance = fake_instance.fake_instance_obj(
@@ -1300,6 +2070,25 @@ class LXDDriverTest(test.NoDBTestCase):
         result = lxd_driver.get_host_cpu_stats()
 
         self.assertEqual(expected, result)
+        cpu_times.assert_called_once_with()
+
+    @mock.patch('nova.virt.lxd.driver.psutil.cpu_times')
+    @mock.patch('nova.virt.lxd.driver.open')
+    @mock.patch.object(driver.utils, 'execute')
+    def test_get_host_cpu_stats_sampled(self, execute, open, cpu_times):
+        """lscpu is only run once, and cpu times once per interval."""
+        self.CONF.lxd.host_sample_interval = 30
+        cpu_times.return_value = [1, 0, 2, 3, 4]
+        execute.return_value = ('CPU MHz: 1000\n', None)
+        open.return_value = six.moves.cStringIO('flags: fake\n')
+
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.get_host_cpu_stats()
+        result = lxd_driver.get_host_cpu_stats()
+
+        self.assertEqual('1000', result['frequency'])
+        execute.assert_called_once_with('lscpu')
+        cpu_times.assert_called_once_with()
 
     def test_get_volume_connector(self):
         expected = {
@@ -1328,6 +2117,84 @@ class LXDDriverTest(test.NoDBTestCase):
 
         self.assertEqual(expected, result)
 
+    def test_manage_image_cache(self):
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0)
+
+        lxd_driver = driver.LXDDriver(None)
+        lxd_driver.init_host(None)
+        lxd_driver.manage_image_cache(ctx, [instance])
+
+        self.image_cache.update.assert_called_once_with(
+            self.client, [instance])
+
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    def test_manage_image_cache_warm_pool(self, IMAGE_API):
+        """The warm pool is refilled before images are evicted."""
+        self.CONF.lxd.warm_pool = {'image-a': '1'}
+        ctx = context.get_admin_context()
+
+        lxd_driver = driver.LXDDriver(None)
+        with mock.patch('nova.virt.lxd.driver.utils.spawn_n'):
+            lxd_driver.init_host(None)
+        lxd_driver.warm_pool = mock.Mock()
+        calls = mock.Mock()
+        calls.attach_mock(lxd_driver.warm_pool.refill, 'refill')
+        calls.attach_mock(self.image_cache.update, 'update')
+
+        lxd_driver.manage_image_cache(ctx, [])
+
+        self.assertEqual(
+            ['refill', 'update'], [c[0] for c in calls.mock_calls])
+        ensure_image = lxd_driver.warm_pool.refill.call_args[0][1]
+        ensure_image('image-a')
+        IMAGE_API.get.assert_called_once_with(mock.ANY, 'image-a')
+        self.client.images.get_by_alias.assert_called_once_with('image-a')
+
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    def test_refill_warm_pool_glance_lookups(self, IMAGE_API):
+        """Glance is asked about a pooled image once until a recheck."""
+        self.CONF.lxd.warm_pool = {'image-a': '1'}
+
+        lxd_driver = driver.LXDDriver(None)
+        with mock.patch('nova.virt.lxd.driver.utils.spawn_n'):
+            lxd_driver.init_host(None)
+        lxd_driver.warm_pool = mock.Mock()
+
+        def refill(recheck=False):
+            lxd_driver._refill_warm_pool(recheck=recheck)
+            ensure_image = lxd_driver.warm_pool.refill.call_args[0][1]
+            ensure_image('image-a')
+
+        refill()
+        refill()
+        self.assertEqual(1, IMAGE_API.get.call_count)
+        self.assertEqual(2, self.client.images.get_by_alias.call_count)
+
+        refill(recheck=True)
+        self.assertEqual(2, IMAGE_API.get.call_count)
+
+    @mock.patch('nova.virt.lxd.driver.IMAGE_API')
+    def test_refill_warm_pool_image_deleted(self, IMAGE_API):
+        """An image missing from glance is looked up again."""
+        self.CONF.lxd.warm_pool = {'image-a': '1'}
+        IMAGE_API.get.side_effect = exception.ImageNotFound(
+            image_id='image-a')
+
+        lxd_driver = driver.LXDDriver(None)
+        with mock.patch('nova.virt.lxd.driver.utils.spawn_n'):
+            lxd_driver.init_host(None)
+        lxd_driver.warm_pool = mock.Mock()
+
+        for _ in range(2):
+            lxd_driver._refill_warm_pool()
+            ensure_image = lxd_driver.warm_pool.refill.call_args[0][1]
+            self.assertRaises(
+                exception.ImageNotFound, ensure_image, 'image-a')
+        self.assertEqual(2, IMAGE_API.get.call_count)
+        self.assertFalse(self.client.images.get_by_alias.called)
+
     @mock.patch('nova.virt.lxd.driver.IMAGE_API')
     @mock.patch('nova.virt.lxd.driver.lockutils.lock')
     def test_snapshot(self, lock, IMAGE_API):
@@ -1366,6 +2233,10 @@ class LXDDriverTest(test.NoDBTestCase):
                 'disk_format': 'raw',
                 'container_format': 'bare'},
             data)
+        image.add_alias.assert_called_once_with(image_id, '')
+        self.image_cache.register.assert_called_once_with(
+            image_id, image,
+            checksum=IMAGE_API.update.return_value.get.return_value)
 
     def test_finish_revert_migration(self):
         ctx = context.get_admin_context()
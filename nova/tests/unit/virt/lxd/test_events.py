@@ -0,0 +1,450 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import eventlet
+import mock
+from nova import exception
+from nova import test
+from nova.virt import event as virtevent
+from pylxd import exceptions as lxdcore_exceptions
+
+from nova.virt.lxd import events
+
+
+def _operation_event(*names):
+    return {
+        'type': 'operation',
+        'metadata': {
+            'status_code': 200,
+            'resources': {
+                'containers': ['/1.0/containers/' + n for n in names]},
+        },
+    }
+
+
+class ContainerNamesTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.events.container_names."""
+
+    def test_operation(self):
+        event = _operation_event('a', 'a/snapshots/snap0', 'b')
+
+        self.assertEqual(['a', 'b'], events.container_names(event))
+
+    def test_lifecycle(self):
+        event = {'type': 'lifecycle',
+                 'metadata': {'action': 'container-stopped',
+                              'source': '/1.0/containers/a'}}
+
+        self.assertEqual(['a'], events.container_names(event))
+
+    def test_logging(self):
+        event = {'type': 'logging', 'metadata': {'message': 'hello'}}
+
+        self.assertEqual([], events.container_names(event))
+
+
+class StateCacheTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.events.StateCache."""
+
+    def setUp(self):
+        super(StateCacheTest, self).setUp()
+        self.client = mock.MagicMock()
+        self.client.api.containers.get.return_value.json.return_value = {
+            'metadata': [
+                {'name': 'instance-a', 'expanded_config': {'a': 'b'}},
+                {'name': 'nova-lxd-warm-1', 'expanded_config': {}},
+            ]}
+        state = self.client.api.containers.__getitem__.return_value.state
+        state.get.return_value.json.return_value = {
+            'metadata': {'status_code': 103, 'memory': {'usage': 1}}}
+
+        self.cache = events.StateCache()
+
+    def test_get_not_synced(self):
+        container = self.client.containers.get.return_value
+        container.state.return_value = mock.Mock(
+            status_code=102, memory={'usage': 2})
+
+        state = self.cache.get(self.client, 'instance-a')
+
+        self.assertEqual(102, state.status_code)
+        self.assertEqual(container.expanded_config, state.expanded_config)
+        self.assertEqual({}, self.cache._states)
+
+    def test_resync(self):
+        self.cache.resync(self.client)
+
+        self.assertTrue(self.cache.synced)
+        self.assertEqual(
+            events.CachedState(103, {'usage': 1}, {'a': 'b'}),
+            self.cache.get(self.client, 'instance-a'))
+        self.assertEqual(
+            ['instance-a', 'nova-lxd-warm-1'],
+            sorted(self.cache.names(self.client)))
+        self.assertFalse(self.client.containers.get.called)
+        self.assertFalse(self.client.containers.all.called)
+
+    def test_handle(self):
+        self.cache.resync(self.client)
+        container = self.client.containers.get.return_value
+        container.state.return_value = mock.Mock(
+            status_code=102, memory={'usage': 2})
+
+        self.cache.handle(self.client, _operation_event('instance-a'))
+
+        self.client.containers.get.assert_called_once_with('instance-a')
+        self.assertEqual(
+            102, self.cache.get(self.client, 'instance-a').status_code)
+
+    def test_handle_running_operation(self):
+        """Operations still running are not fetched again."""
+        self.cache.resync(self.client)
+        event = _operation_event('instance-a')
+        event['metadata']['status_code'] = events.RUNNING
+
+        self.cache.handle(self.client, event)
+
+        self.assertFalse(self.client.containers.get.called)
+
+    def test_handle_lifecycle(self):
+        self.cache.resync(self.client)
+
+        self.cache.handle(self.client, {
+            'type': 'lifecycle',
+            'metadata': {'source': '/1.0/containers/instance-a'}})
+
+        self.client.containers.get.assert_called_once_with('instance-a')
+
+    def test_handle_deleted(self):
+        self.cache.resync(self.client)
+        self.client.containers.get.side_effect = (
+            lxdcore_exceptions.NotFound(mock.Mock(status_code=404)))
+
+        self.cache.handle(self.client, _operation_event('instance-a'))
+
+        self.assertEqual(
+            ['nova-lxd-warm-1'], self.cache.names(self.client))
+
+    def test_invalidate(self):
+        self.cache.resync(self.client)
+        container = self.client.containers.get.return_value
+        container.state.return_value = mock.Mock(
+            status_code=102, memory={'usage': 2})
+
+        self.cache.invalidate('instance-a')
+
+        self.assertEqual(
+            102, self.cache.get(self.client, 'instance-a').status_code)
+        self.client.containers.get.assert_called_once_with('instance-a')
+
+    def test_invalidate_during_fetch(self):
+        """A fetch which raced with an invalidation is not cached."""
+        self.cache.resync(self.client)
+
+        def state():
+            self.cache.invalidate('instance-a')
+            return mock.Mock(status_code=102, memory={})
+        self.client.containers.get.return_value.state.side_effect = state
+
+        self.cache.handle(self.client, _operation_event('instance-a'))
+
+        self.assertIsNone(self.cache._states['instance-a'])
+
+    def test_invalidate_not_synced(self):
+        """Nothing is kept for containers invalidated while not synced."""
+        self.cache.invalidate('instance-a')
+        self.cache.invalidate('instance-b', exists=False)
+
+        self.assertEqual({}, self.cache._states)
+        self.assertEqual(0, self.cache._generation)
+
+    def test_invalidate_deleted(self):
+        self.cache.resync(self.client)
+
+        self.cache.invalidate('instance-a', exists=False)
+
+        self.assertEqual(
+            ['nova-lxd-warm-1'], self.cache.names(self.client))
+
+    def test_invalidate_during_resync(self):
+        """What is invalidated while the listing is fetched is kept."""
+        listing = self.client.api.containers.get.return_value.json
+        containers = listing.return_value
+
+        def json():
+            self.cache.invalidate('instance-a')
+            self.cache.invalidate('nova-lxd-warm-1', exists=False)
+            return containers
+        listing.side_effect = json
+
+        self.cache.resync(self.client)
+
+        self.assertEqual({'instance-a': None}, self.cache._states)
+        self.assertIsNone(self.cache._invalidated)
+
+    def test_observer(self):
+        self.cache.resync(self.client)
+        observer = mock.Mock()
+        self.cache.add_observer(observer)
+        container = self.client.containers.get.return_value
+        container.state.return_value = mock.Mock(
+            status_code=102, memory={'usage': 2})
+
+        self.cache.handle(self.client, _operation_event('instance-a'))
+
+        observer.assert_called_once_with(
+            'instance-a', events.CachedState(103, {'usage': 1}, {'a': 'b'}),
+            events.CachedState(102, {'usage': 2}, container.expanded_config))
+
+    def test_lost(self):
+        self.cache.resync(self.client)
+
+        self.cache.lost()
+
+        self.assertFalse(self.cache.synced)
+        self.cache.names(self.client)
+        self.client.containers.all.assert_called_once_with()
+
+
+class EventListenerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.events.EventListener."""
+
+    def test_run(self):
+        client = mock.Mock()
+        websocket = client.events.return_value
+        handler = mock.Mock()
+        listener = events.EventListener()
+        listener.add_handler(handler)
+        listener._client = client
+        listener._stopped = False
+
+        def run():
+            websocket.listener._connected()
+            websocket.listener._received({'type': 'logging'})
+            listener.stop()
+        websocket.run.side_effect = run
+
+        listener._run()
+
+        client.events.assert_called_once_with(
+            websocket_client=events._EventsClient)
+        websocket.connect.assert_called_once_with()
+        handler.resync.assert_called_once_with(client)
+        handler.handle.assert_called_once_with(client, {'type': 'logging'})
+        handler.lost.assert_called_once_with()
+        websocket.close.assert_called_once_with()
+
+    @mock.patch('eventlet.sleep')
+    def test_run_reconnects(self, sleep):
+        client = mock.Mock()
+        listener = events.EventListener()
+        listener._client = client
+        listener._stopped = False
+        client.events.return_value.connect.side_effect = [
+            IOError('refused'), None]
+        client.events.return_value.run.side_effect = listener.stop
+
+        listener._run()
+
+        self.assertEqual(2, client.events.call_count)
+        sleep.assert_called_once_with(events.RECONNECT_INTERVAL)
+
+
+class LifecycleTransitionTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.events.lifecycle_transition."""
+
+    def _transition(self, old, new):
+        return events.lifecycle_transition(
+            old and events.CachedState(old, {}, {}),
+            new and events.CachedState(new, {}, {}))
+
+    def test_transitions(self):
+        self.assertEqual(virtevent.EVENT_LIFECYCLE_STARTED,
+                         self._transition(events.STOPPED, events.RUNNING))
+        self.assertEqual(virtevent.EVENT_LIFECYCLE_STOPPED,
+                         self._transition(events.RUNNING, events.STOPPED))
+        self.assertEqual(virtevent.EVENT_LIFECYCLE_PAUSED,
+                         self._transition(events.RUNNING, events.FROZEN))
+        self.assertEqual(virtevent.EVENT_LIFECYCLE_RESUMED,
+                         self._transition(events.FROZEN, events.RUNNING))
+
+    def test_deleted(self):
+        self.assertEqual(virtevent.EVENT_LIFECYCLE_STOPPED,
+                         self._transition(events.RUNNING, None))
+        self.assertIsNone(self._transition(events.STOPPED, None))
+
+    def test_no_change(self):
+        self.assertIsNone(self._transition(events.RUNNING, events.RUNNING))
+        self.assertIsNone(self._transition(None, events.RUNNING))
+
+
+class LifecycleEmitterTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.events.LifecycleEmitter."""
+
+    def setUp(self):
+        super(LifecycleEmitterTest, self).setUp()
+        self.emit = mock.Mock()
+        self.uuids = {'instance-a': 'uuid-a'}
+        self.emitter = events.LifecycleEmitter(
+            self.emit, self.uuids.get, delay=0, maxsize=1)
+        self.running = events.CachedState(events.RUNNING, {}, {})
+        self.stopped = events.CachedState(events.STOPPED, {}, {})
+
+    def _drain(self):
+        eventlet.sleep(0)
+        while not self.emitter._queue.empty():
+            self.emitter._emit_one(*self.emitter._queue.get())
+
+    def test_emit(self):
+        self.emitter.changed('instance-a', self.running, self.stopped)
+        self._drain()
+
+        self.emit.assert_called_once_with(virtevent.LifecycleEvent(
+            'uuid-a', virtevent.EVENT_LIFECYCLE_STOPPED))
+
+    def test_debounce(self):
+        self.emitter._delay = 60
+        self.emitter.changed('instance-a', self.running, self.stopped)
+        self.emitter.changed('instance-a', self.stopped, self.running)
+
+        self.assertEqual(1, len(self.emitter._timers))
+        self.emitter.stop()
+
+    def test_queue_full(self):
+        self.uuids['instance-b'] = 'uuid-b'
+        self.emitter.changed('instance-a', self.running, self.stopped)
+        self.emitter.changed('instance-b', self.running, self.stopped)
+        self._drain()
+
+        self.assertEqual(1, self.emit.call_count)
+
+    def test_unknown_instance(self):
+        self.emitter.changed('instance-c', self.running, self.stopped)
+        self.emitter.changed(
+            'nova-lxd-warm-1', self.running, self.stopped)
+        self._drain()
+
+        self.assertFalse(self.emit.called)
+
+
+class OperationTrackerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.events.OperationTracker."""
+
+    def setUp(self):
+        super(OperationTrackerTest, self).setUp()
+        self.client = mock.MagicMock()
+        self.api = self.client.api.operations.__getitem__.return_value
+        self.running = {'id': 'op', 'status_code': 103,
+                        'description': 'Starting container',
+                        'may_cancel': True}
+        self.done = dict(self.running, status_code=200,
+                         metadata={'fingerprint': 'abc'})
+        self.api.get.return_value.json.return_value = {
+            'metadata': self.running}
+        self.tracker = events.OperationTracker(
+            {'Starting container': '30'}, default_timeout=-1)
+
+    def test_wait_not_connected(self):
+        self.api.wait.get.return_value.json.return_value = {
+            'metadata': self.done}
+
+        operation = self.tracker.wait(self.client, '/1.0/operations/op')
+
+        self.assertEqual({'fingerprint': 'abc'}, operation.metadata)
+        self.client.api.operations.__getitem__.assert_called_with('op')
+        self.api.wait.get.assert_called_once_with(params={'timeout': 30})
+
+    def test_wait_not_connected_timeout(self):
+        self.api.wait.get.return_value.json.return_value = {
+            'metadata': self.running}
+
+        self.assertRaises(exception.NovaException,
+                          self.tracker.wait, self.client, 'op')
+        self.api.delete.assert_called_once_with()
+
+    def test_wait_failed(self):
+        self.api.get.return_value.json.return_value = {
+            'metadata': dict(self.running, status_code=400, err='broken')}
+        self.api.get.return_value.status_code = 200
+
+        e = self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                              self.tracker.wait, self.client, 'op')
+        self.assertEqual('broken', str(e))
+        self.assertEqual(200, e.response.status_code)
+
+    def test_wait_event_failed(self):
+        """A failed operation is not fetched again, LXD may prune it."""
+        self.tracker.resync(self.client)
+        waiter = eventlet.spawn(self.tracker.wait, self.client, 'op')
+        eventlet.sleep(0)
+        self.api.get.side_effect = lxdcore_exceptions.NotFound(
+            mock.Mock(status_code=404))
+
+        self.tracker.handle(self.client, {
+            'type': 'operation',
+            'metadata': dict(self.running, status_code=400, err='broken')})
+
+        e = self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                              waiter.wait)
+        self.assertEqual('broken', str(e))
+        self.assertEqual(1, self.api.get.call_count)
+
+    def test_wait_event(self):
+        self.tracker.resync(self.client)
+        waiter = eventlet.spawn(self.tracker.wait, self.client, 'op')
+        eventlet.sleep(0)
+
+        self.tracker.handle(
+            self.client, {'type': 'operation', 'metadata': self.done})
+
+        self.assertEqual({'fingerprint': 'abc'}, waiter.wait().metadata)
+        self.assertFalse(self.api.wait.get.called)
+        self.assertEqual({}, self.tracker._waiters)
+
+    def test_wait_event_timeout(self):
+        self.tracker._timeouts = {'starting container': 0.01}
+        self.tracker.resync(self.client)
+
+        self.assertRaises(exception.NovaException,
+                          self.tracker.wait, self.client, 'op')
+        self.api.delete.assert_called_once_with()
+        self.assertEqual({}, self.tracker._waiters)
+
+    def test_wait_event_lost(self):
+        """Waiters fall back to the wait API when the stream is lost."""
+        self.tracker.resync(self.client)
+        self.api.wait.get.return_value.json.return_value = {
+            'metadata': self.done}
+        waiter = eventlet.spawn(self.tracker.wait, self.client, 'op')
+        eventlet.sleep(0)
+
+        self.tracker.lost()
+
+        self.assertEqual({'fingerprint': 'abc'}, waiter.wait().metadata)
+        self.api.wait.get.assert_called_once_with(params={'timeout': 30})
+
+    def test_no_deadline(self):
+        tracker = events.OperationTracker()
+
+        self.assertIsNone(tracker._timeout(self.running))
+        self.assertEqual(30, self.tracker._timeout(self.running))
+
+    def test_tracked_operations(self):
+        self.api.get.return_value.json.return_value = {'metadata': self.done}
+        operations = events.TrackedOperations(self.client, self.tracker)
+
+        operation = operations.wait_for_operation('/1.0/operations/op')
+
+        self.assertEqual('op', operation.id)
+        self.assertIs(self.client.operations.get, operations.get)
@@ -0,0 +1,364 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import time
+
+import eventlet
+import fixtures
+import mock
+from nova import context
+from nova import exception
+from nova import test
+from nova.compute import power_state
+from nova.tests.unit import fake_instance
+import pylxd
+from pylxd import exceptions as lxdcore_exceptions
+
+from nova.tests.unit.virt.lxd import fake_lxd
+from nova.virt.lxd import driver
+from nova.virt.lxd import events
+
+
+class _Recorder(object):
+    """An events handler keeping what it is handed."""
+
+    def __init__(self):
+        self.connected = False
+        self.events = []
+
+    def resync(self, client):
+        self.connected = True
+
+    def handle(self, client, event):
+        self.events.append(event)
+
+    def lost(self):
+        self.connected = False
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        eventlet.sleep(0.01)
+
+
+class FakeLXDTest(test.NoDBTestCase):
+    """Tests for nova.tests.unit.virt.lxd.fake_lxd.FakeLXD."""
+
+    def setUp(self):
+        super(FakeLXDTest, self).setUp()
+        self.lxd = self.useFixture(fake_lxd.FakeLXDFixture()).lxd
+        self.client = pylxd.Client()
+        self.tracker = events.OperationTracker()
+        self.client.operations = events.TrackedOperations(
+            self.client, self.tracker)
+        self.lxd.add_image(b'rootfs', alias='ubuntu')
+
+    def test_connect(self):
+        self.assertEqual('dir', self.client.host_info['environment'][
+            'storage'])
+        self.assertEqual(1, self.lxd.calls['GET /1.0'])
+
+    def test_endpoint(self):
+        client = pylxd.Client(endpoint=self.lxd.endpoint)
+
+        self.assertEqual('trusted', client.host_info['auth'])
+
+    def test_container_lifecycle(self):
+        container = self.client.containers.create({
+            'name': 'instance-1',
+            'source': {'type': 'image', 'alias': 'ubuntu'},
+        }, wait=True)
+        container.start(wait=True)
+        running = container.state().status_code
+        container.stop(wait=True)
+        container.delete(wait=True)
+
+        self.assertEqual(events.RUNNING, running)
+        self.assertEqual({}, self.lxd.containers)
+        self.assertEqual(1, self.lxd.calls['POST /1.0/containers'])
+        self.assertEqual(2, self.lxd.calls['PUT /1.0/containers/*/state'])
+        self.assertEqual(1, self.lxd.calls['DELETE /1.0/containers/*'])
+
+    def test_create_missing_image(self):
+        self.assertRaises(
+            lxdcore_exceptions.LXDAPIException,
+            self.client.containers.create,
+            {'name': 'instance-1',
+             'source': {'type': 'image', 'alias': 'missing'}},
+            wait=True)
+
+    def test_container_not_found(self):
+        self.assertRaises(lxdcore_exceptions.NotFound,
+                          self.client.containers.get, 'instance-1')
+
+    def test_delete_running(self):
+        self.lxd.add_container('instance-1', status='Running')
+        container = self.client.containers.get('instance-1')
+
+        self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                          container.delete, wait=True)
+
+    def test_list_with_state(self):
+        self.lxd.add_container('instance-1', status='Running',
+                               config={'limits.cpu': '2'})
+
+        response = self.client.api.containers.get(params={'recursion': 2})
+
+        container = response.json()['metadata'][0]
+        self.assertEqual(events.RUNNING, container['state']['status_code'])
+        self.assertEqual('2', container['expanded_config']['limits.cpu'])
+
+    def test_profiles(self):
+        profile = self.client.profiles.create(
+            'instance-1', config={'limits.memory': '512MB'})
+        profile.config['limits.cpu'] = '1'
+        profile.save()
+        self.lxd.add_container('instance-1', profiles=['instance-1'])
+
+        self.assertEqual('1', self.lxd.profiles['instance-1']['config'][
+            'limits.cpu'])
+        self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                          profile.delete)
+
+    def test_files(self):
+        self.lxd.add_container('instance-1')
+        container = self.client.containers.get('instance-1')
+
+        container.files.put('/etc/hostname', b'instance-1')
+
+        self.assertEqual(b'instance-1', container.files.get('/etc/hostname'))
+
+    def test_images(self):
+        image = self.client.images.create(b'image data', wait=True)
+        image.add_alias('trusty', '')
+
+        self.assertEqual(10, self.client.images.get_by_alias('trusty').size)
+        self.assertEqual(b'image data', image.export().read())
+
+    def test_publish(self):
+        self.lxd.add_container('instance-1')
+        container = self.client.containers.get('instance-1')
+
+        image = container.publish(wait=True)
+
+        self.assertIn(image.fingerprint, self.lxd.images)
+
+    def test_storage_pool_resources(self):
+        self.lxd.add_storage_pool('default', total=1000, used=400)
+
+        response = self.client.api['storage-pools']['default'].resources.get()
+
+        self.assertEqual({'total': 1000, 'used': 400},
+                         response.json()['metadata']['space'])
+
+    def test_latency(self):
+        self.lxd.latency['GET /1.0/containers'] = 0.2
+        start = time.time()
+
+        self.client.containers.all()
+
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_failure(self):
+        self.lxd.add_container('instance-1')
+        self.lxd.fail('GET /1.0/containers/*', code=503)
+
+        e = self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                              self.client.containers.get, 'instance-1')
+        self.assertEqual(503, e.response.status_code)
+        self.client.containers.get('instance-1')
+
+    def test_operation_failure(self):
+        self.lxd.add_container('instance-1')
+        self.lxd.fail('PUT /1.0/containers/*/state', operation=True)
+        container = self.client.containers.get('instance-1')
+
+        self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                          container.start, wait=True)
+        self.assertEqual('Stopped', self.lxd.containers['instance-1'][
+            'status'])
+
+    def test_operation_timeout(self):
+        """An operation past its deadline is cancelled."""
+        self.lxd.add_container('instance-1')
+        self.lxd.operation_latency = 5
+        self.tracker = events.OperationTracker(default_timeout=1)
+        self.client.operations = events.TrackedOperations(
+            self.client, self.tracker)
+        container = self.client.containers.get('instance-1')
+
+        self.assertRaises(exception.NovaException,
+                          container.start, wait=True)
+        self.assertEqual(1, self.lxd.calls['DELETE /1.0/operations/*'])
+        self.assertEqual(['Cancelled'], [
+            operation['status']
+            for operation in self.lxd.operations.values()])
+
+    def test_events(self):
+        listener = events.EventListener()
+        recorder = _Recorder()
+        listener.add_handler(recorder)
+        listener.start(self.client)
+        self.addCleanup(listener.stop)
+        _wait_for(lambda: recorder.connected)
+
+        self.lxd.add_container('instance-1')
+        self.client.containers.get('instance-1').start(wait=True)
+        _wait_for(lambda: len(recorder.events) == 3)
+
+        self.assertEqual(
+            ['operation', 'lifecycle', 'operation'],
+            [event['type'] for event in recorder.events])
+        self.assertEqual(['instance-1'],
+                         events.container_names(recorder.events[1]))
+
+
+class LXDDriverFakeLXDTest(test.NoDBTestCase):
+    """The API requests LXDDriver makes, against a FakeLXD."""
+
+    def setUp(self):
+        super(LXDDriverFakeLXDTest, self).setUp()
+        self.lxd = self.useFixture(fake_lxd.FakeLXDFixture()).lxd
+        # Operations are still running when they are first looked at.
+        self.lxd.operation_latency = 0.05
+        self.flags(host_sample_interval=0, group='lxd')
+
+        get_by_host = mock.patch(
+            'nova.virt.lxd.driver.objects.InstanceList.get_by_host',
+            return_value=[])
+        get_by_host.start()
+        self.addCleanup(get_by_host.stop)
+
+        self.driver = driver.LXDDriver(None)
+        self.driver.init_host(None)
+        self.ctx = context.get_admin_context()
+        self.lxd.reset_calls()
+
+    def _instance(self, status):
+        instance = fake_instance.fake_instance_obj(self.ctx)
+        self.lxd.add_container(instance.name, status=status)
+        return instance
+
+    def test_init_host(self):
+        self.lxd.reset_calls()
+
+        self.driver.init_host(None)
+
+        self.assertEqual({'GET /1.0': 1}, dict(self.lxd.calls))
+
+    def test_list_instances(self):
+        instance = self._instance('Running')
+
+        self.assertEqual([instance.name], self.driver.list_instances())
+        self.assertEqual({'GET /1.0/containers': 1}, dict(self.lxd.calls))
+
+    def test_get_info(self):
+        instance = self._instance('Stopped')
+
+        info = self.driver.get_info(instance)
+
+        self.assertEqual(power_state.SHUTDOWN, info.state)
+        self.assertEqual({'GET /1.0/containers/*': 1,
+                          'GET /1.0/containers/*/state': 1},
+                         dict(self.lxd.calls))
+
+    def test_power_off(self):
+        instance = self._instance('Running')
+
+        self.driver.power_off(instance)
+
+        self.assertEqual('Stopped',
+                         self.lxd.containers[instance.name]['status'])
+        # pylxd reloads the container once it is stopped.
+        self.assertEqual({'GET /1.0/containers/*': 2,
+                          'PUT /1.0/containers/*/state': 1,
+                          'GET /1.0/operations/*': 1,
+                          'GET /1.0/operations/*/wait': 1},
+                         dict(self.lxd.calls))
+
+    @mock.patch('nova.virt.configdrive.required_by', return_value=False)
+    def test_spawn(self, required_by):
+        self.flags(instances_path=self.useFixture(fixtures.TempDir()).path)
+        instance = fake_instance.fake_instance_obj(
+            self.ctx, image_ref='image-a', memory_mb=256)
+        self.lxd.add_image(b'rootfs', alias='image-a')
+
+        self.driver.spawn(self.ctx, instance, None, [], None, [])
+
+        self.assertEqual('Running',
+                         self.lxd.containers[instance.name]['status'])
+        # pylxd loads the container it created when it starts it, and
+        # reloads it once it is started.
+        self.assertEqual({'GET /1.0/containers/*': 3,
+                          'GET /1.0/images/aliases/*': 1,
+                          'GET /1.0/images/*': 1,
+                          'POST /1.0/profiles': 1,
+                          'GET /1.0/profiles/*': 1,
+                          'POST /1.0/containers': 1,
+                          'PUT /1.0/containers/*/state': 1,
+                          'GET /1.0/operations/*': 2,
+                          'GET /1.0/operations/*/wait': 2},
+                         dict(self.lxd.calls))
+
+    @mock.patch('nova.virt.configdrive.required_by', return_value=False)
+    def test_spawn_latency(self, required_by):
+        """A slow container create is waited on once, not polled."""
+        self.flags(instances_path=self.useFixture(fixtures.TempDir()).path)
+        instance = fake_instance.fake_instance_obj(
+            self.ctx, image_ref='image-a', memory_mb=256)
+        self.lxd.add_image(b'rootfs', alias='image-a')
+        self.lxd.latency['POST /1.0/containers'] = 0.2
+        self.lxd.operation_latency = 0.5
+        start = time.time()
+
+        self.driver.spawn(self.ctx, instance, None, [], None, [])
+
+        elapsed = time.time() - start
+        self.assertGreaterEqual(elapsed, 1.0)
+        self.assertLess(elapsed, 3)
+        self.assertEqual(2, self.lxd.calls['GET /1.0/operations/*/wait'])
+
+    def test_destroy(self):
+        self.flags(instances_path=self.useFixture(fixtures.TempDir()).path)
+        instance = fake_instance.fake_instance_obj(self.ctx)
+        self.lxd.add_profile(instance.name)
+        self.lxd.add_container(instance.name, status='Running',
+                               profiles=[instance.name])
+
+        self.driver.destroy(self.ctx, instance, [])
+
+        self.assertEqual({}, self.lxd.containers)
+        self.assertNotIn(instance.name, self.lxd.profiles)
+        self.assertEqual({'GET /1.0/containers/*': 2,
+                          'PUT /1.0/containers/*/state': 1,
+                          'DELETE /1.0/containers/*': 1,
+                          'GET /1.0/operations/*': 2,
+                          'GET /1.0/operations/*/wait': 2,
+                          'GET /1.0/profiles/*': 1,
+                          'DELETE /1.0/profiles/*': 1},
+                         dict(self.lxd.calls))
+
+    def test_local_disk_info(self):
+        self.lxd.add_storage_pool('default', total=100 * 2 ** 30,
+                                  used=25 * 2 ** 30)
+
+        disk = self.driver._get_local_disk_info()
+
+        self.assertEqual(100 * 2 ** 30, disk['total'])
+        self.assertEqual(75 * 2 ** 30, disk['available'])
+        self.assertEqual(
+            1, self.lxd.calls['GET /1.0/storage-pools/*/resources'])
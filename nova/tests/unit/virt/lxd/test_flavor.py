@@ -61,6 +61,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -91,6 +92,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -119,6 +121,7 @@ class ToProfileTest(test.NoDBTestCase):
         block_info = []
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -153,6 +156,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -188,6 +192,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'security.idmap.isolated': 'True',
             'limits.cpu': '1',
             'limits.memory': '0MB',
@@ -236,6 +241,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -271,6 +277,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -305,6 +312,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -338,6 +346,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -378,6 +387,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -425,6 +435,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -467,6 +478,7 @@ class ToProfileTest(test.NoDBTestCase):
 
         expected_config = {
             'environment.product_name': 'OpenStack Nova',
+            'user.nova-lxd.instance-uuid': instance.uuid,
             'limits.cpu': '1',
             'limits.memory': '0MB',
             'raw.lxc': (
@@ -490,3 +502,31 @@ class ToProfileTest(test.NoDBTestCase):
 
         self.client.profiles.create.assert_called_once_with(
             instance.name, expected_config, expected_devices)
+
+
+class LimitsTest(test.NoDBTestCase):
+    """Tests for the limits set by nova.virt.lxd.flavor profiles."""
+
+    def test_instance_limits(self):
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=512)
+
+        self.assertEqual(
+            flavor.Limits(instance.flavor.vcpus, 512),
+            flavor.instance_limits(instance))
+
+    def test_profile_limits(self):
+        self.assertEqual(
+            flavor.Limits(2, 512),
+            flavor.profile_limits(
+                {'limits.cpu': '2', 'limits.memory': '512MB'}))
+        self.assertEqual(
+            flavor.Limits(5, 2048),
+            flavor.profile_limits(
+                {'limits.cpu': '0-3,6', 'limits.memory': '2GiB'}))
+
+    def test_profile_limits_unset(self):
+        self.assertEqual(
+            flavor.Limits(0, 0),
+            flavor.profile_limits({'limits.memory': '50%'}))
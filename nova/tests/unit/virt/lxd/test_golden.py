@@ -0,0 +1,84 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import mock
+from nova import test
+from pylxd import exceptions as lxdcore_exceptions
+
+from nova.virt.lxd import golden
+
+
+class GoldenContainersTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.golden.GoldenContainers."""
+
+    def setUp(self):
+        super(GoldenContainersTest, self).setUp()
+        self.flags(pool=None, group='lxd')
+        lock_patcher = mock.patch('nova.virt.lxd.golden.lockutils.lock')
+        self.lock = lock_patcher.start()
+        self.addCleanup(lock_patcher.stop)
+
+        self.client = mock.Mock()
+        self.profile = mock.Mock()
+        self.profile.name = 'instance'
+        self.golden = golden.GoldenContainers()
+
+    def test_clone(self):
+        self.client.containers.exists.return_value = True
+
+        container = self.golden.clone(
+            self.client, 'image', 'instance', self.profile)
+
+        self.client.containers.exists.assert_called_once_with(
+            golden.PREFIX + 'image')
+        self.client.containers.create.assert_called_once_with({
+            'name': 'instance',
+            'profiles': ['instance'],
+            'source': {'type': 'copy', 'source': golden.PREFIX + 'image'},
+        }, wait=True)
+        self.assertEqual(
+            self.client.containers.create.return_value, container)
+        self.assertEqual(['instance'], container.profiles)
+        self.assertEqual({}, container.devices)
+        container.config.pop.assert_called_once_with(golden.IMAGE_KEY, None)
+        container.save.assert_called_once_with(wait=True)
+
+    def test_clone_adopt_fails(self):
+        """A copy which cannot be adopted is deleted."""
+        self.client.containers.exists.return_value = True
+        container = self.client.containers.create.return_value
+        container.save.side_effect = lxdcore_exceptions.LXDAPIException(
+            mock.Mock(status_code=500))
+
+        self.assertRaises(
+            lxdcore_exceptions.LXDAPIException, self.golden.clone,
+            self.client, 'image', 'instance', self.profile)
+        container.delete.assert_called_once_with(wait=True)
+
+    def test_clone_creates_golden(self):
+        self.client.containers.exists.return_value = False
+
+        self.golden.clone(self.client, 'image', 'instance', self.profile)
+
+        self.assertEqual(2, self.client.containers.create.call_count)
+        config = self.client.containers.create.call_args_list[0][0][0]
+        self.assertEqual({
+            'name': golden.PREFIX + 'image',
+            'profiles': [],
+            'devices': {'root': {'type': 'disk', 'path': '/'}},
+            'config': {golden.IMAGE_KEY: 'image'},
+            'source': {'type': 'image', 'alias': 'image'},
+        }, config)
+        self.assertEqual(
+            'lxd-golden-image', self.lock.call_args[1]['lock_file_prefix'])
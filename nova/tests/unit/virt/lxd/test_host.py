@@ -0,0 +1,100 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import mock
+from nova import test
+
+from nova.virt.lxd import host
+
+
+class HostSamplerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.host.HostSampler."""
+
+    def setUp(self):
+        super(HostSamplerTest, self).setUp()
+        self.sampler = host.HostSampler(30)
+        self.static = mock.Mock(return_value='topology')
+        self.dynamic = mock.Mock(side_effect=range(100))
+        self.sampler.add_probe('static', self.static, static=True)
+        self.sampler.add_probe('dynamic', self.dynamic)
+
+        time_patcher = mock.patch('time.time', return_value=1000)
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+    def test_static(self):
+        self.sampler.get('static')
+        self.time.return_value = 5000
+
+        self.assertEqual('topology', self.sampler.get('static'))
+        self.static.assert_called_once_with()
+
+    def test_dynamic(self):
+        self.assertEqual(0, self.sampler.get('dynamic'))
+        self.time.return_value = 1029
+        self.assertEqual(0, self.sampler.get('dynamic'))
+        self.time.return_value = 1030
+        self.assertEqual(1, self.sampler.get('dynamic'))
+
+    def test_refresh(self):
+        """Only the dynamic metrics asked for are sampled again."""
+        other = mock.Mock()
+        self.sampler.add_probe('other', other)
+        self.sampler.get('static')
+        self.sampler.get('dynamic')
+
+        self.sampler.refresh()
+
+        self.assertEqual(1, self.sampler.get('dynamic'))
+        self.static.assert_called_once_with()
+        self.assertFalse(other.called)
+
+    def test_refresh_failure(self):
+        self.sampler.get('dynamic')
+        self.dynamic.side_effect = OSError()
+
+        self.sampler.refresh()
+
+        self.assertEqual(0, self.sampler.get('dynamic'))
+
+    def test_running(self):
+        """The green thread is given a second interval to refresh."""
+        self.sampler._running = True
+        self.sampler.get('dynamic')
+        self.time.return_value = 1059
+
+        self.assertEqual(0, self.sampler.get('dynamic'))
+
+    @mock.patch('eventlet.sleep')
+    def test_run(self, sleep):
+        self.sampler.get('dynamic')
+        self.sampler._running = True
+
+        def stop_after_refresh(interval):
+            if sleep.call_count == 2:
+                self.sampler.stop()
+        sleep.side_effect = stop_after_refresh
+
+        self.sampler._run()
+
+        sleep.assert_called_with(30)
+        self.assertEqual(2, self.dynamic.call_count)
+
+    @mock.patch('nova.utils.spawn_n')
+    def test_start_disabled(self, spawn_n):
+        sampler = host.HostSampler(0)
+
+        sampler.start()
+
+        self.assertFalse(spawn_n.called)
@@ -0,0 +1,255 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import hashlib
+import io
+import tarfile
+import threading
+
+import ddt
+import mock
+from nova import test
+from oslo_utils import units
+
+from nova.virt.lxd import image
+
+
+class MetadataTarballTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.image.metadata_tarball."""
+
+    def test_metadata_tarball(self):
+        fileobj = image.metadata_tarball(b'architecture: x86_64\n')
+
+        tarball = tarfile.open(fileobj=fileobj, mode='r:gz')
+        self.assertEqual(['metadata.yaml'], tarball.getnames())
+        self.assertEqual(
+            b'architecture: x86_64\n',
+            tarball.extractfile('metadata.yaml').read())
+
+
+class MultipartBodyTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.image.MultipartBody."""
+
+    def test_body(self):
+        body = image.MultipartBody((
+            ('metadata', io.BytesIO(b'meta')),
+            ('rootfs', io.BytesIO(b'root' * 10)),
+        ))
+        boundary = body.boundary.encode('ascii')
+
+        data = body.read()
+
+        self.assertEqual(len(data), len(body))
+        self.assertTrue(data.startswith(b'--' + boundary + b'\r\n'))
+        self.assertTrue(data.endswith(b'--' + boundary + b'--\r\n'))
+        self.assertIn(b'name="metadata"', data)
+        self.assertIn(b'\r\n\r\nmeta\r\n', data)
+        self.assertIn(b'\r\n\r\n' + b'root' * 10 + b'\r\n', data)
+        self.assertEqual(
+            'multipart/form-data; boundary={}'.format(body.boundary),
+            body.content_type)
+
+    def test_read_bounded(self):
+        body = image.MultipartBody((('rootfs', io.BytesIO(b'x' * 100)),))
+        length = len(body)
+
+        chunks = []
+        for chunk in iter(lambda: body.read(7), b''):
+            self.assertTrue(len(chunk) <= 7)
+            chunks.append(chunk)
+
+        self.assertEqual(length, len(b''.join(chunks)))
+
+    def test_iter(self):
+        body = image.MultipartBody((('rootfs', io.BytesIO(b'x' * 100)),))
+        length = len(body)
+
+        self.assertEqual(length, len(b''.join(body)))
+
+
+class UploadTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.image.upload."""
+
+    def setUp(self):
+        super(UploadTest, self).setUp()
+        self.client = mock.Mock()
+        self.client.api.images.post.return_value.json.return_value = {
+            'operation': '/1.0/operations/1234'}
+        operation = self.client.operations.wait_for_operation.return_value
+        operation.metadata = {'fingerprint': 'abcdef'}
+
+    def test_upload(self):
+        rootfs = io.BytesIO(b'rootfs')
+
+        lxd_image = image.upload(self.client, rootfs)
+
+        self.client.api.images.post.assert_called_once_with(
+            data=rootfs, headers={})
+        self.client.operations.wait_for_operation.assert_called_once_with(
+            '/1.0/operations/1234')
+        self.client.images.get.assert_called_once_with('abcdef')
+        self.assertEqual(self.client.images.get.return_value, lxd_image)
+
+    def test_upload_with_metadata(self):
+        rootfs = io.BytesIO(b'rootfs')
+        metadata = io.BytesIO(b'metadata')
+
+        image.upload(self.client, rootfs, metadata=metadata)
+
+        kwargs = self.client.api.images.post.call_args[1]
+        self.assertIsInstance(kwargs['data'], image.MultipartBody)
+        self.assertEqual(
+            kwargs['data'].content_type, kwargs['headers']['Content-Type'])
+
+
+def _tarball(mode, members):
+    fileobj = io.BytesIO()
+    tarball = tarfile.open(fileobj=fileobj, mode=mode)
+    for name, data in members:
+        info = tarfile.TarInfo(name=name)
+        info.size = len(data)
+        tarball.addfile(info, io.BytesIO(data))
+    tarball.close()
+    return fileobj.getvalue()
+
+
+@ddt.ddt
+class ImageWriterTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.image.ImageWriter."""
+
+    def _write(self, data, chunk_size=1000):
+        fileobj = io.BytesIO()
+        writer = image.ImageWriter(fileobj)
+        for i in range(0, len(data), chunk_size):
+            writer.write(data[i:i + chunk_size])
+        writer.close()
+        self.assertEqual(data, fileobj.getvalue())
+        self.assertEqual(len(data), writer.size)
+        return writer
+
+    @ddt.data('w', 'w:gz', 'w:bz2')
+    def test_has_metadata(self, mode):
+        data = _tarball(mode, [
+            ('rootfs/bin/sh', b'\0' * 20000),
+            ('metadata.yaml', b'architecture: x86_64\n'),
+        ])
+
+        writer = self._write(data)
+
+        self.assertTrue(writer.has_metadata)
+        self.assertEqual(hashlib.sha256(data).hexdigest(), writer.fingerprint)
+
+    def test_has_metadata_dot_prefix(self):
+        data = _tarball('w:gz', [('./metadata.yaml', b'')])
+
+        writer = self._write(data, chunk_size=1)
+
+        self.assertTrue(writer.has_metadata)
+
+    @ddt.data('w', 'w:gz', 'w:bz2')
+    def test_no_metadata(self, mode):
+        data = _tarball(mode, [('bin/sh', b'\0' * 20000)])
+
+        writer = self._write(data)
+
+        self.assertFalse(writer.has_metadata)
+
+    def test_not_a_tarball(self):
+        writer = self._write(b'hsqs' + b'\1' * 5000)
+
+        self.assertFalse(writer.has_metadata)
+
+    @mock.patch('nova.virt.lxd.image.lzma', None)
+    def test_unknown_compression(self):
+        writer = self._write(b'\xfd7zXZ\x00' + b'\1' * 5000)
+
+        self.assertIsNone(writer.has_metadata)
+
+
+class TransferSchedulerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.image.TransferScheduler."""
+
+    def setUp(self):
+        super(TransferSchedulerTest, self).setUp()
+        time_patcher = mock.patch('nova.virt.lxd.image.time')
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.time.time.return_value = 100.0
+
+    def test_transfer_stats(self):
+        scheduler = image.TransferScheduler()
+
+        with scheduler.transfer('image'):
+            self.assertEqual(1, scheduler.stats()['active'])
+
+        self.assertEqual(
+            {'queued': 0, 'active': 0, 'transfers': 1,
+             'wait_time': 0.0, 'max_wait_time': 0.0},
+            scheduler.stats())
+
+    def test_transfer_limited(self):
+        scheduler = image.TransferScheduler(max_transfers=1)
+        scheduler._slots = mock.Mock(wraps=threading.Semaphore(1))
+
+        with scheduler.transfer('image-a'):
+            self.assertFalse(scheduler._slots.acquire(False))
+
+        scheduler._slots.acquire.assert_called_with(False)
+        self.assertEqual(2, scheduler._slots.acquire.call_count)
+        scheduler._slots.release.assert_called_once_with()
+
+    def test_transfer_wait_time(self):
+        scheduler = image.TransferScheduler(max_transfers=1)
+        self.time.time.side_effect = [100.0, 105.0]
+
+        with scheduler.transfer('image'):
+            pass
+
+        stats = scheduler.stats()
+        self.assertEqual(5.0, stats['wait_time'])
+        self.assertEqual(5.0, stats['max_wait_time'])
+
+    def test_transfer_releases_on_error(self):
+        scheduler = image.TransferScheduler(max_transfers=1)
+
+        def fail():
+            with scheduler.transfer('image'):
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+
+        with scheduler.transfer('image'):
+            self.assertEqual(1, scheduler.stats()['active'])
+
+    def test_throttle_unlimited(self):
+        scheduler = image.TransferScheduler()
+
+        scheduler.throttle(10 * units.Gi)
+
+        self.assertFalse(self.time.sleep.called)
+
+    def test_throttle(self):
+        scheduler = image.TransferScheduler(max_rate=units.Mi)
+
+        # One second's worth of data is allowed as a burst.
+        scheduler.throttle(units.Mi)
+        self.assertFalse(self.time.sleep.called)
+
+        scheduler.throttle(units.Mi // 2)
+        self.time.sleep.assert_called_once_with(0.5)
+
+        # Time passing pays the debt back.
+        self.time.time.return_value = 101.5
+        self.time.sleep.reset_mock()
+        scheduler.throttle(units.Mi)
+        self.assertFalse(self.time.sleep.called)
@@ -0,0 +1,183 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import fixtures
+import mock
+from nova import context
+from nova import test
+from nova.tests.unit import fake_instance
+from oslo_utils import units
+
+from nova.virt.lxd import golden
+from nova.virt.lxd import imagecache
+
+
+class ImageCacheManagerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.imagecache.ImageCacheManager."""
+
+    def setUp(self):
+        super(ImageCacheManagerTest, self).setUp()
+        self.flags(
+            instances_path=self.useFixture(fixtures.TempDir()).path)
+        self.flags(remove_unused_base_images=True)
+        self.flags(image_cache_size_gb=0, image_cache_min_age=100,
+                   group='lxd')
+
+        time_patcher = mock.patch('nova.virt.lxd.imagecache.time.time')
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.time.return_value = 1000
+
+        self.client = mock.Mock()
+        self.images = []
+        self.containers = []
+        self.client.api.images.get.return_value.json.return_value = {
+            'metadata': self.images}
+        self.client.api.containers.get.return_value.json.return_value = {
+            'metadata': self.containers}
+
+        self.cache = imagecache.ImageCacheManager()
+
+    def _add_image(self, alias, fingerprint, size=units.Gi, last_used=0,
+                   extra_aliases=()):
+        self.images.append({
+            'fingerprint': fingerprint,
+            'aliases': [{'name': a} for a in (alias,) + extra_aliases],
+        })
+        self.time.return_value = last_used
+        self.cache.register(
+            alias, mock.Mock(fingerprint=fingerprint, size=size))
+        self.time.return_value = 1000
+
+    def _evicted(self):
+        return [c[0][0] for c in self.client.images.get.call_args_list]
+
+    def test_register_persists(self):
+        self._add_image('image-a', 'aaa')
+
+        cache = imagecache.ImageCacheManager()
+        cache.update(self.client, [])
+
+        self.assertEqual(['aaa'], self._evicted())
+
+    def test_lookup(self):
+        self.cache.register(
+            'image-a', mock.Mock(fingerprint='aaa', size=1), checksum='md5')
+
+        self.assertEqual('aaa', self.cache.lookup('md5'))
+        self.assertIsNone(self.cache.lookup('other'))
+        self.assertIsNone(self.cache.lookup(None))
+
+    def test_update_evicts_unused(self):
+        self._add_image('image-a', 'aaa')
+        self._add_image('image-b', 'bbb')
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual(['aaa', 'bbb'], sorted(self._evicted()))
+        self.client.images.get.return_value.delete.assert_called_with(
+            wait=True)
+
+    def test_update_keeps_referenced(self):
+        ctx = context.get_admin_context()
+        instance = fake_instance.fake_instance_obj(
+            ctx, name='test', memory_mb=0, image_ref='image-a')
+        self._add_image('image-a', 'aaa')
+        self._add_image('image-b', 'bbb')
+        self._add_image('image-c', 'ccc')
+        self.containers.append({'name': 'instance-00000002',
+                                'config': {'volatile.base_image': 'bbb'}})
+
+        self.cache.update(self.client, [instance])
+
+        self.assertEqual(['ccc'], self._evicted())
+
+    def test_update_evicts_golden(self):
+        self._add_image('image-a', 'aaa')
+        self.containers.append({'name': golden.PREFIX + 'image-a',
+                                'config': {'volatile.base_image': 'aaa'}})
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual(['aaa'], self._evicted())
+        self.client.containers.get.assert_called_once_with(
+            golden.PREFIX + 'image-a')
+        self.client.containers.get.return_value.delete.assert_called_once_with(
+            wait=True)
+
+    def test_update_keeps_recent(self):
+        self._add_image('image-a', 'aaa', last_used=950)
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual([], self._evicted())
+
+    def test_update_touch(self):
+        self._add_image('image-a', 'aaa')
+        self.time.return_value = 950
+        self.cache.touch('image-a')
+        self.time.return_value = 1000
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual([], self._evicted())
+
+    def test_update_size_budget_lru(self):
+        self.flags(image_cache_size_gb=2, group='lxd')
+        self._add_image('image-a', 'aaa', last_used=30)
+        self._add_image('image-b', 'bbb', last_used=10)
+        self._add_image('image-c', 'ccc', last_used=20)
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual(['bbb'], self._evicted())
+
+    def test_update_size_budget_in_use(self):
+        """Images in use do not count against the budget."""
+        self.flags(image_cache_size_gb=2, group='lxd')
+        self._add_image('image-a', 'aaa', size=3 * units.Gi)
+        self._add_image('image-b', 'bbb', last_used=10)
+        self._add_image('image-c', 'ccc', last_used=20)
+        self.containers.append({'name': 'instance-00000001',
+                                'config': {'volatile.base_image': 'aaa'}})
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual([], self._evicted())
+
+    def test_update_foreign_alias(self):
+        self._add_image('image-a', 'aaa', extra_aliases=('ubuntu',))
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual([], self._evicted())
+
+    def test_update_disabled(self):
+        self.flags(remove_unused_base_images=False)
+        self._add_image('image-a', 'aaa')
+
+        self.cache.update(self.client, [])
+
+        self.assertEqual([], self._evicted())
+
+    def test_update_forgets_deleted_images(self):
+        self._add_image('image-a', 'aaa')
+        del self.images[:]
+
+        self.cache.update(self.client, [])
+        self.images.append({'fingerprint': 'aaa',
+                            'aliases': [{'name': 'image-a'}]})
+        self.cache.update(self.client, [])
+
+        self.assertEqual([], self._evicted())
@@ -0,0 +1,137 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import json
+
+import mock
+from nova import context
+from nova import test
+from nova.tests.unit import fake_instance
+
+from nova.virt.lxd import nocloud
+
+_VIF = {
+    'address': 'ca:fe:de:ad:be:ef',
+    'network': {
+        'subnets': [{
+            'version': 4,
+            'cidr': '10.0.0.0/24',
+            'gateway': {'address': '10.0.0.1'},
+            'dns': [{'address': '8.8.8.8'}],
+            'ips': [{'address': '10.0.0.2'}],
+        }, {
+            'version': 6,
+            'cidr': 'fd00::/64',
+            'gateway': None,
+            'dns': [],
+            'ips': [],
+        }],
+    },
+}
+
+
+def _instance_metadata(userdata_raw=None):
+    """A stand in for the InstanceMetadata of an instance."""
+    inst_md = mock.Mock(userdata_raw=userdata_raw)
+    inst_md.lookup.return_value = json.dumps({
+        'uuid': 'fake-uuid',
+        'hostname': 'test',
+        'launch_index': 1,
+        'meta': {'role': 'web'},
+        'public_keys': {'a': 'ssh-rsa AAAA a', 'b': 'ssh-rsa BBBB b'},
+    }).encode('utf-8')
+    return inst_md
+
+
+class NoCloudTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.nocloud."""
+
+    def setUp(self):
+        super(NoCloudTest, self).setUp()
+        self.ctx = context.get_admin_context()
+
+    def test_supported(self):
+        instance = fake_instance.fake_instance_obj(
+            self.ctx, system_metadata={'image_lxd_nocloud': 'true'})
+
+        self.assertTrue(nocloud.supported(instance))
+
+    def test_supported_unset(self):
+        """Images have to opt in."""
+        instance = fake_instance.fake_instance_obj(
+            self.ctx, system_metadata={})
+
+        self.assertFalse(nocloud.supported(instance))
+
+    def test_supported_disabled(self):
+        instance = fake_instance.fake_instance_obj(
+            self.ctx, system_metadata={'image_lxd_nocloud': 'false'})
+
+        self.assertFalse(nocloud.supported(instance))
+
+    def test_meta_data(self):
+        inst_md = _instance_metadata()
+
+        self.assertEqual(
+            'hostname: "test"\n'
+            'instance-id: "fake-uuid"\n'
+            'launch_index: 1\n'
+            'local-hostname: "test"\n'
+            'meta: {"role": "web"}\n'
+            'public-keys: ["ssh-rsa AAAA a", "ssh-rsa BBBB b"]\n'
+            'public_keys: {"a": "ssh-rsa AAAA a", "b": "ssh-rsa BBBB b"}\n'
+            'uuid: "fake-uuid"\n',
+            nocloud.meta_data(inst_md))
+        inst_md.lookup.assert_called_once_with(
+            '/openstack/latest/meta_data.json')
+
+    def test_user_data(self):
+        inst_md = _instance_metadata(userdata_raw=b'#cloud-config\n')
+
+        self.assertEqual(u'#cloud-config\n', nocloud.user_data(inst_md))
+
+    def test_user_data_binary(self):
+        inst_md = _instance_metadata(userdata_raw=b'\x1f\x8b\x08\xff')
+
+        self.assertRaises(ValueError, nocloud.user_data, inst_md)
+
+    def test_network_config(self):
+        config = nocloud.network_config([_VIF])
+
+        self.assertEqual({
+            'version': 1,
+            'config': [{
+                'type': 'physical',
+                'name': 'eth0',
+                'mac_address': 'ca:fe:de:ad:be:ef',
+                'subnets': [{
+                    'type': 'static',
+                    'address': '10.0.0.2/24',
+                    'gateway': '10.0.0.1',
+                    'dns_nameservers': ['8.8.8.8'],
+                }, {
+                    'type': 'dhcp6',
+                }],
+            }],
+        }, config)
+
+    def test_instance_config(self):
+        inst_md = _instance_metadata()
+
+        config = nocloud.instance_config(inst_md, [_VIF])
+
+        self.assertEqual(nocloud.meta_data(inst_md), config['user.meta-data'])
+        self.assertNotIn('user.user-data', config)
+        self.assertEqual(nocloud.network_config([_VIF]),
+                         json.loads(config['user.network-config']))
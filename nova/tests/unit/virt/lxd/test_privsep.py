@@ -0,0 +1,69 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+
+import fixtures
+import mock
+from nova import test
+
+from nova.virt.lxd import privsep
+
+
+class PrivsepTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.privsep."""
+
+    def setUp(self):
+        super(PrivsepTest, self).setUp()
+        # Run the entrypoints in this process instead of the daemon.
+        privsep.lxd_pctxt.set_client_mode(False)
+        self.addCleanup(privsep.lxd_pctxt.set_client_mode, True)
+        self.path = self.useFixture(fixtures.TempDir()).path
+        os.makedirs(os.path.join(self.path, 'a', 'b'))
+        open(os.path.join(self.path, 'a', 'file'), 'w').close()
+
+    @mock.patch('os.lchown')
+    def test_chown_recursive(self, lchown):
+        privsep.chown(self.path, 1000, 1000, recursive=True)
+
+        self.assertEqual(
+            sorted([self.path,
+                    os.path.join(self.path, 'a'),
+                    os.path.join(self.path, 'a', 'b'),
+                    os.path.join(self.path, 'a', 'file')]),
+            sorted(c[0][0] for c in lchown.call_args_list))
+        lchown.assert_called_with(mock.ANY, 1000, 1000)
+
+    @mock.patch('os.lchown')
+    def test_chown(self, lchown):
+        privsep.chown(self.path, uid=1000)
+
+        lchown.assert_called_once_with(self.path, 1000, -1)
+
+    def test_chmod_recursive(self):
+        privsep.chmod(self.path, 0o700, recursive=True)
+
+        self.assertEqual(
+            0o700,
+            os.stat(os.path.join(self.path, 'a', 'file')).st_mode & 0o777)
+
+    @mock.patch('oslo_concurrency.processutils.execute')
+    def test_stats(self, execute):
+        before = privsep.stats().get('umount', 0)
+
+        privsep.umount('/mnt')
+        privsep.umount('/mnt')
+
+        self.assertEqual(before + 2, privsep.stats()['umount'])
+        execute.assert_called_with('umount', '/mnt')
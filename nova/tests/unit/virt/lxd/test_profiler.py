@@ -0,0 +1,180 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+import pstats
+import time
+import unittest
+
+import fixtures
+import mock
+from nova import test
+
+from nova.virt.lxd import profiler
+
+
+class _Instance(object):
+    uuid = 'instance-uuid'
+    flavor = None
+
+
+def _busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class _Driver(object):
+
+    @profiler.profiled
+    def spawn(self, context, instance, seconds=0):
+        _busy(seconds)
+        return 'spawned'
+
+    @profiler.profiled
+    def get_available_resource(self, nodename):
+        raise OSError('failed')
+
+
+class ProfilerTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.profiler."""
+
+    def setUp(self):
+        super(ProfilerTest, self).setUp()
+        self.directory = self.useFixture(fixtures.TempDir()).path
+        self.profiler = profiler.Profiler()
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.virt.lxd.profiler.PROFILER', self.profiler))
+
+    def _files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_inactive(self):
+        self.profiler.configure(self.directory, ['cprofile'])
+
+        self.assertEqual('spawned', _Driver().spawn(None, _Instance()))
+
+        self.assertFalse(self.profiler.active)
+        self.assertEqual([], self._files())
+
+    def test_not_configured(self):
+        self.profiler.configure(None, ['cprofile'], enabled=True)
+
+        self.profiler.toggle()
+
+        self.assertFalse(self.profiler.active)
+
+    def test_cprofile(self):
+        self.profiler.configure(self.directory, ['cprofile'], enabled=True)
+
+        self.assertEqual('spawned', _Driver().spawn(None, _Instance()))
+
+        files = self._files()
+        self.assertEqual(1, len(files))
+        self.assertTrue(files[0].startswith('spawn-instance-uuid-'))
+        self.assertTrue(files[0].endswith('.prof'))
+        stats = pstats.Stats(os.path.join(self.directory, files[0]))
+        self.assertIn('spawn', [func[2] for func in stats.stats])
+        self.assertFalse(self.profiler._cprofile_busy)
+
+    def test_sampling(self):
+        self.profiler.configure(self.directory, ['sampling'], enabled=True)
+
+        _Driver().spawn(None, _Instance(), seconds=0.1)
+
+        files = self._files()
+        self.assertEqual(1, len(files))
+        self.assertTrue(files[0].endswith('.stacks'))
+        with open(os.path.join(self.directory, files[0])) as f:
+            stacks = f.read()
+        self.assertIn(':spawn;', stacks)
+        self.assertIn(':_busy ', stacks)
+
+    @unittest.skipIf(profiler.tracemalloc is None, 'tracemalloc missing')
+    def test_tracemalloc(self):
+        self.profiler.configure(self.directory, ['tracemalloc'],
+                                enabled=True)
+
+        _Driver().spawn(None, _Instance())
+
+        self.assertTrue(self._files()[0].endswith('.tracemalloc'))
+        self.assertFalse(profiler.tracemalloc.is_tracing())
+
+    @unittest.skipIf(profiler.tracemalloc is None, 'tracemalloc missing')
+    def test_tracemalloc_overlapping(self):
+        """Tracing goes on until the last overlapping call is done."""
+        stop_first = profiler._start_tracemalloc(self.profiler)
+        stop_second = profiler._start_tracemalloc(self.profiler)
+
+        stop_first(os.path.join(self.directory, 'first'))
+        self.assertTrue(profiler.tracemalloc.is_tracing())
+        stop_second(os.path.join(self.directory, 'second'))
+
+        self.assertFalse(profiler.tracemalloc.is_tracing())
+        self.assertEqual(['first', 'second'], self._files())
+
+    def test_host_method(self):
+        """Methods without an instance are profiled as the host's."""
+        self.profiler.configure(self.directory, ['cprofile'], enabled=True)
+
+        self.assertRaises(OSError, _Driver().get_available_resource, 'node')
+
+        self.assertTrue(
+            self._files()[0].startswith('get_available_resource-host-'))
+
+    def test_unknown_mode(self):
+        self.profiler.configure(self.directory, ['cprofile', 'perf'])
+
+        self.assertEqual(['cprofile'], self.profiler.modes)
+
+    def test_toggle(self):
+        self.profiler.configure(self.directory, ['cprofile'])
+
+        self.profiler.toggle()
+        _Driver().spawn(None, _Instance())
+        self.profiler.toggle()
+        _Driver().spawn(None, _Instance())
+
+        self.assertEqual(1, len(self._files()))
+
+    @mock.patch('signal.signal')
+    def test_install_signal(self, signal):
+        self.profiler.install_signal('SIGUSR1')
+
+        signal.assert_called_once_with(
+            profiler.signal.SIGUSR1, self.profiler.toggle)
+
+    def test_write_failure(self):
+        """A profile which cannot be written does not fail the call."""
+        self.profiler.configure(self.directory, ['cprofile'], enabled=True)
+        os.rmdir(self.directory)
+
+        self.assertEqual('spawned', _Driver().spawn(None, _Instance()))
+        self.assertFalse(self.profiler._cprofile_busy)
+
+    def test_collector_failure(self):
+        """A collector failing does not fail the call."""
+        self.profiler.configure(self.directory, ['cprofile', 'sampling'],
+                                enabled=True)
+        failing_start = mock.Mock(side_effect=RuntimeError('start'))
+        failing_stop = mock.Mock(return_value=mock.Mock(
+            side_effect=RuntimeError('stop')))
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.virt.lxd.profiler._COLLECTORS', {
+                'cprofile': ('prof', failing_start),
+                'sampling': ('stacks', failing_stop)}))
+
+        self.assertEqual('spawned', _Driver().spawn(None, _Instance()))
+
+        failing_stop.return_value.assert_called_once_with(mock.ANY)
@@ -20,6 +20,8 @@ The following tests the ContainerMixin class
 for nova-lxd.
 """
 
+import socket
+
 import ddt
 import mock
 
@@ -40,6 +42,8 @@ class SessionContainerTest(test.NoDBTestCase):
 
         """This is so we can mock out pylxd API calls."""
         self.ml = stubs.lxd_mock()
+        # The client has not connected to LXD yet.
+        self.ml.connection.connection = None
         lxd_patcher = mock.patch('pylxd.deprecated.api.API',
                                  mock.Mock(return_value=self.ml))
         lxd_patcher.start()
@@ -47,6 +51,13 @@ class SessionContainerTest(test.NoDBTestCase):
 
         self.session = session.LXDAPISession()
 
+    @mock.patch('nova.virt.lxd.tracing.TRACER')
+    def test_pool_stats_exported(self, tracer):
+        lxd_session = session.LXDAPISession()
+
+        tracer.add_stats.assert_called_once_with(
+            'session_pool', lxd_session._pool.stats)
+
     @stubs.annotated_data(
         ('1', (200, fake_api.fake_operation_info_ok()))
     )
@@ -93,6 +104,8 @@ class SessionEventTest(test.NoDBTestCase):
         super(SessionEventTest, self).setUp()
 
         self.ml = stubs.lxd_mock()
+        # The client has not connected to LXD yet.
+        self.ml.connection.connection = None
         lxd_patcher = mock.patch('pylxd.deprecated.api.API',
                                  mock.Mock(return_value=self.ml))
         lxd_patcher.start()
@@ -107,3 +120,95 @@ class SessionEventTest(test.NoDBTestCase):
         self.assertIsNone(self.session.operation_wait(operation_id, instance))
         self.ml.wait_container_operation.assert_called_with(operation_id,
                                                             200, -1)
+
+
+class ClientPoolTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.session.ClientPool."""
+
+    def setUp(self):
+        super(ClientPoolTest, self).setUp()
+        self.connect = mock.Mock(side_effect=self._client)
+        self.pool = session.ClientPool(self.connect, max_idle=1)
+
+    def _client(self, host):
+        client = mock.Mock()
+        client.connection.connection = None
+        return client
+
+    def test_reuse(self):
+        with self.pool.client() as first:
+            pass
+        with self.pool.client() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.connect.assert_called_once_with(None)
+        self.assertEqual({'created': 1, 'reused': 1, 'idle': {None: 1}},
+                         self.pool.stats())
+
+    def test_concurrent(self):
+        """A client is not shared while it is checked out."""
+        with self.pool.client('a') as first:
+            connection = first.connection.connection = mock.Mock()
+            with self.pool.client('a') as second:
+                self.assertIsNot(first, second)
+
+        # Only one client is kept idle, the other one is closed.
+        self.assertEqual(1, self.pool.stats()['idle']['a'])
+        connection.close.assert_called_once_with()
+        self.assertIsNone(first.connection.connection)
+
+    def test_hosts(self):
+        with self.pool.client('a') as first:
+            pass
+        with self.pool.client('b') as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertEqual([mock.call('a'), mock.call('b')],
+                         self.connect.call_args_list)
+
+    def test_failed_connection(self):
+        def fail():
+            with self.pool.client() as client:
+                client.connection.connection = mock.Mock()
+                raise socket.error('broken pipe')
+
+        self.assertRaises(socket.error, fail)
+
+        self.assertEqual(0, self.pool.stats()['idle'][None])
+        self.assertEqual(1, self.pool.stats()['dropped'])
+
+    def test_api_error(self):
+        """An error reported by LXD leaves the connection usable."""
+        def fail():
+            with self.pool.client():
+                raise lxd_exceptions.APIError(500, 'Fake')
+
+        self.assertRaises(lxd_exceptions.APIError, fail)
+
+        self.assertEqual(1, self.pool.stats()['idle'][None])
+
+    def test_dropped_connection(self):
+        """A connection closed by LXD while idle is reopened."""
+        ours, theirs = socket.socketpair()
+        self.addCleanup(ours.close)
+        with self.pool.client() as client:
+            connection = client.connection.connection = mock.Mock(sock=ours)
+        theirs.close()
+
+        with self.pool.client() as reused:
+            self.assertIsNone(reused.connection.connection)
+
+        connection.close.assert_called_once_with()
+        self.assertEqual(1, self.pool.stats()['reconnected'])
+
+    def test_open_connection(self):
+        ours, theirs = socket.socketpair()
+        self.addCleanup(ours.close)
+        self.addCleanup(theirs.close)
+        with self.pool.client() as client:
+            connection = client.connection.connection = mock.Mock(sock=ours)
+
+        with self.pool.client() as reused:
+            self.assertIs(connection, reused.connection.connection)
@@ -39,11 +39,11 @@ class TestAttachEphemeral(test.NoDBTestCase):
         for patcher in self.patchers:
             patcher.stop()
 
-    @mock.patch.object(storage.utils, 'execute')
+    @mock.patch.object(storage, 'privsep')
     @mock.patch(
         'nova.virt.lxd.storage.driver.block_device_info_get_ephemerals')
     def test_add_ephemerals_with_zfs(
-            self, block_device_info_get_ephemerals, execute):
+            self, block_device_info_get_ephemerals, privsep):
         ctx = context.get_admin_context()
         block_device_info_get_ephemerals.return_value = [
             {'virtual_name': 'ephemerals0'}]
@@ -68,24 +68,17 @@ class TestAttachEphemeral(test.NoDBTestCase):
         block_device_info_get_ephemerals.assert_called_once_with(
             block_device_info)
 
-        expected_calls = [
-            mock.call(
-                'zfs', 'create', '-o',
-                'mountpoint=/i/instance-00000001/storage/ephemerals0', '-o',
-                'quota=0G', 'zfs/instance-00000001-ephemeral',
-                run_as_root=True),
-            mock.call(
-                'chown', '165536', '/i/instance-00000001/storage/ephemerals0',
-                run_as_root=True)
-        ]
+        privsep.zfs_create.assert_called_once_with(
+            'zfs/instance-00000001-ephemeral',
+            '/i/instance-00000001/storage/ephemerals0', 0)
+        privsep.chown.assert_called_once_with(
+            '/i/instance-00000001/storage/ephemerals0', uid=165536)
 
-        self.assertEqual(expected_calls, execute.call_args_list)
-
-    @mock.patch.object(storage.utils, 'execute')
+    @mock.patch.object(storage, 'privsep')
     @mock.patch(
         'nova.virt.lxd.storage.driver.block_device_info_get_ephemerals')
     def test_add_ephemerals_with_btrfs(
-            self, block_device_info_get_ephemerals, execute):
+            self, block_device_info_get_ephemerals, privsep):
         ctx = context.get_admin_context()
         block_device_info_get_ephemerals.return_value = [
             {'virtual_name': 'ephemerals0'}]
@@ -127,30 +120,20 @@ class TestAttachEphemeral(test.NoDBTestCase):
             block_device_info)
         profile.save.assert_called_once_with()
 
-        expected_calls = [
-            mock.call(
-                'btrfs', 'subvolume', 'create',
-                '/var/lib/lxd/containers/instance-00000001/ephemerals0',
-                run_as_root=True),
-            mock.call(
-                'btrfs', 'qgroup', 'limit', '1g',
-                '/var/lib/lxd/containers/instance-00000001/ephemerals0',
-                run_as_root=True),
-            mock.call(
-                'chown', '165536',
-                '/var/lib/lxd/containers/instance-00000001/ephemerals0',
-                run_as_root=True)
-        ]
-        self.assertEqual(expected_calls, execute.call_args_list)
+        privsep.btrfs_subvolume_create.assert_called_once_with(
+            '/var/lib/lxd/containers/instance-00000001/ephemerals0', 1)
+        privsep.chown.assert_called_once_with(
+            '/var/lib/lxd/containers/instance-00000001/ephemerals0',
+            uid=165536)
         self.assertEqual(
             profile.devices['ephemerals0']['source'],
             '/var/lib/lxd/containers/instance-00000001/ephemerals0')
 
-    @mock.patch.object(storage.utils, 'execute')
+    @mock.patch.object(storage, 'privsep')
     @mock.patch(
         'nova.virt.lxd.storage.driver.block_device_info_get_ephemerals')
     def test_ephemeral_with_lvm(
-            self, block_device_info_get_ephemerals, execute):
+            self, block_device_info_get_ephemerals, privsep):
         ctx = context.get_admin_context()
         block_device_info_get_ephemerals.return_value = [
             {'virtual_name': 'ephemerals0'}]
@@ -177,32 +160,23 @@ class TestAttachEphemeral(test.NoDBTestCase):
         block_device_info_get_ephemerals.assert_called_once_with(
             block_device_info)
 
-        expected_calls = [
-            mock.call(
-                'lvcreate', '-L', '0G', '-n', 'instance-00000001-ephemerals0',
-                'lxd', attempts=3, run_as_root=True),
-            mock.call(
-                'mkfs', '-t', 'ext4', '/dev/lxd/instance-00000001-ephemerals0',
-                run_as_root=True),
-            mock.call(
-                'mount', '-t', 'ext4',
-                '/dev/lxd/instance-00000001-ephemerals0',
-                '/i/instance-00000001/storage/ephemerals0',
-                run_as_root=True),
-            mock.call(
-                'chown', '165536', '/i/instance-00000001/storage/ephemerals0',
-                run_as_root=True)]
-        self.assertEqual(expected_calls, execute.call_args_list)
+        privsep.lvm_create_ext4.assert_called_once_with(
+            'lxd', 'instance-00000001-ephemerals0', 0)
+        privsep.mount.assert_called_once_with(
+            '/dev/lxd/instance-00000001-ephemerals0',
+            '/i/instance-00000001/storage/ephemerals0', fstype='ext4')
+        privsep.chown.assert_called_once_with(
+            '/i/instance-00000001/storage/ephemerals0', uid=165536)
 
 
 class TestDetachEphemeral(test.NoDBTestCase):
     """Tests for nova.virt.lxd.storage.detach_ephemeral."""
 
-    @mock.patch.object(storage.utils, 'execute')
+    @mock.patch.object(storage, 'privsep')
     @mock.patch(
         'nova.virt.lxd.storage.driver.block_device_info_get_ephemerals')
     def test_remove_ephemeral_with_zfs(
-            self, block_device_info_get_ephemerals, execute):
+            self, block_device_info_get_ephemerals, privsep):
         block_device_info_get_ephemerals.return_value = [
             {'virtual_name': 'ephemerals0'}]
 
@@ -218,17 +192,14 @@ class TestDetachEphemeral(test.NoDBTestCase):
         block_device_info_get_ephemerals.assert_called_once_with(
             block_device_info)
 
-        expected_calls = [
-            mock.call('zfs', 'destroy', 'zfs/instance-00000001-ephemeral',
-                      run_as_root=True)
-        ]
-        self.assertEqual(expected_calls, execute.call_args_list)
+        privsep.zfs_destroy.assert_called_once_with(
+            'zfs/instance-00000001-ephemeral')
 
-    @mock.patch.object(storage.utils, 'execute')
+    @mock.patch.object(storage, 'privsep')
     @mock.patch(
         'nova.virt.lxd.storage.driver.block_device_info_get_ephemerals')
     def test_remove_ephemeral_with_lvm(
-            self, block_device_info_get_ephemerals, execute):
+            self, block_device_info_get_ephemerals, privsep):
         block_device_info_get_ephemerals.return_value = [
             {'virtual_name': 'ephemerals0'}]
 
@@ -244,12 +215,7 @@ class TestDetachEphemeral(test.NoDBTestCase):
         block_device_info_get_ephemerals.assert_called_once_with(
             block_device_info)
 
-        expected_calls = [
-            mock.call(
-                'umount', '/dev/lxd/instance-00000001-ephemerals0',
-                run_as_root=True),
-            mock.call('lvremove', '-f',
-                      '/dev/lxd/instance-00000001-ephemerals0',
-                      run_as_root=True)
-        ]
-        self.assertEqual(expected_calls, execute.call_args_list)
+        privsep.umount.assert_called_once_with(
+            '/dev/lxd/instance-00000001-ephemerals0')
+        privsep.lvremove.assert_called_once_with(
+            '/dev/lxd/instance-00000001-ephemerals0')
@@ -0,0 +1,147 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import json
+import os
+
+import fixtures
+import mock
+from nova import test
+from pylxd import exceptions as lxdcore_exceptions
+
+from nova.virt.lxd import tracing
+
+
+class _Node(object):
+    """A stand in for the pylxd API node."""
+
+    def __init__(self, response):
+        self.response = response
+        self._api_endpoint = 'http+unix://lxd/1.0'
+
+    def __getattr__(self, name):
+        return _Node(self.response)
+
+    def __getitem__(self, item):
+        return _Node(self.response)
+
+    def get(self, *args, **kwargs):
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class _Instance(object):
+    uuid = 'instance-uuid'
+    flavor = None
+
+
+class _Driver(object):
+
+    @tracing.traced
+    def spawn(self, context, instance):
+        with tracing.timed('privsep', 'chown'):
+            pass
+        return 'spawned'
+
+
+class TracingTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.tracing."""
+
+    def setUp(self):
+        super(TracingTest, self).setUp()
+        self.tracer = tracing.Tracer()
+        self.tracer.sample_rate = 1.0
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.virt.lxd.tracing.TRACER', self.tracer))
+
+    def test_histogram(self):
+        histogram = tracing.Histogram()
+        histogram.add(0.5)
+        histogram.add(3)
+        histogram.add(100000)
+
+        self.assertEqual(3, histogram.count)
+        self.assertEqual(1, histogram.counts[0])
+        self.assertEqual(1, histogram.counts[2])
+        self.assertEqual(1, histogram.counts[-1])
+
+    def test_traced(self):
+        result = _Driver().spawn(None, _Instance())
+
+        snapshot = self.tracer.snapshot()
+        self.assertEqual('spawned', result)
+        self.assertEqual(
+            ['driver:spawn', 'privsep:chown'],
+            sorted(snapshot['histograms']))
+        self.assertEqual(
+            [('privsep', 'chown', 'spawn', 'instance-uuid', 'ok')],
+            [(c['kind'], c['name'], c['method'], c['instance'],
+              c['status']) for c in snapshot['recent']])
+        self.assertEqual((None, None), self.tracer.context)
+
+    def test_disabled(self):
+        self.tracer.sample_rate = 0
+
+        _Driver().spawn(None, _Instance())
+
+        self.assertEqual({}, self.tracer.snapshot()['histograms'])
+
+    def test_api_name(self):
+        self.assertEqual(
+            '1.0/containers/*/state',
+            tracing.api_name(('1.0', 'containers', 'instance-1', 'state')))
+        self.assertEqual(
+            '1.0/images/aliases/*',
+            tracing.api_name(('1.0', 'images', 'aliases', 'ubuntu')))
+
+    def test_traced_api(self):
+        response = mock.Mock(status_code=200, content=b'{"type": "sync"}')
+        api = tracing.TracedAPI(_Node(response))
+
+        self.assertIs(response, api.containers['instance-1'].state.get())
+
+        call = self.tracer.snapshot()['recent'][0]
+        self.assertEqual('GET /1.0/containers/*/state', call['name'])
+        self.assertEqual(200, call['status'])
+        self.assertEqual(16, call['size'])
+        self.assertEqual('http+unix://lxd/1.0', api._api_endpoint)
+
+    def test_traced_api_error(self):
+        error = lxdcore_exceptions.LXDAPIException(
+            mock.Mock(status_code=404))
+        api = tracing.TracedAPI(_Node(error))
+
+        self.assertRaises(lxdcore_exceptions.LXDAPIException,
+                          api.containers['instance-1'].get)
+
+        self.assertEqual(404, self.tracer.snapshot()['recent'][0]['status'])
+
+    def test_dump(self):
+        path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'metrics.json')
+        self.tracer.record('lxd', 'GET /1.0', 0.002, status=200, size=10)
+
+        self.tracer.dump(path)
+
+        with open(path) as f:
+            metrics = json.load(f)
+        self.assertEqual(1, metrics['histograms']['lxd:GET /1.0']['count'])
+        self.assertEqual(1.0, metrics['sample_rate'])
+
+    def test_stats(self):
+        self.tracer.add_stats('transfers', lambda: {'active': 1})
+
+        self.assertEqual({'transfers': {'active': 1}},
+                         self.tracer.snapshot()['stats'])
@@ -203,12 +203,12 @@ class LXDGenericVifDriverTest(test.NoDBTestCase):
         _post_plug_wiring.assert_called_with(INSTANCE, TAP_VIF)
 
     @mock.patch.object(vif, '_post_unplug_wiring')
-    @mock.patch('nova.virt.lxd.vif.linux_net')
+    @mock.patch('nova.virt.lxd.vif.privsep')
     @mock.patch('nova.virt.lxd.vif.os_vif')
-    def test_unplug_tap(self, os_vif, linux_net, _post_unplug_wiring):
+    def test_unplug_tap(self, os_vif, privsep, _post_unplug_wiring):
         self.vif_driver.unplug(INSTANCE, TAP_VIF)
         os_vif.plug.assert_not_called()
-        linux_net.delete_net_dev.assert_called_with('tapda5cc4bf-f1')
+        privsep.delete_net_dev.assert_called_with('tapda5cc4bf-f1')
         _post_unplug_wiring.assert_called_with(INSTANCE, TAP_VIF)
 
 
@@ -297,10 +297,10 @@ class PostPlugTest(test.NoDBTestCase):
 class PostUnplugTest(test.NoDBTestCase):
     """Tests for post unplug operations"""
 
-    @mock.patch('nova.virt.lxd.vif.linux_net')
-    def test_post_unplug_ovs_hybrid(self, linux_net):
+    @mock.patch('nova.virt.lxd.vif.privsep')
+    def test_post_unplug_ovs_hybrid(self, privsep):
         vif._post_unplug_wiring(INSTANCE, OVS_HYBRID_VIF)
-        linux_net.delete_net_dev.assert_called_with('tapda5cc4bf-f1')
+        privsep.delete_net_dev.assert_called_with('tapda5cc4bf-f1')
 
     @mock.patch('nova.virt.lxd.vif.linux_net')
     def test_post_unplug_ovs(self, linux_net):
@@ -309,10 +309,10 @@ class PostUnplugTest(test.NoDBTestCase):
                                                          'tapda5cc4bf-f1',
                                                          True)
 
-    @mock.patch('nova.virt.lxd.vif.linux_net')
-    def test_post_unplug_bridge(self, linux_net):
+    @mock.patch('nova.virt.lxd.vif.privsep')
+    def test_post_unplug_bridge(self, privsep):
         vif._post_unplug_wiring(INSTANCE, LB_VIF)
-        linux_net.delete_net_dev.assert_called_with('tapda5cc4bf-f1')
+        privsep.delete_net_dev.assert_called_with('tapda5cc4bf-f1')
 
 
 class MiscHelpersTest(test.NoDBTestCase):
@@ -323,9 +323,13 @@ class MiscHelpersTest(test.NoDBTestCase):
         self.assertFalse(vif._is_ovs_vif_port(OVS_HYBRID_VIF))
         self.assertFalse(vif._is_ovs_vif_port(TAP_VIF))
 
-    @mock.patch.object(vif, 'utils')
-    def test_add_bridge_port(self, utils):
+    @mock.patch.object(vif, 'privsep')
+    def test_add_bridge_port(self, privsep):
         vif._add_bridge_port('br-int', 'tapXYZ')
-        utils.execute.assert_called_with('brctl', 'addif',
-                                         'br-int', 'tapXYZ',
-                                         run_as_root=True)
+        privsep.add_bridge_port.assert_called_with('br-int', 'tapXYZ')
+
+    @mock.patch.object(vif, 'privsep')
+    def test_create_veth_pair(self, privsep):
+        vif._create_veth_pair('tapXYZ', 'tinXYZ', 1000)
+        privsep.create_veth_pair.assert_called_with(
+            'tapXYZ', 'tinXYZ', 1000)
@@ -0,0 +1,162 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import mock
+from nova import exception
+from nova import test
+from pylxd import exceptions as lxdcore_exceptions
+
+from nova.virt.lxd import warmpool
+
+
+class WarmPoolTest(test.NoDBTestCase):
+    """Tests for nova.virt.lxd.warmpool.WarmPool."""
+
+    def setUp(self):
+        super(WarmPoolTest, self).setUp()
+        self.flags(warm_pool={'image-a': '2'}, pool=None, group='lxd')
+
+        self.client = mock.Mock()
+        self.containers = []
+        self.client.api.containers.get.return_value.json.return_value = {
+            'metadata': self.containers}
+        self.containers_get = {}
+        self.client.containers.get.side_effect = (
+            lambda name: self.containers_get.setdefault(name, mock.Mock()))
+        self.ensure_image = mock.Mock()
+
+        self.pool = warmpool.WarmPool()
+
+    def _add_container(self, name, image_ref):
+        self.containers.append({
+            'name': name, 'config': {warmpool.IMAGE_KEY: image_ref}})
+
+    def _deleted(self):
+        return sorted(name for name, container in self.containers_get.items()
+                      if container.delete.called)
+
+    def test_claim_not_pooled(self):
+        self.assertIsNone(
+            self.pool.claim(self.client, 'image-b', 'instance', mock.Mock()))
+        self.assertFalse(self.client.api.containers.get.called)
+        self.assertEqual({}, self.pool.stats())
+
+    def test_claim_miss(self):
+        self._add_container('instance-00000001', None)
+
+        self.assertIsNone(
+            self.pool.claim(self.client, 'image-a', 'instance', mock.Mock()))
+        self.assertEqual(
+            {'image-a': {'hits': 0, 'misses': 1}}, self.pool.stats())
+
+    def test_claim(self):
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        profile = mock.Mock()
+        profile.name = 'instance'
+
+        container = self.pool.claim(
+            self.client, 'image-a', 'instance', profile)
+
+        self.assertEqual(self.containers_get[warmpool.PREFIX + '1'], container)
+        container.rename.assert_called_once_with('instance', wait=True)
+        self.assertEqual(['instance'], container.profiles)
+        self.assertEqual({}, container.devices)
+        container.config.pop.assert_called_once_with(
+            warmpool.IMAGE_KEY, None)
+        container.save.assert_called_once_with(wait=True)
+        self.assertEqual(
+            {'image-a': {'hits': 1, 'misses': 0}}, self.pool.stats())
+
+    def test_claim_taken(self):
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        self._add_container(warmpool.PREFIX + '2', 'image-a')
+        taken = self.client.containers.get(warmpool.PREFIX + '1')
+        taken.rename.side_effect = lxdcore_exceptions.LXDAPIException(
+            mock.Mock(status_code=404))
+
+        container = self.pool.claim(
+            self.client, 'image-a', 'instance', mock.Mock())
+
+        self.assertEqual(self.containers_get[warmpool.PREFIX + '2'], container)
+
+    def test_claim_deleted(self):
+        """A candidate deleted since it was listed is skipped."""
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        self._add_container(warmpool.PREFIX + '2', 'image-a')
+        second = self.client.containers.get(warmpool.PREFIX + '2')
+        self.client.containers.get.side_effect = [
+            lxdcore_exceptions.NotFound(mock.Mock(status_code=404)), second]
+
+        container = self.pool.claim(
+            self.client, 'image-a', 'instance', mock.Mock())
+
+        self.assertEqual(second, container)
+
+    def test_claim_adopt_fails(self):
+        """A claimed container which cannot be adopted is deleted."""
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        claimed = self.client.containers.get(warmpool.PREFIX + '1')
+        claimed.save.side_effect = lxdcore_exceptions.LXDAPIException(
+            mock.Mock(status_code=500))
+
+        self.assertRaises(
+            lxdcore_exceptions.LXDAPIException, self.pool.claim,
+            self.client, 'image-a', 'instance', mock.Mock())
+        claimed.delete.assert_called_once_with(wait=True)
+        self.assertEqual({}, self.pool.stats())
+
+    def test_refill(self):
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+
+        self.pool.refill(self.client, self.ensure_image)
+
+        self.ensure_image.assert_called_once_with('image-a')
+        self.assertEqual(1, self.client.containers.create.call_count)
+        config = self.client.containers.create.call_args[0][0]
+        self.assertTrue(config['name'].startswith(warmpool.PREFIX))
+        self.assertEqual([], config['profiles'])
+        self.assertEqual(
+            {'root': {'type': 'disk', 'path': '/'}}, config['devices'])
+        self.assertEqual({warmpool.IMAGE_KEY: 'image-a'}, config['config'])
+        self.assertEqual(
+            {'type': 'image', 'alias': 'image-a'}, config['source'])
+
+    def test_refill_trims(self):
+        self.flags(warm_pool={'image-a': '1'}, group='lxd')
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        self._add_container(warmpool.PREFIX + '2', 'image-a')
+
+        self.pool.refill(self.client, self.ensure_image)
+
+        self.assertEqual([warmpool.PREFIX + '2'], self._deleted())
+        self.assertFalse(self.client.containers.create.called)
+
+    def test_refill_unconfigured_image(self):
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        self._add_container(warmpool.PREFIX + '2', 'image-a')
+        self._add_container(warmpool.PREFIX + '3', 'image-b')
+
+        self.pool.refill(self.client, self.ensure_image)
+
+        self.assertEqual([warmpool.PREFIX + '3'], self._deleted())
+
+    def test_refill_deleted_image(self):
+        self._add_container(warmpool.PREFIX + '1', 'image-a')
+        self.ensure_image.side_effect = exception.ImageNotFound(
+            image_id='image-a')
+
+        self.pool.refill(self.client, self.ensure_image)
+
+        self.assertEqual([warmpool.PREFIX + '1'], self._deleted())
+        self.assertFalse(self.client.containers.create.called)
@@ -0,0 +1,167 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import os
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# The cgroup of a container, relative to the root of a hierarchy, in
+# the order LXD releases have used them.
+_CONTAINER_CGROUPS = ('lxc.payload.{}', 'lxc.payload/{}', 'lxc/{}')
+# cgroup v1 mounts the cpuacct controller alone or along with cpu.
+_V1_CPU_CONTROLLERS = ('cpuacct', 'cpu,cpuacct')
+# cgroup v1 reports an unlimited memory limit as the largest page
+# aligned value, rather than as "max".
+_V1_UNLIMITED = 1 << 62
+
+Usage = collections.namedtuple(
+    'Usage', ['cpu_time_ns', 'memory_kb', 'max_memory_kb'])
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _read_stat(path, key):
+    for line in _read(path).splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == key:
+            return int(fields[1])
+    raise ValueError('No {} in {}'.format(key, path))
+
+
+class CgroupSampler(object):
+    """Sample the CPU time and memory of containers from their cgroups.
+
+    The cgroup of each container is looked up in the cgroup v2 unified
+    hierarchy, or in the cpuacct and memory hierarchies of cgroup v1,
+    and remembered until reading it fails, which happens when the
+    container stops.
+
+    Every container asked about during a sampling interval is sampled
+    again, all at once, on the first request of the next interval. The
+    reads are of cgroup files only, and cost no LXD API call.
+    """
+
+    def __init__(self, interval, root=CGROUP_ROOT):
+        self._interval = interval
+        self._root = root
+        self._unified = None
+        self._paths = {}
+        self._samples = {}
+        self._missing = set()
+        self._sampled_at = None
+
+    @property
+    def unified(self):
+        """Whether the host uses the cgroup v2 unified hierarchy."""
+        if self._unified is None:
+            self._unified = os.path.exists(
+                os.path.join(self._root, 'cgroup.controllers'))
+        return self._unified
+
+    def _find(self, hierarchy, name):
+        for cgroup in _CONTAINER_CGROUPS:
+            path = os.path.join(self._root, hierarchy, cgroup.format(name))
+            if os.path.isdir(path):
+                return path
+        return None
+
+    def _resolve(self, name):
+        """Return the (cpu, memory) cgroup directories of a container."""
+        paths = self._paths.get(name)
+        if paths is not None:
+            return paths
+        if self.unified:
+            path = self._find('', name)
+            paths = path and (path, path)
+        else:
+            cpu = None
+            for controller in _V1_CPU_CONTROLLERS:
+                cpu = self._find(controller, name)
+                if cpu:
+                    break
+            memory = self._find('memory', name)
+            paths = cpu and memory and (cpu, memory)
+        if paths:
+            self._paths[name] = paths
+        return paths
+
+    def _read_usage(self, cpu, memory):
+        if self.unified:
+            cpu_time_ns = _read_stat(
+                os.path.join(cpu, 'cpu.stat'), 'usage_usec') * 1000
+            usage = int(_read(os.path.join(memory, 'memory.current')))
+            limit = _read(os.path.join(memory, 'memory.max'))
+            limit = None if limit == 'max' else int(limit)
+        else:
+            cpu_time_ns = int(_read(os.path.join(cpu, 'cpuacct.usage')))
+            usage = int(_read(
+                os.path.join(memory, 'memory.usage_in_bytes')))
+            limit = int(_read(
+                os.path.join(memory, 'memory.limit_in_bytes')))
+            if limit >= _V1_UNLIMITED:
+                limit = None
+        return Usage(cpu_time_ns, usage >> 10, limit and limit >> 10)
+
+    def _sample_one(self, name):
+        paths = self._resolve(name)
+        if not paths:
+            return None
+        try:
+            return self._read_usage(*paths)
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug('Failed to read the cgroup of %(name)s: %(error)s',
+                      {'name': name, 'error': e})
+            self._paths.pop(name, None)
+            return None
+
+    def _record(self, name):
+        usage = self._sample_one(name)
+        if usage is None:
+            self._missing.add(name)
+        else:
+            self._samples[name] = usage
+
+    def _sample(self, names):
+        self._samples = {}
+        self._missing = set()
+        for name in names:
+            self._record(name)
+        self._sampled_at = time.time()
+
+    def get(self, name):
+        """Return the Usage of a container, or None if it cannot be read.
+
+        None is returned for containers that are not running.
+        """
+        if (self._sampled_at is None or
+                time.time() - self._sampled_at >= self._interval):
+            self._sample(set(self._samples) | {name})
+        elif name not in self._samples and name not in self._missing:
+            self._record(name)
+        return self._samples.get(name)
+
+    def forget(self, name):
+        """Stop sampling a container, as it was deleted."""
+        self._paths.pop(name, None)
+        self._samples.pop(name, None)
+        self._missing.discard(name)
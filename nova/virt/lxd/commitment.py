@@ -0,0 +1,62 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+from nova.virt.lxd import flavor
+
+
+class Commitment(object):
+    """Track the vcpus and memory committed to instance containers.
+
+    The limits of every instance profile are read once, from a single
+    listing of the profiles, the first time the totals are needed.
+    After that the driver records each profile it creates, updates or
+    deletes, and the totals are kept up to date as it does.
+    """
+
+    def __init__(self):
+        self._limits = {}
+        self._vcpus = 0
+        self._memory_mb = 0
+        self._loaded = False
+
+    def set(self, name, limits):
+        """Record the Limits of the profile of an instance."""
+        self.remove(name)
+        self._limits[name] = limits
+        self._vcpus += limits.vcpus
+        self._memory_mb += limits.memory_mb
+
+    def remove(self, name):
+        """Forget the profile of an instance, as it was deleted."""
+        limits = self._limits.pop(name, None)
+        if limits is not None:
+            self._vcpus -= limits.vcpus
+            self._memory_mb -= limits.memory_mb
+
+    def _load(self, client):
+        response = client.api.profiles.get(params={'recursion': 1})
+        for profile in response.json()['metadata']:
+            config = profile.get('config') or {}
+            if config.get('environment.product_name') != 'OpenStack Nova':
+                continue
+            # What was recorded while the listing was fetched is newer.
+            if profile['name'] not in self._limits:
+                self.set(profile['name'], flavor.profile_limits(config))
+        self._loaded = True
+
+    def totals(self, client):
+        """Return the Limits committed to all instances together."""
+        if not self._loaded:
+            self._load(client)
+        return flavor.Limits(self._vcpus, self._memory_mb)
@@ -14,9 +14,28 @@
 #    under the License.
 import collections
 import os
+import sys
+import threading
 
+import eventlet
 from nova import conf
+from nova import utils
+from oslo_log import log as logging
+from pylxd import exceptions as lxd_exceptions
+import six
 
+from nova.virt.lxd import tracing
+
+LOG = logging.getLogger(__name__)
+
+
+# Containers nova-lxd creates for its own use, rather than for an
+# instance, are named with this prefix.
+INTERNAL_PREFIX = 'nova-lxd-'
+
+# The profile of every instance container records the uuid of its
+# instance in this key.
+INSTANCE_UUID_KEY = 'user.nova-lxd.instance-uuid'
 
 _InstanceAttributes = collections.namedtuple('InstanceAttributes', [
     'instance_dir', 'console_path', 'storage_path', 'container_path'])
@@ -31,3 +50,218 @@ def InstanceAttributes(instance):
         conf.CONF.lxd.root_dir, 'containers', instance.name)
     return _InstanceAttributes(
         instance_dir, console_path, storage_path, container_path)
+
+
+def internal_container_config(name, image_ref, config):
+    """Return the creation config of an internal container.
+
+    Internal containers are created stopped from `image_ref`, without
+    profiles. They get a root disk of their own instead, which is
+    dropped by `adopt_container` once the container is handed to an
+    instance.
+    """
+    root = {'type': 'disk', 'path': '/'}
+    if conf.CONF.lxd.pool:
+        root['pool'] = conf.CONF.lxd.pool
+    return {
+        'name': name,
+        'profiles': [],
+        'devices': {'root': root},
+        'config': config,
+        'source': {'type': 'image', 'alias': image_ref},
+    }
+
+
+def list_containers(client, state=False):
+    """Return every container, with its config, in a single request.
+
+    With `state`, the state of the containers is included too, under
+    the 'state' key. LXD releases before 3.0 do not include it in the
+    listing, so it is then fetched for each container that is not
+    internal to nova-lxd.
+    """
+    response = client.api.containers.get(
+        params={'recursion': 2 if state else 1})
+    containers = response.json()['metadata']
+    if not state:
+        return containers
+    for container in containers:
+        if container.get('state') is not None:
+            continue
+        if container['name'].startswith(INTERNAL_PREFIX):
+            continue
+        try:
+            container['state'] = client.api.containers[
+                container['name']].state.get().json()['metadata']
+        except lxd_exceptions.LXDAPIException as e:
+            if e.response.status_code != 404:
+                raise
+    return containers
+
+
+def adopt_container(container, profile, key, config=None):
+    """Turn an internal container into an instance container.
+
+    The instance profile replaces the local devices of the container,
+    and the `key` marking it as internal is removed from its config.
+    `config` is added to the config of the container.
+    """
+    container.sync()
+    container.profiles = [profile.name]
+    container.devices = {}
+    container.config.pop(key, None)
+    if config:
+        container.config.update(config)
+    container.save(wait=True)
+
+
+def discard_container(container):
+    """Delete a container which could not be made an instance's.
+
+    Such a container is already named after the instance, so leaving
+    it behind would make the next spawn of the instance fail.
+    """
+    try:
+        container.delete(wait=True)
+    except lxd_exceptions.LXDAPIException as e:
+        LOG.warning('Failed to delete container %(name)s: %(reason)s',
+                    {'name': container.name, 'reason': e})
+
+
+class _Flight(object):
+    """A call in progress on behalf of a SingleFlight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.waiters = 0
+
+    def wait(self):
+        self.done.wait()
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+        return self.result
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key into a single call.
+
+    The first thread to call `do` for a key runs the function; threads
+    calling `do` with the same key while it is running wait for it and
+    get its result, or have its exception raised. A call made after the
+    first one has returned runs the function again.
+
+    This only coalesces calls within this process, callers still need
+    an external lock if other processes may do the same work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                flight.waiters += 1
+                leader = False
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.result = function(*args, **kwargs)
+            return flight.result
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self, key):
+        """Return the number of callers waiting on a call for key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight.waiters if flight is not None else 0
+
+
+class TaskGraph(object):
+    """Run a set of interdependent steps concurrently.
+
+    Each step is added with the names of the steps it requires, and is
+    started on its own green thread as soon as they have all completed.
+    When a step fails no further steps are started; `run` waits for the
+    steps already running, then raises the first failure. The return
+    values of completed steps are kept in `results` either way, so
+    callers can tell what needs to be rolled back. The calls made by
+    the steps are traced as those of the method calling `run`.
+    """
+
+    def __init__(self):
+        self._steps = collections.OrderedDict()
+        self.results = {}
+
+    def add(self, name, function, *args, **kwargs):
+        """Add a step.
+
+        :param name: the name of the step
+        :param function: the callable run for the step, with the
+                         remaining arguments
+        :param requires: the names of the steps that must complete
+                         before this one starts
+        """
+        requires = tuple(kwargs.pop('requires', ()))
+        for required in requires:
+            if required not in self._steps:
+                raise ValueError(
+                    'Step {} requires unknown step {}'.format(name, required))
+        self._steps[name] = (requires, function, args, kwargs)
+
+    def _run_step(self, name, function, args, kwargs, done, context):
+        try:
+            with tracing.TRACER.tagged(*context):
+                result = function(*args, **kwargs)
+            done.put((name, result, None))
+        except BaseException:
+            # Anything escaping the green thread would leave run()
+            # waiting forever, so even timeouts are handed back.
+            done.put((name, None, sys.exc_info()))
+
+    def run(self):
+        """Run every step, returning the results by step name."""
+        done = eventlet.queue.LightQueue()
+        # The tracing context is local to each green thread.
+        context = tracing.TRACER.context
+        pending = collections.OrderedDict(self._steps)
+        running = 0
+        failure = None
+
+        while True:
+            if failure is None:
+                for name, (requires, function, args, kwargs) in list(
+                        pending.items()):
+                    if all(r in self.results for r in requires):
+                        del pending[name]
+                        running += 1
+                        utils.spawn_n(
+                            self._run_step, name, function, args, kwargs,
+                            done, context)
+            if not running:
+                break
+
+            name, result, exc_info = done.get()
+            running -= 1
+            if exc_info is not None:
+                if failure is None:
+                    failure = exc_info
+            else:
+                self.results[name] = result
+
+        if failure is not None:
+            six.reraise(*failure)
+        return self.results
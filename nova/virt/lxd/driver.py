@@ -16,16 +16,13 @@
 from __future__ import absolute_import
 
 import errno
-import io
 import json
 import os
 import platform
-import pwd
 import shutil
 import socket
 import tarfile
 import tempfile
-import hashlib
 
 import eventlet
 import nova.conf
@@ -46,11 +43,24 @@ from oslo_log import log as logging
 from oslo_utils import fileutils
 import pylxd
 from pylxd import exceptions as lxd_exceptions
+import six
 
 from nova.virt.lxd import vif as lxd_vif
+from nova.virt.lxd import cgroup
 from nova.virt.lxd import common
+from nova.virt.lxd import commitment
+from nova.virt.lxd import events
 from nova.virt.lxd import flavor
+from nova.virt.lxd import golden
+from nova.virt.lxd import host as lxd_host
+from nova.virt.lxd import image as lxd_image
+from nova.virt.lxd import imagecache
+from nova.virt.lxd import nocloud
+from nova.virt.lxd import privsep
+from nova.virt.lxd import profiler
 from nova.virt.lxd import storage
+from nova.virt.lxd import tracing
+from nova.virt.lxd import warmpool
 
 from nova.api.metadata import base as instance_metadata
 from nova.objects import fields as obj_fields
@@ -81,9 +91,147 @@ lxd_opts = [
     cfg.IntOpt('timeout',
                default=-1,
                help='Default LXD timeout'),
+    cfg.DictOpt('operation_timeouts',
+                default={},
+                help='Seconds LXD operations are given to finish, by '
+                     'the text of their description, for example '
+                     '"Creating container:600,Stopping container:60". '
+                     'Other operations are given [lxd] timeout seconds. '
+                     'An operation still running past its deadline is '
+                     'cancelled, and the nova operation fails.'),
     cfg.BoolOpt('allow_live_migration',
                 default=False,
                 help='Determine wheter to allow live migration'),
+    cfg.IntOpt('image_cache_size_gb',
+               default=0,
+               min=0,
+               help='Size budget, in GB, for unused glance images kept '
+                    'in the LXD image store. Images in use, and images '
+                    'used more recently than image_cache_min_age, do '
+                    'not count against it. Unused images are removed '
+                    'least recently used first until the cache fits. '
+                    '0 removes every unused image older than '
+                    'image_cache_min_age.'),
+    cfg.IntOpt('image_cache_min_age',
+               default=86400,
+               min=0,
+               help='Number of seconds an image must have been unused '
+                    'before it can be removed from the LXD image store'),
+    cfg.IntOpt('max_concurrent_image_downloads',
+               default=0,
+               min=0,
+               help='Maximum number of glance images downloaded at the '
+                    'same time. Further downloads wait for a free slot. '
+                    '0 means unlimited.'),
+    cfg.IntOpt('image_download_bandwidth_mb',
+               default=0,
+               min=0,
+               help='Aggregate bandwidth, in MB per second, used by '
+                    'all glance image downloads on the host. 0 means '
+                    'unlimited.'),
+    cfg.StrOpt('image_staging_dir',
+               default=None,
+               help='Directory glance images are downloaded to before '
+                    'they are imported into LXD. It should be on the '
+                    'same filesystem as the LXD storage. Defaults to '
+                    'the system temporary directory.'),
+    cfg.DictOpt('warm_pool',
+                default={},
+                help='Number of stopped containers to keep created ahead '
+                     'of time for frequently used images, as '
+                     'image_ref:count pairs. Spawning an instance of one '
+                     'of these images takes a container from the pool '
+                     'instead of creating a new one.'),
+    cfg.BoolOpt('clone_from_golden',
+                default=False,
+                help='Create instance containers as copies of a stopped '
+                     'golden container of their image, rather than from '
+                     'the image itself. This avoids unpacking the image '
+                     'for every container, and uses clones or reflinks '
+                     'where the storage backend supports them.'),
+    cfg.BoolOpt('config_drive_direct',
+                default=False,
+                help='Write config drive files straight into the '
+                     'instance directory, instead of building an ISO '
+                     'image and copying its contents out of a loop '
+                     'mount. No root commands are run, and the files '
+                     'are made readable by the container instead of '
+                     'owned by its root user.'),
+    cfg.StrOpt('metadata_delivery',
+               default='configdrive',
+               choices=('configdrive', 'cloud-init'),
+               help='How instance metadata is handed to instances. '
+                    '"configdrive" builds a config drive when one is '
+                    'required. "cloud-init" sets the user.meta-data, '
+                    'user.user-data and user.network-config keys of the '
+                    'container for the cloud-init NoCloud datasource '
+                    'when the image has lxd_nocloud=true, unless files '
+                    'are injected or an admin password is set. A config '
+                    'drive is used otherwise.'),
+    cfg.BoolOpt('watch_events',
+                default=False,
+                help='Follow the LXD events stream, and answer get_info '
+                     'and list_instances from a cache of container '
+                     'states which the events keep up to date, instead '
+                     'of querying LXD on every call. Containers that '
+                     'start, stop, freeze or are deleted outside of nova '
+                     'are then also reported to nova as lifecycle '
+                     'events.'),
+    cfg.IntOpt('cgroup_sample_interval',
+               default=10,
+               min=0,
+               help='Seconds for which get_info reuses the CPU time and '
+                    'memory usage read from the cgroups of containers. '
+                    'All the containers are read again together once '
+                    'this interval has passed.'),
+    cfg.IntOpt('host_sample_interval',
+               default=30,
+               min=0,
+               help='Seconds between two samples of the memory, disk '
+                    'and CPU usage of the host, which a background '
+                    'thread takes for get_available_resource and '
+                    'get_host_cpu_stats. The CPU topology is only read '
+                    'once. 0 reads the host on every call.'),
+    cfg.FloatOpt('trace_sample_rate',
+                 default=0.0,
+                 min=0.0,
+                 max=1.0,
+                 help='Fraction of the LXD API requests, privileged '
+                      'operations and commands of the driver whose '
+                      'latency is recorded, tagged with the driver '
+                      'method and instance they were made for. Driver '
+                      'methods are timed whenever this is above 0. The '
+                      'latencies are aggregated into histograms.'),
+    cfg.StrOpt('trace_metrics_file',
+               default=None,
+               help='File the traced latency histograms, the most '
+                    'recent traced calls, the image transfer and warm '
+                    'pool statistics and the number of privileged '
+                    'operations are written to as JSON every minute. The '
+                    'statistics are written even when '
+                    'trace_sample_rate is 0.'),
+    cfg.StrOpt('profile_dir',
+               default=None,
+               help='Directory profiles of the spawn, destroy, snapshot '
+                    'and get_available_resource calls, and of the resync '
+                    'of instances in init_host, are written to, one '
+                    'file per call and profiling mode, named after '
+                    'the method, instance and time of the call. '
+                    'Profiling is only available when this is set.'),
+    cfg.ListOpt('profile_modes',
+                default=['cprofile'],
+                help='How driver calls are profiled: any of cprofile, '
+                     'sampling, for the stacks of the green threads '
+                     'sampled every 5ms, and tracemalloc, for the '
+                     'memory allocated during the call (Python 3 only).'),
+    cfg.BoolOpt('profile_enabled',
+                default=False,
+                help='Profile driver calls from the start, rather than '
+                     'once profile_signal is received.'),
+    cfg.StrOpt('profile_signal',
+               default=None,
+               help='Name of a signal, such as SIGUSR1, which switches '
+                    'the profiling of driver calls on and off.'),
 ]
 
 CONF = cfg.CONF
@@ -139,7 +287,8 @@ def _get_cpu_info():
     returning a dictionary of information.
     """
     cpuinfo = {}
-    out, err = utils.execute('lscpu')
+    with tracing.timed('execute', 'lscpu'):
+        out, err = utils.execute('lscpu')
     if err:
         msg = _('Unable to parse lscpu output.')
         raise exception.NovaException(msg)
@@ -195,10 +344,7 @@ def _get_fs_info(path):
 def _get_zpool_info(pool):
     """Get free/used/total disk space in a zfs pool."""
     def _get_zpool_attribute(attribute):
-        value, err = utils.execute('zpool', 'list',
-                                   '-o', attribute,
-                                   '-H', pool,
-                                   run_as_root=True)
+        value, err = privsep.zpool_attribute(pool, attribute)
         if err:
             msg = _('Unable to parse zpool output.')
             raise exception.NovaException(msg)
@@ -214,6 +360,29 @@ def _get_zpool_info(pool):
             'used': used}
 
 
+def _get_storage_pool_info(client, pool=None):
+    """Get free/used/total disk space from LXD storage pools.
+
+    The space of `pool` is returned, or, when no pool is given, the
+    total space of every storage pool of the host. LXD reports it for
+    all storage drivers, so no command needs to be run here.
+    """
+    pools_api = client.api['storage-pools']
+    if pool:
+        pools = [pool]
+    else:
+        pools = [url.rsplit('/', 1)[-1]
+                 for url in pools_api.get().json()['metadata']]
+    total = used = 0
+    for name in pools:
+        resources = pools_api[name].resources.get().json()['metadata']
+        total += resources['space']['total']
+        used += resources['space']['used']
+    return {'total': total,
+            'available': total - used,
+            'used': used}
+
+
 def _get_power_state(lxd_state):
     """Take a lxd state code and translate it to nova power state."""
     state_map = [
@@ -229,14 +398,50 @@ def _get_power_state(lxd_state):
     raise ValueError('Unknown LXD power state: {}'.format(lxd_state))
 
 
-def _sync_glance_image_to_lxd(client, context, image_ref):
+def _glance_fingerprint(image):
+    """Return the sha256 glance computed for an image, if it has one.
+
+    For unified images this is the fingerprint LXD gives the image.
+    Older glance releases pass the os_hash_* attributes as properties.
+    """
+    properties = image.get('properties', {})
+    algo = image.get('os_hash_algo') or properties.get('os_hash_algo')
+    if algo == 'sha256':
+        return image.get('os_hash_value') or properties.get('os_hash_value')
+
+
+def _alias_existing_image(client, image_cache, fingerprint, image_ref,
+                          checksum):
+    """Alias an image already in the LXD image store to image_ref.
+
+    Returns the LXD image, or None if there is no image with the
+    fingerprint.
+    """
+    if not client.images.exists(fingerprint):
+        return None
+    LOG.info(
+        'Image with fingerprint %(fingerprint)s already exists'
+        'but not accessible by alias %(alias)s, add alias',
+        {'fingerprint': fingerprint, 'alias': image_ref})
+    lxdimage = client.images.get(fingerprint)
+    lxdimage.add_alias(image_ref, '')
+    image_cache.register(image_ref, lxdimage, checksum=checksum)
+    return lxdimage
+
+
+def _sync_glance_image_to_lxd(client, context, image_ref, image_cache,
+                              transfers):
     """Sync an image from glance to LXD image store.
 
     The image from glance can't go directly into the LXD image store,
     as LXD needs some extra metadata connected to it.
 
     The image is stored in the LXD image store with an alias to
-    the image_ref. This way, it will only copy over once.
+    the image_ref. This way, it will only copy over once. The alias
+    is registered with the image cache manager. The download runs
+    within the limits of the `transfers` scheduler.
+
+    Returns the LXD image.
     """
     lock_path = os.path.join(CONF.instances_path, 'locks')
     with lockutils.lock(
@@ -248,21 +453,57 @@ def _sync_glance_image_to_lxd(client, context, image_ref):
         #                  sneak infront of this one and create
         #                  the same image already.
         try:
-            client.images.get_by_alias(image_ref)
-            return
+            return client.images.get_by_alias(image_ref)
         except lxd_exceptions.LXDAPIException as e:
             if e.response.status_code != 404:
                 raise
 
+        image_file = None
         try:
-            image_file = tempfile.mkstemp()[1]
-            manifest_file = tempfile.mkstemp()[1]
-
             image = IMAGE_API.get(context, image_ref)
             if image.get('disk_format') not in ACCEPTABLE_IMAGE_FORMATS:
                 raise exception.ImageUnacceptable(
                     image_id=image_ref, reason=_('Bad image format'))
-            IMAGE_API.download(context, image_ref, dest_path=image_file)
+            checksum = image.get('checksum')
+
+            # Glance may already know the LXD fingerprint of the image,
+            # either from its own sha256 or because the same data was
+            # imported before under another image id. In that case there
+            # is nothing to download.
+            for fingerprint in (_glance_fingerprint(image),
+                                image_cache.lookup(checksum)):
+                if fingerprint:
+                    lxdimage = _alias_existing_image(
+                        client, image_cache, fingerprint, image_ref,
+                        checksum)
+                    if lxdimage:
+                        return lxdimage
+            staging_dir = CONF.lxd.image_staging_dir
+            if staging_dir:
+                fileutils.ensure_tree(staging_dir)
+            else:
+                staging_dir = tempfile.gettempdir()
+            # Refuse to start a download that cannot fit, rather than
+            # filling the filesystem and failing part way through.
+            available = lxd_image.free_space(staging_dir)
+            if image.get('size') and image['size'] > available:
+                msg = _('Not enough space in %(dir)s to stage the image: '
+                        '%(size)d bytes needed, %(free)d available') % {
+                    'dir': staging_dir, 'size': image['size'],
+                    'free': available}
+                raise exception.ImageUnacceptable(
+                    image_id=image_ref, reason=msg)
+
+            # The image is fingerprinted and probed for an embedded
+            # metadata.yaml as it is written to disk, so the downloaded
+            # file is only read again to upload it to LXD.
+            fd, image_file = tempfile.mkstemp(dir=staging_dir)
+            with transfers.transfer(image_ref), \
+                    os.fdopen(fd, 'wb') as image_fh:
+                writer = lxd_image.ImageWriter(
+                    image_fh, throttle=transfers.throttle)
+                IMAGE_API.download(context, image_ref, data=writer)
+                writer.close()
 
             # It is possible that LXD already have the same image
             # but NOT aliased as result of previous publish/export operation
@@ -274,32 +515,10 @@ def _sync_glance_image_to_lxd(client, context, image_ref):
             # fingerprint of image as LXD do it and check if LXD already have
             # image with such fingerprint.
             # If any we will add alias to this image and will not re-import it
-            def add_alias():
-
-                def lxdimage_fingerprint():
-                    def sha256_file():
-                        sha256 = hashlib.sha256()
-                        with closing(open(image_file, 'rb')) as f:
-                            for block in iter(lambda: f.read(65536), b''):
-                                sha256.update(block)
-                        return sha256.hexdigest()
-
-                    return sha256_file()
-
-                fingerprint = lxdimage_fingerprint()
-                if client.images.exists(fingerprint):
-                    LOG.info(
-                        'Image with fingerprint %(fingerprint)s already exists'
-                        'but not accessible by alias %(alias)s, add alias',
-                        {'fingerprint': fingerprint, 'alias': image_ref})
-                    lxdimage = client.images.get(fingerprint)
-                    lxdimage.add_alias(image_ref, '')
-                    return True
-
-                return False
-
-            if add_alias():
-                return
+            lxdimage = _alias_existing_image(
+                client, image_cache, writer.fingerprint, image_ref, checksum)
+            if lxdimage:
+                return lxdimage
 
             # up2date LXD publish/export operations produce images which
             # already contains /rootfs and metdata.yaml in exported file.
@@ -309,6 +528,12 @@ def _sync_glance_image_to_lxd(client, context, image_ref):
             # Try to detect if image content already has metadata and not pass
             # explicit metadata in that case
             def imagefile_has_metadata(image_file):
+                if writer.has_metadata is not None:
+                    return writer.has_metadata
+
+                # NOTE: the stream could not be probed while downloading
+                #       (e.g. xz compression without lzma support), so
+                #       fall back to reading the archive.
                 try:
                     with closing(tarfile.TarFile.open(
                         name=image_file, mode='r:*')) as tf:
@@ -326,7 +551,7 @@ def _sync_glance_image_to_lxd(client, context, image_ref):
                          'skipping metadata injection...',
                          {'alias': image_ref})
                 with open(image_file, 'rb') as image:
-                    image = client.images.create(image.read(), wait=True)
+                    image = lxd_image.upload(client, image)
             else:
                 metadata = {
                     'architecture': image.get(
@@ -338,23 +563,39 @@ def _sync_glance_image_to_lxd(client, context, image_ref):
                     separators=(',', ': '),
                     ensure_ascii=False).encode('utf-8') + b"\n"
 
-                tarball = tarfile.open(manifest_file, "w:gz")
-                tarinfo = tarfile.TarInfo(name='metadata.yaml')
-                tarinfo.size = len(metadata_yaml)
-                tarball.addfile(tarinfo, io.BytesIO(metadata_yaml))
-                tarball.close()
-
-                with open(manifest_file, 'rb') as manifest:
-                    with open(image_file, 'rb') as image:
-                        image = client.images.create(
-                            image.read(), metadata=manifest.read(),
-                            wait=True)
+                manifest = lxd_image.metadata_tarball(metadata_yaml)
+                with open(image_file, 'rb') as image:
+                    image = lxd_image.upload(
+                        client, image, metadata=manifest)
 
             image.add_alias(image_ref, '')
+            image_cache.register(image_ref, image, checksum=checksum)
+            return image
 
         finally:
-            os.unlink(image_file)
-            os.unlink(manifest_file)
+            if image_file is not None:
+                os.unlink(image_file)
+
+
+def _write_configdrive(instance_md, path):
+    """Write the config drive files of an instance under path.
+
+    The files are left owned by nova, readable by everyone, so that the
+    container can read them through its idmap without anything being
+    run as root.
+    """
+    for name, data in instance_md.metadata_for_config_drive():
+        file_path = os.path.join(path, name)
+        fileutils.ensure_tree(os.path.dirname(file_path))
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        os.chmod(file_path, 0o644)
+
+    # The umask may have left the directories unreadable.
+    for dir_path, dirs, files in os.walk(path):
+        os.chmod(dir_path, 0o755)
 
 
 def brick_get_connector_properties(multipath=False, enforce_multipath=False):
@@ -410,7 +651,7 @@ class LXDDriver(driver.ComputeDriver):
     """
 
     capabilities = {
-        "has_imagecache": False,
+        "has_imagecache": True,
         "supports_recreate": False,
         "supports_migrate_to_same_host": False,
         "supports_attach_interface": True
@@ -425,6 +666,37 @@ class LXDDriver(driver.ComputeDriver):
         self.vif_driver = lxd_vif.LXDGenericVifDriver()
         self.firewall_driver = firewall.load_driver(
             default='nova.virt.firewall.NoopFirewallDriver')
+        self.image_cache = imagecache.ImageCacheManager()
+        self._image_syncs = common.SingleFlight()
+        self.image_transfers = lxd_image.TransferScheduler(
+            CONF.lxd.max_concurrent_image_downloads,
+            CONF.lxd.image_download_bandwidth_mb * units.Mi)
+        self.warm_pool = warmpool.WarmPool()
+        self._warm_images = set()
+        self.golden = golden.GoldenContainers()
+        self.state_cache = events.StateCache()
+        self.events = events.EventListener()
+        self.events.add_handler(self.state_cache)
+        self.operations = events.OperationTracker(
+            CONF.lxd.operation_timeouts, CONF.lxd.timeout)
+        self.events.add_handler(self.operations)
+        self.lifecycle = events.LifecycleEmitter(
+            self.emit_event, self._instance_uuid)
+        self.state_cache.add_observer(self.lifecycle.changed)
+        self._instance_uuids = {}
+        self._unknown_names = set()
+        self.cgroups = cgroup.CgroupSampler(CONF.lxd.cgroup_sample_interval)
+        tracing.TRACER.sample_rate = CONF.lxd.trace_sample_rate
+        profiler.PROFILER.configure(
+            CONF.lxd.profile_dir, CONF.lxd.profile_modes,
+            CONF.lxd.profile_enabled)
+        self.commitment = commitment.Commitment()
+        self.host_metrics = lxd_host.HostSampler(
+            CONF.lxd.host_sample_interval)
+        self.host_metrics.add_probe('cpu_info', _get_cpu_info, static=True)
+        self.host_metrics.add_probe('memory', _get_ram_usage)
+        self.host_metrics.add_probe('disk', self._get_local_disk_info)
+        self.host_metrics.add_probe('cpu_times', psutil.cpu_times)
 
     def init_host(self, host):
         """Initialize the driver on the host.
@@ -444,49 +716,104 @@ class LXDDriver(driver.ComputeDriver):
         except lxd_exceptions.ClientConnectionFailed as e:
             msg = _('Unable to connect to LXD daemon: %s') % e
             raise exception.HostNotFound(msg)
+        # Operations waited for by pylxd go through the tracker.
+        self.client.operations = events.TrackedOperations(
+            self.client, self.operations)
+        if tracing.TRACER.enabled:
+            tracing.trace_client(self.client)
+        if CONF.lxd.trace_metrics_file:
+            tracing.TRACER.add_stats(
+                'image_transfers', self.image_transfers.stats)
+            tracing.TRACER.add_stats('warm_pool', self.warm_pool.stats)
+            tracing.TRACER.add_stats('privsep_calls', privsep.stats)
+            tracing.TRACER.start_dumping(CONF.lxd.trace_metrics_file)
+        if CONF.lxd.profile_signal:
+            profiler.PROFILER.install_signal(CONF.lxd.profile_signal)
         self._after_reboot()
+        if CONF.lxd.warm_pool:
+            utils.spawn_n(self._refill_warm_pool)
+        if CONF.lxd.watch_events:
+            self.lifecycle.start()
+            self.events.start(self.client)
+        self.host_metrics.start()
 
     def cleanup_host(self, host):
         """Clean up the host.
 
-        `nova.virt.ComputeDriver` defines this method. It is overridden
-        here to be explicit that there is nothing to be done, as
-        `init_host` does not create any resources that would need to be
-        cleaned up.
+        The LXD events stream is closed, if `init_host` opened it.
 
         See `nova.virt.driver.ComputeDriver.cleanup_host` for more
         information.
         """
+        self.events.stop()
+        self.lifecycle.stop()
+        self.host_metrics.stop()
 
+    @tracing.traced
     def get_info(self, instance):
         """Return an InstanceInfo object for the instance."""
-        try:
-            container = self.client.containers.get(instance.name)
-        except lxd_exceptions.NotFound:
+        state = self.state_cache.get(self.client, instance.name)
+        if state is None:
             raise exception.InstanceNotFound(instance_id=instance.uuid)
 
-        state = container.state()
-        mem_kb = state.memory['usage'] >> 10
-        max_mem_kb = state.memory['usage_peak'] >> 10
+        usage = None
+        if state.status_code != events.STOPPED:
+            usage = self.cgroups.get(instance.name)
+        if usage is None:
+            # The cgroups of the container cannot be read, so fall back
+            # to what LXD reports, which has no CPU time.
+            mem_kb = state.memory['usage'] >> 10
+            max_mem_kb = state.memory['usage_peak'] >> 10
+            cpu_time_ns = 0
+        else:
+            mem_kb = usage.memory_kb
+            max_mem_kb = (usage.max_memory_kb or
+                          instance.flavor.memory_mb * units.Ki)
+            cpu_time_ns = usage.cpu_time_ns
         return hardware.InstanceInfo(
             state=_get_power_state(state.status_code),
             max_mem_kb=max_mem_kb,
             mem_kb=mem_kb,
             num_cpu=instance.flavor.vcpus,
-            cpu_time_ns=0)
+            cpu_time_ns=cpu_time_ns)
 
     def list_instances(self):
         """Return a list of all instance names."""
-        return [c.name for c in self.client.containers.all()]
+        return [name for name in self.state_cache.names(self.client)
+                if not name.startswith(common.INTERNAL_PREFIX)]
 
+    def list_instance_uuids(self):
+        """Return the uuids of all instances, from a single request.
+
+        Only instances whose profile records their uuid can be listed.
+        When a container was created by an older nova-lxd, and its
+        profile has not been updated since, NotImplementedError is
+        raised so that nova falls back to `list_instances`.
+        """
+        uuids = []
+        for container in common.list_containers(self.client):
+            config = container.get('expanded_config') or {}
+            if config.get('environment.product_name') != 'OpenStack Nova':
+                continue
+            uuid = config.get(common.INSTANCE_UUID_KEY)
+            if uuid is None:
+                raise NotImplementedError()
+            if uuid not in uuids:
+                uuids.append(uuid)
+        return uuids
+
+    @tracing.traced
+    @profiler.profiled
     def spawn(self, context, instance, image_meta, injected_files,
               admin_password, network_info=None, block_device_info=None):
         """Create a new lxd container as a nova instance.
 
-        Creating a new container requires a number of steps. First, the
-        image is fetched from glance, if needed. Next, the network is
-        connected. A profile is created in LXD, and then the container
-        is created and started.
+        Creating a new container requires a number of steps. The image
+        is fetched from glance, if needed, the network is connected and
+        a profile is created in LXD. These do not depend on each other
+        and run concurrently. The container is created as soon as the
+        image and profile exist, while neutron may still be plugging
+        the network, and is started once everything else is done.
 
         See `nova.virt.driver.ComputeDriver.spawn` for more
         information.
@@ -502,103 +829,51 @@ class LXDDriver(driver.ComputeDriver):
         if not os.path.exists(instance_dir):
             fileutils.ensure_tree(instance_dir)
 
-        # Check to see if LXD already has a copy of the image. If not,
-        # fetch it.
+        metadata_config = self._nocloud_config(
+            context, instance, injected_files, admin_password, network_info)
+
+        steps = common.TaskGraph()
+        steps.add('image', self._ensure_image, context, instance.image_ref)
+        steps.add('network', self._plug_vifs_and_wait, instance, network_info)
+        steps.add('profile', self._create_profile,
+                  instance, network_info, block_device_info)
+        steps.add('container',
+                  lambda: self._create_container(
+                      instance, steps.results['profile'], metadata_config),
+                  requires=('image', 'profile'))
+        steps.add('ephemeral', storage.attach_ephemeral,
+                  self.client, block_device_info, self.client.host_info,
+                  instance, requires=('container',))
+        start_requires = ('network', 'container', 'ephemeral')
+        if metadata_config is None:
+            # An ISO config drive is owned by the container's root user,
+            # so it needs the idmap of the container. Attaching either
+            # kind rewrites the profile, like the ephemeral step does,
+            # so the two must not run at the same time.
+            steps.add('configdrive', self._attach_configdrive,
+                      context, instance, injected_files, admin_password,
+                      network_info, requires=('ephemeral',))
+            start_requires += ('configdrive',)
+        steps.add('start',
+                  lambda: self._start_container(
+                      steps.results['container'], instance, network_info),
+                  requires=start_requires)
         try:
-            self.client.images.get_by_alias(instance.image_ref)
-        except lxd_exceptions.LXDAPIException as e:
-            if e.response.status_code != 404:
-                raise
-            _sync_glance_image_to_lxd(
-                self.client, context, instance.image_ref)
-
-        # Plug in the network
-        if network_info:
-            timeout = CONF.vif_plugging_timeout
-            if (utils.is_neutron() and timeout):
-                events = [('network-vif-plugged', vif['id'])
-                          for vif in network_info if not vif.get(
-                    'active', True)]
-            else:
-                events = []
-
-            try:
-                with self.virtapi.wait_for_instance_event(
-                        instance, events, deadline=timeout,
-                        error_callback=_neutron_failed_callback):
-                    self.plug_vifs(instance, network_info)
-            except eventlet.timeout.Timeout:
-                LOG.warn('Timeout waiting for vif plugging callback for '
-                         'instance %(uuid)s', {'uuid': instance['name']})
-                if CONF.vif_plugging_is_fatal:
+            steps.run()
+            self.state_cache.invalidate(instance.name)
+        except Exception:
+            # Every step has finished by now, so nothing is still
+            # being created while it is torn down.
+            with excutils.save_and_reraise_exception():
+                if 'container' in steps.results:
                     self.destroy(
                         context, instance, network_info, block_device_info)
-                    raise exception.InstanceDeployFailure(
-                        'Timeout waiting for vif plugging',
-                        instance_id=instance['name'])
-
-        # Create the profile
-        try:
-            profile = flavor.to_profile(
-                self.client, instance, network_info, block_device_info)
-        except lxd_exceptions.LXDAPIException as e:
-            with excutils.save_and_reraise_exception():
-                self.cleanup(
-                    context, instance, network_info, block_device_info)
-
-        # Create the container
-        container_config = {
-            'name': instance.name,
-            'profiles': [profile.name],
-            'source': {
-                'type': 'image',
-                'alias': instance.image_ref,
-            },
-        }
-        try:
-            container = self.client.containers.create(
-                container_config, wait=True)
-        except lxd_exceptions.LXDAPIException as e:
-            with excutils.save_and_reraise_exception():
-                self.cleanup(
-                    context, instance, network_info, block_device_info)
-
-        lxd_config = self.client.host_info
-        storage.attach_ephemeral(
-            self.client, block_device_info, lxd_config, instance)
-        if configdrive.required_by(instance):
-            configdrive_path = self._add_configdrive(
-                context, instance,
-                injected_files, admin_password,
-                network_info)
-
-            profile = self.client.profiles.get(instance.name)
-            config_drive = {
-                'configdrive': {
-                    'path': '/config-drive',
-                    'source': configdrive_path,
-                    'type': 'disk',
-                    'readonly': 'True',
-                }
-            }
-            profile.devices.update(config_drive)
-            profile.save()
-
-        try:
-            self.firewall_driver.setup_basic_filtering(
-                instance, network_info)
-            self.firewall_driver.instance_filter(
-                instance, network_info)
-
-            container.start(wait=True)
-
-            self.firewall_driver.apply_instance_filter(
-                instance, network_info)
-        except lxd_exceptions.LXDAPIException as e:
-            with excutils.save_and_reraise_exception():
-                self.cleanup(
-                    context, instance, network_info, block_device_info)
+                else:
+                    self.cleanup(
+                        context, instance, network_info, block_device_info)
 
+    @tracing.traced
+    @profiler.profiled
     def destroy(self, context, instance, network_info, block_device_info=None,
                 destroy_disks=True, migrate_data=None):
         """Destroy a running instance.
@@ -622,6 +897,8 @@ class LXDDriver(driver.ComputeDriver):
             else:
                 raise
         finally:
+            self.state_cache.invalidate(instance.name, exists=False)
+            self.cgroups.forget(instance.name)
             self.cleanup(
                 context, instance, network_info, block_device_info)
 
@@ -639,13 +916,10 @@ class LXDDriver(driver.ComputeDriver):
         lxd_config = self.client.host_info
         storage.detach_ephemeral(block_device_info, lxd_config, instance)
 
-        name = pwd.getpwuid(os.getuid()).pw_name
-
         container_dir = common.InstanceAttributes(instance).instance_dir
         if os.path.exists(container_dir):
-            utils.execute(
-                'chown', '-R', '{}:{}'.format(name, name),
-                container_dir, run_as_root=True)
+            privsep.chown(container_dir, os.getuid(), os.getgid(),
+                          recursive=True)
             shutil.rmtree(container_dir)
 
         try:
@@ -657,7 +931,9 @@ class LXDDriver(driver.ComputeDriver):
                             {'instance': instance.name})
             else:
                 raise
+        self.commitment.remove(instance.name)
 
+    @tracing.traced
     def reboot(self, context, instance, network_info, reboot_type,
                block_device_info=None, bad_volumes_callback=None):
         """Reboot the container.
@@ -671,6 +947,7 @@ class LXDDriver(driver.ComputeDriver):
         """
         container = self.client.containers.get(instance.name)
         container.restart(force=True, wait=True)
+        self.state_cache.invalidate(instance.name)
 
     def get_console_output(self, context, instance):
         """Get the output of the container console.
@@ -682,11 +959,8 @@ class LXDDriver(driver.ComputeDriver):
         console_path = instance_attrs.console_path
         if not os.path.exists(console_path):
             return ''
-        uid = pwd.getpwuid(os.getuid()).pw_uid
-        utils.execute(
-            'chown', '%s:%s' % (uid, uid), console_path, run_as_root=True)
-        utils.execute(
-            'chmod', '755', instance_attrs.container_path, run_as_root=True)
+        privsep.chown(console_path, os.getuid(), os.getgid())
+        privsep.chmod(instance_attrs.container_path, 0o755)
         with open(console_path, 'rb') as f:
             log_data, _ = _last_bytes(f, MAX_CONSOLE_BYTES)
             return log_data
@@ -694,6 +968,7 @@ class LXDDriver(driver.ComputeDriver):
     def get_host_ip_addr(self):
         return CONF.my_ip
 
+    @tracing.traced
     def attach_volume(self, context, connection_info, instance, mountpoint,
                       disk_bus=None, device_type=None, encryption=None):
         """Attach block device to a nova instance.
@@ -732,6 +1007,7 @@ class LXDDriver(driver.ComputeDriver):
         profile.config.update({'raw.apparmor': 'mount fstype=ext4,'})
         profile.save()
 
+    @tracing.traced
     def detach_volume(self, connection_info, instance, mountpoint,
                       encryption=None):
         """Detach block device from a nova instance.
@@ -753,6 +1029,7 @@ class LXDDriver(driver.ComputeDriver):
         storage_driver = brick_get_connector(protocol)
         storage_driver.disconnect_volume(connection_info['data'], None)
 
+    @tracing.traced
     def attach_interface(self, context, instance, image_meta, vif):
         self.vif_driver.plug(instance, vif)
         self.firewall_driver.setup_basic_filtering(instance, vif)
@@ -772,6 +1049,7 @@ class LXDDriver(driver.ComputeDriver):
         profile.devices.update(config_update)
         profile.save(wait=True)
 
+    @tracing.traced
     def detach_interface(self, context, instance, vif):
         profile = self.client.profiles.get(instance.name)
         devname = lxd_vif.get_vif_devname(vif)
@@ -795,6 +1073,7 @@ class LXDDriver(driver.ComputeDriver):
 
         self.vif_driver.unplug(instance, vif)
 
+    @tracing.traced
     def migrate_disk_and_power_off(
             self, context, instance, dest, _flavor, network_info,
             block_device_info=None, timeout=0, retry_interval=0):
@@ -805,10 +1084,15 @@ class LXDDriver(driver.ComputeDriver):
             flavor.to_profile(
                 self.client, instance, network_info, block_device_info,
                 update=True)
+            self.commitment.set(
+                instance.name, flavor.instance_limits(instance))
         container = self.client.containers.get(instance.name)
         container.stop(wait=True)
+        self.state_cache.invalidate(instance.name)
         return ''
 
+    @tracing.traced
+    @profiler.profiled
     def snapshot(self, context, instance, image_id, update_task_state):
         lock_path = str(os.path.join(CONF.instances_path, 'locks'))
 
@@ -823,6 +1107,7 @@ class LXDDriver(driver.ComputeDriver):
                 container.stop(wait=True)
             image = container.publish(wait=True)
             container.start(wait=True)
+            self.state_cache.invalidate(instance.name)
 
             update_task_state(
                 task_state=task_states.IMAGE_UPLOADING,
@@ -833,8 +1118,16 @@ class LXDDriver(driver.ComputeDriver):
             image_meta = {'name': snapshot['name'],
                           'disk_format': 'raw',
                           'container_format': 'bare'}
-            IMAGE_API.update(context, image_id, image_meta, data)
+            snapshot = IMAGE_API.update(context, image_id, image_meta, data)
+
+            # The published image stays in the LXD image store; alias it
+            # to the new glance image so that instances booted from the
+            # snapshot on this host do not download it again.
+            image.add_alias(image_id, '')
+            self.image_cache.register(
+                image_id, image, checksum=snapshot.get('checksum'))
 
+    @tracing.traced
     def pause(self, instance):
         """Pause container.
 
@@ -843,7 +1136,9 @@ class LXDDriver(driver.ComputeDriver):
         """
         container = self.client.containers.get(instance.name)
         container.freeze(wait=True)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
     def unpause(self, instance):
         """Unpause container.
 
@@ -852,7 +1147,9 @@ class LXDDriver(driver.ComputeDriver):
         """
         container = self.client.containers.get(instance.name)
         container.unfreeze(wait=True)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
     def suspend(self, context, instance):
         """Suspend container.
 
@@ -861,6 +1158,7 @@ class LXDDriver(driver.ComputeDriver):
         """
         self.pause(instance)
 
+    @tracing.traced
     def resume(self, context, instance, network_info, block_device_info=None):
         """Resume container.
 
@@ -886,6 +1184,7 @@ class LXDDriver(driver.ComputeDriver):
         except (exception.InternalError, exception.InstanceNotFound):
             pass
 
+    @tracing.traced
     def rescue(self, context, instance, network_info, image_meta,
                rescue_password):
         """Rescue a LXD container.
@@ -903,10 +1202,13 @@ class LXDDriver(driver.ComputeDriver):
         """
         rescue = '%s-rescue' % instance.name
 
+        self._ensure_image(context, instance.image_ref)
+
         container = self.client.containers.get(instance.name)
         container_rootfs = os.path.join(
             nova.conf.CONF.lxd.root_dir, 'containers', instance.name, 'rootfs')
         container.rename(rescue, wait=True)
+        self.state_cache.invalidate(rescue)
 
         profile = self.client.profiles.get(instance.name)
 
@@ -920,18 +1222,11 @@ class LXDDriver(driver.ComputeDriver):
         profile.devices.update(rescue_dir)
         profile.save()
 
-        container_config = {
-            'name': instance.name,
-            'profiles': [profile.name],
-            'source': {
-                'type': 'image',
-                'alias': instance.image_ref,
-            }
-        }
-        container = self.client.containers.create(
-            container_config, wait=True)
+        container = self._create_container(instance, profile)
         container.start(wait=True)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
     def unrescue(self, instance, network_info):
         """Unrescue an instance.
 
@@ -957,7 +1252,10 @@ class LXDDriver(driver.ComputeDriver):
         container = self.client.containers.get(rescue)
         container.rename(instance.name, wait=True)
         container.start(wait=True)
+        self.state_cache.invalidate(rescue, exists=False)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
     def power_off(self, instance, timeout=0, retry_interval=0):
         """Power off an instance
 
@@ -967,7 +1265,9 @@ class LXDDriver(driver.ComputeDriver):
         container = self.client.containers.get(instance.name)
         if container.status != 'Stopped':
             container.stop(wait=True)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
     def power_on(self, context, instance, network_info,
                  block_device_info=None):
         """Power on an instance
@@ -978,14 +1278,17 @@ class LXDDriver(driver.ComputeDriver):
         container = self.client.containers.get(instance.name)
         if container.status != 'Running':
             container.start(wait=True)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
+    @profiler.profiled
     def get_available_resource(self, nodename):
         """Aggregate all available system resources.
 
         See 'nova.virt.drvier.ComputeDriver.get_available_resource`
         for more information.
         """
-        cpuinfo = _get_cpu_info()
+        cpuinfo = self.host_metrics.get('cpu_info')
 
         cpu_info = {
             'arch': platform.uname()[5],
@@ -1004,28 +1307,17 @@ class LXDDriver(driver.ComputeDriver):
                  int(cpu_topology['sockets']) *
                  int(cpu_topology['threads']))
 
-        local_memory_info = _get_ram_usage()
-
-        lxd_config = self.client.host_info
-
-        # NOTE(jamespage): ZFS storage report is very LXD 2.0.x
-        #                  centric and will need to be updated
-        #                  to support LXD storage pools
-        storage_driver = lxd_config['environment']['storage']
-        if storage_driver == 'zfs':
-            local_disk_info = _get_zpool_info(
-                lxd_config['config']['storage.zfs_pool_name']
-            )
-        else:
-            local_disk_info = _get_fs_info(CONF.lxd.root_dir)
+        local_memory_info = self.host_metrics.get('memory')
+        local_disk_info = self.host_metrics.get('disk')
+        committed = self.commitment.totals(self.client)
 
         data = {
             'vcpus': vcpus,
             'memory_mb': local_memory_info['total'] // units.Mi,
-            'memory_mb_used': local_memory_info['used'] // units.Mi,
+            'memory_mb_used': committed.memory_mb,
             'local_gb': local_disk_info['total'] // units.Gi,
             'local_gb_used': local_disk_info['used'] // units.Gi,
-            'vcpus_used': 0,
+            'vcpus_used': committed.vcpus,
             'hypervisor_type': 'lxd',
             'hypervisor_version': '011',
             'cpu_info': jsonutils.dumps(cpu_info),
@@ -1045,6 +1337,26 @@ class LXDDriver(driver.ComputeDriver):
 
         return data
 
+    def _create_profile(self, instance, network_info, block_device_info):
+        profile = flavor.to_profile(
+            self.client, instance, network_info, block_device_info)
+        self.commitment.set(instance.name, flavor.instance_limits(instance))
+        return profile
+
+    def _get_local_disk_info(self):
+        lxd_config = self.client.host_info
+        if 'storage' in lxd_config.get('api_extensions', []):
+            return _get_storage_pool_info(self.client, CONF.lxd.pool)
+
+        # LXD releases before the storage API only have one storage
+        # backend, configured in the daemon.
+        storage_driver = lxd_config['environment']['storage']
+        if storage_driver == 'zfs':
+            return _get_zpool_info(
+                lxd_config['config']['storage.zfs_pool_name']
+            )
+        return _get_fs_info(CONF.lxd.root_dir)
+
     def refresh_instance_security_rules(self, instance):
         return self.firewall_driver.refresh_instance_security_rules(
             instance)
@@ -1064,7 +1376,8 @@ class LXDDriver(driver.ComputeDriver):
             instance, network_info)
 
     def get_host_uptime(self):
-        out, err = utils.execute('env', 'LANG=C', 'uptime')
+        with tracing.timed('execute', 'uptime'):
+            out, err = utils.execute('env', 'LANG=C', 'uptime')
         return out
 
     def plug_vifs(self, instance, network_info):
@@ -1076,12 +1389,13 @@ class LXDDriver(driver.ComputeDriver):
             self.vif_driver.unplug(instance, vif)
 
     def get_host_cpu_stats(self):
+        cpu_times = self.host_metrics.get('cpu_times')
         return {
-            'kernel': int(psutil.cpu_times()[2]),
-            'idle': int(psutil.cpu_times()[3]),
-            'user': int(psutil.cpu_times()[0]),
-            'iowait': int(psutil.cpu_times()[4]),
-            'frequency': _get_cpu_info().get('cpu mhz', 0)
+            'kernel': int(cpu_times[2]),
+            'idle': int(cpu_times[3]),
+            'user': int(cpu_times[0]),
+            'iowait': int(cpu_times[4]),
+            'frequency': self.host_metrics.get('cpu_info').get('cpu mhz', 0)
         }
 
     def get_volume_connector(self, instance):
@@ -1093,6 +1407,18 @@ class LXDDriver(driver.ComputeDriver):
         hostname = socket.gethostname()
         return [hostname]
 
+    def manage_image_cache(self, context, all_instances):
+        """Remove unused images from the LXD image store.
+
+        See `nova.virt.driver.ComputeDriver.manage_image_cache` for more
+        information.
+        """
+        if CONF.lxd.warm_pool:
+            # Let go of the warm containers of deleted images first, so
+            # their images can be evicted.
+            self._refill_warm_pool(recheck=True)
+        self.image_cache.update(self.client, all_instances)
+
     # XXX: rockstar (5 July 2016) - The methods and code below this line
     # have not been through the cleanup process. We know the cleanup process
     # is complete when there is no more code below this comment, and the
@@ -1101,6 +1427,7 @@ class LXDDriver(driver.ComputeDriver):
     #
     # ComputeDriver implementation methods
     #
+    @tracing.traced
     def finish_migration(self, context, migration, instance, disk_info,
                          network_info, image_meta, resize_instance,
                          block_device_info=None, power_on=True):
@@ -1110,8 +1437,7 @@ class LXDDriver(driver.ComputeDriver):
             fileutils.ensure_tree(instance_dir)
 
         # Step 1 - Setup the profile on the dest host
-        flavor.to_profile(self.client,
-                          instance, network_info, block_device_info)
+        self._create_profile(instance, network_info, block_device_info)
 
         # Step 2 - Open a websocket on the srct and and
         #          generate the container config
@@ -1120,16 +1446,24 @@ class LXDDriver(driver.ComputeDriver):
         # Step 3 - Start the network and container
         self.plug_vifs(instance, network_info)
         self.client.container.get(instance.name).start(wait=True)
+        self.state_cache.invalidate(instance.name)
 
+    @tracing.traced
     def confirm_migration(self, migration, instance, network_info):
         self.unplug_vifs(instance, network_info)
 
         self.client.profiles.get(instance.name).delete()
+        self.commitment.remove(instance.name)
         self.client.containers.get(instance.name).delete(wait=True)
+        self.state_cache.invalidate(instance.name, exists=False)
+        self.cgroups.forget(instance.name)
 
+    @tracing.traced
     def finish_revert_migration(self, context, instance, network_info,
                                 block_device_info=None, power_on=True):
         self.client.containers.get(instance.name).start(wait=True)
+        self.state_cache.invalidate(instance.name)
+        self.commitment.set(instance.name, flavor.instance_limits(instance))
 
     def pre_live_migration(self, context, instance, block_device_info,
                            network_info, disk_info, migrate_data=None):
@@ -1142,9 +1476,9 @@ class LXDDriver(driver.ComputeDriver):
         self.firewall_driver.apply_instance_filter(
             instance, network_info)
 
-        flavor.to_profile(self.client,
-                          instance, network_info, block_device_info)
+        self._create_profile(instance, network_info, block_device_info)
 
+    @tracing.traced
     def live_migration(self, context, instance, dest,
                        post_method, recover_method, block_migration=False,
                        migrate_data=None):
@@ -1154,6 +1488,8 @@ class LXDDriver(driver.ComputeDriver):
     def post_live_migration(self, context, instance, block_device_info,
                             migrate_data=None):
         self.client.containers.get(instance.name).delete(wait=True)
+        self.state_cache.invalidate(instance.name, exists=False)
+        self.cgroups.forget(instance.name)
 
     def post_live_migration_at_source(self, context, instance, network_info):
         self.client.profiles.get(instance.name).delete()
@@ -1191,16 +1527,17 @@ class LXDDriver(driver.ComputeDriver):
     # comment can be removed.
     def _add_configdrive(self, context, instance,
                          injected_files, admin_password, network_info):
-        """Create configdrive for the instance."""
-        if CONF.config_drive_format != 'iso9660':
+        """Create configdrive for the instance.
+
+        With `[lxd] config_drive_direct`, the config drive is written
+        straight into the configdrive dir of the instance. Otherwise it
+        is built as an ISO image and copied out of it.
+        """
+        direct = CONF.lxd.config_drive_direct
+        if not direct and CONF.config_drive_format != 'iso9660':
             raise exception.ConfigDriveUnsupportedFormat(
                 format=CONF.config_drive_format)
 
-        container = self.client.containers.get(instance.name)
-        container_id_map = container.config[
-            'volatile.last_state.idmap'].split(',')
-        storage_id = container_id_map[2].split(':')[1]
-
         extra_md = {}
         if admin_password:
             extra_md['admin_pass'] = admin_password
@@ -1209,6 +1546,17 @@ class LXDDriver(driver.ComputeDriver):
             instance, content=injected_files, extra_md=extra_md,
             network_info=network_info, request_context=context)
 
+        configdrive_dir = os.path.join(
+            nova.conf.CONF.instances_path, instance.name, 'configdrive')
+        if direct:
+            _write_configdrive(inst_md, configdrive_dir)
+            return configdrive_dir
+
+        container = self.client.containers.get(instance.name)
+        container_id_map = container.config[
+            'volatile.last_state.idmap'].split(',')
+        storage_id = container_id_map[2].split(':')[1]
+
         iso_path = os.path.join(
             common.InstanceAttributes(instance).instance_dir,
             'configdrive.iso')
@@ -1222,20 +1570,15 @@ class LXDDriver(driver.ComputeDriver):
                               'error: %s',
                               e, instance=instance)
 
-        configdrive_dir = os.path.join(
-            nova.conf.CONF.instances_path, instance.name, 'configdrive')
         if not os.path.exists(configdrive_dir):
             fileutils.ensure_tree(configdrive_dir)
 
         with utils.tempdir() as tmpdir:
             mounted = False
             try:
-                _, err = utils.execute('mount',
-                                       '-o',
-                                       'loop,uid=%d,gid=%d' % (os.getuid(),
-                                                               os.getgid()),
-                                       iso_path, tmpdir,
-                                       run_as_root=True)
+                privsep.mount(iso_path, tmpdir,
+                              options='loop,uid=%d,gid=%d' % (os.getuid(),
+                                                              os.getgid()))
                 mounted = True
 
                 # Copy and adjust the files from the ISO so that we
@@ -1245,16 +1588,201 @@ class LXDDriver(driver.ComputeDriver):
                 for ent in os.listdir(tmpdir):
                     shutil.copytree(os.path.join(tmpdir, ent),
                                     os.path.join(configdrive_dir, ent))
-                    utils.execute('chmod', '-R', '775', configdrive_dir,
-                                  run_as_root=True)
-                    utils.execute('chown', '-R', storage_id, configdrive_dir,
-                                  run_as_root=True)
+                privsep.chmod(configdrive_dir, 0o775, recursive=True)
+                privsep.chown(configdrive_dir, uid=int(storage_id),
+                              recursive=True)
             finally:
                 if mounted:
-                    utils.execute('umount', tmpdir, run_as_root=True)
+                    privsep.umount(tmpdir)
 
         return configdrive_dir
 
+    def _plug_vifs_and_wait(self, instance, network_info):
+        """Plug the instance vifs and wait for neutron to report them."""
+        if not network_info:
+            return
+        timeout = CONF.vif_plugging_timeout
+        if (utils.is_neutron() and timeout):
+            events = [('network-vif-plugged', vif['id'])
+                      for vif in network_info if not vif.get(
+                'active', True)]
+        else:
+            events = []
+
+        try:
+            with self.virtapi.wait_for_instance_event(
+                    instance, events, deadline=timeout,
+                    error_callback=_neutron_failed_callback):
+                self.plug_vifs(instance, network_info)
+        except eventlet.timeout.Timeout:
+            LOG.warn('Timeout waiting for vif plugging callback for '
+                     'instance %(uuid)s', {'uuid': instance['name']})
+            if CONF.vif_plugging_is_fatal:
+                raise exception.InstanceDeployFailure(
+                    'Timeout waiting for vif plugging',
+                    instance_id=instance['name'])
+
+    def _nocloud_config(self, context, instance, injected_files,
+                        admin_password, network_info):
+        """Return the container config delivering the instance metadata.
+
+        None is returned when the metadata is not delivered through
+        cloud-init keys, and a config drive should be used if one is
+        required.
+        """
+        if CONF.lxd.metadata_delivery != 'cloud-init':
+            return None
+        if injected_files:
+            LOG.debug('Files are injected, using a config drive instead '
+                      'of cloud-init keys', instance=instance)
+            return None
+        if admin_password:
+            # The NoCloud datasource has no place for the password.
+            LOG.debug('An admin password is set, using a config drive '
+                      'instead of cloud-init keys', instance=instance)
+            return None
+        if not nocloud.supported(instance):
+            return None
+        inst_md = instance_metadata.InstanceMetadata(
+            instance, network_info=network_info, request_context=context)
+        try:
+            return nocloud.instance_config(inst_md, network_info)
+        except ValueError as e:
+            LOG.debug('Cannot deliver metadata through cloud-init keys: '
+                      '%s', e, instance=instance)
+            return None
+
+    def _create_container(self, instance, profile, config=None):
+        """Create the container from its image and profile.
+
+        A container is taken from the warm pool when there is one for
+        the image, or copied from the golden container of the image
+        when `[lxd] clone_from_golden` is set. `config` is added to the
+        config of the container.
+        """
+        container = self.warm_pool.claim(
+            self.client, instance.image_ref, instance.name, profile,
+            config=config)
+        if container is not None:
+            utils.spawn_n(self._refill_warm_pool)
+            return container
+
+        if CONF.lxd.clone_from_golden:
+            return self.golden.clone(
+                self.client, instance.image_ref, instance.name, profile,
+                config=config)
+
+        container_config = {
+            'name': instance.name,
+            'profiles': [profile.name],
+            'source': {
+                'type': 'image',
+                'alias': instance.image_ref,
+            },
+        }
+        if config:
+            container_config['config'] = config
+        return self.client.containers.create(container_config, wait=True)
+
+    def _attach_configdrive(self, context, instance, injected_files,
+                            admin_password, network_info):
+        """Build the config drive, if needed, and add it to the profile."""
+        if not configdrive.required_by(instance):
+            return
+        configdrive_path = self._add_configdrive(
+            context, instance,
+            injected_files, admin_password,
+            network_info)
+
+        profile = self.client.profiles.get(instance.name)
+        config_drive = {
+            'configdrive': {
+                'path': '/config-drive',
+                'source': configdrive_path,
+                'type': 'disk',
+                'readonly': 'True',
+            }
+        }
+        profile.devices.update(config_drive)
+        profile.save()
+
+    def _start_container(self, container, instance, network_info):
+        """Set up the instance firewall and start the container."""
+        self.firewall_driver.setup_basic_filtering(
+            instance, network_info)
+        self.firewall_driver.instance_filter(
+            instance, network_info)
+
+        container.start(wait=True)
+
+        self.firewall_driver.apply_instance_filter(
+            instance, network_info)
+
+    def _refill_warm_pool(self, recheck=False):
+        """Top up the warm pool, dropping containers of deleted images.
+
+        Glance is only asked whether a pooled image still exists the
+        first time it is refilled, and again when `recheck` is set, so
+        the refill following every claim does not load glance.
+        """
+        context = nova.context.get_admin_context()
+        if recheck:
+            self._warm_images.clear()
+
+        def ensure_image(image_ref):
+            if image_ref not in self._warm_images:
+                # Raises ImageNotFound once the image is deleted from
+                # glance.
+                IMAGE_API.get(context, image_ref)
+                self._warm_images.add(image_ref)
+            self._ensure_image(context, image_ref)
+        self.warm_pool.refill(self.client, ensure_image)
+
+    def _ensure_image(self, context, image_ref):
+        """Make sure the LXD image store has the image for image_ref.
+
+        Concurrent spawns of the same image wait for a single sync
+        rather than queueing up on the external image lock.
+        """
+        try:
+            self.client.images.get_by_alias(image_ref)
+        except lxd_exceptions.LXDAPIException as e:
+            if e.response.status_code != 404:
+                raise
+            self._image_syncs.do(
+                image_ref, _sync_glance_image_to_lxd,
+                self.client, context, image_ref, self.image_cache,
+                self.image_transfers)
+        else:
+            self.image_cache.touch(image_ref)
+
+    def _instance_uuid(self, name):
+        """Return the uuid of the instance with container `name`.
+
+        The uuid is read from the profile of the container, which is
+        fetched with its state. The instances of the host are only
+        looked up for containers created before the profile recorded
+        it, and a container none of them has is not looked up again.
+        """
+        # A rescued container shares the profile of the instance.
+        if name.endswith('-rescue'):
+            return None
+        if name in self._instance_uuids or name in self._unknown_names:
+            return self._instance_uuids.get(name)
+        state = self.state_cache.get(self.client, name)
+        config = state.expanded_config if state is not None else {}
+        if common.INSTANCE_UUID_KEY in config:
+            self._instance_uuids[name] = config[common.INSTANCE_UUID_KEY]
+        else:
+            context = nova.context.get_admin_context()
+            instances = objects.InstanceList.get_by_host(context, self.host)
+            self._instance_uuids.update(
+                (instance.name, instance.uuid) for instance in instances)
+            if name not in self._instance_uuids:
+                self._unknown_names.add(name)
+        return self._instance_uuids.get(name)
+
+    @profiler.profiled
     def _after_reboot(self):
         """Perform sync operation after host reboot."""
         context = nova.context.get_admin_context()
@@ -0,0 +1,541 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import json
+import math
+import time
+
+import eventlet
+from eventlet import event as greenevent
+from eventlet import queue
+from nova import exception
+from nova import i18n
+from nova import utils
+from nova.virt import event as virtevent
+from oslo_log import log as logging
+from pylxd import exceptions as lxd_exceptions
+from ws4py.client import WebSocketBaseClient
+
+from nova.virt.lxd import common
+
+_ = i18n._
+LOG = logging.getLogger(__name__)
+
+CONTAINERS_PATH = '/1.0/containers/'
+RECONNECT_INTERVAL = 5
+# A container which changes state again within this many seconds only
+# produces a lifecycle event for its last change, so that a reboot is
+# not reported as a stop.
+LIFECYCLE_DELAY = 5
+LIFECYCLE_QUEUE_SIZE = 1000
+
+# LXD status codes
+STOPPED = 102
+RUNNING = 103
+FROZEN = 110
+SUCCESS = 200
+FAILURE = 400
+CANCELLED = 401
+_FINAL = (SUCCESS, FAILURE, CANCELLED)
+
+_TRANSITIONS = {
+    STOPPED: virtevent.EVENT_LIFECYCLE_STOPPED,
+    RUNNING: virtevent.EVENT_LIFECYCLE_STARTED,
+    FROZEN: virtevent.EVENT_LIFECYCLE_PAUSED,
+}
+
+CachedState = collections.namedtuple(
+    'CachedState', ['status_code', 'memory', 'expanded_config'])
+
+
+def container_names(event):
+    """Return the names of the containers an LXD event is about."""
+    metadata = event.get('metadata') or {}
+    if event.get('type') == 'operation':
+        paths = (metadata.get('resources') or {}).get('containers') or []
+    elif event.get('type') == 'lifecycle':
+        paths = [metadata.get('source') or '']
+    else:
+        return []
+    names = []
+    for path in paths:
+        if path.startswith(CONTAINERS_PATH):
+            name = path[len(CONTAINERS_PATH):].split('/')[0]
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def lifecycle_transition(old, new):
+    """Return the lifecycle transition between two CachedStates.
+
+    `new` is None when the container was deleted. None is returned
+    when nova does not need to hear about the change.
+    """
+    if old is None:
+        return None
+    if new is None:
+        if old.status_code == STOPPED:
+            return None
+        return virtevent.EVENT_LIFECYCLE_STOPPED
+    if old.status_code == new.status_code:
+        return None
+    if old.status_code == FROZEN and new.status_code == RUNNING:
+        return virtevent.EVENT_LIFECYCLE_RESUMED
+    return _TRANSITIONS.get(new.status_code)
+
+
+class _EventsClient(WebSocketBaseClient):
+    """Hand the messages of the LXD events websocket to a listener."""
+
+    listener = None
+
+    def handshake_ok(self):
+        # `run` calls `opened` once the connection is being read.
+        pass
+
+    def opened(self):
+        self.listener._connected()
+
+    def received_message(self, message):
+        try:
+            event = json.loads(message.data.decode('utf-8'))
+        except ValueError:
+            LOG.warning('Ignoring malformed LXD event: %s', message.data)
+            return
+        self.listener._received(event)
+
+
+class EventListener(object):
+    """Follow the LXD events stream in a green thread.
+
+    Each handler is an object with three methods: `resync(client)` is
+    called whenever the stream is (re)connected, `handle(client, event)`
+    for every event received, and `lost()` when the stream is
+    disconnected. Events can be missed while the stream is down, so
+    handlers should rebuild their state in `resync`.
+    """
+
+    def __init__(self):
+        self._handlers = []
+        self._client = None
+        self._websocket = None
+        self._stopped = True
+
+    def add_handler(self, handler):
+        self._handlers.append(handler)
+
+    def start(self, client):
+        self._client = client
+        self._stopped = False
+        utils.spawn_n(self._run)
+
+    def stop(self):
+        self._stopped = True
+        if self._websocket is not None:
+            self._websocket.close()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._websocket = self._client.events(
+                    websocket_client=_EventsClient)
+                self._websocket.listener = self
+                self._websocket.connect()
+                self._websocket.run()
+            except Exception as e:
+                LOG.warning('Lost the LXD events stream: %s', e)
+            finally:
+                self._websocket = None
+                for handler in self._handlers:
+                    handler.lost()
+            if not self._stopped:
+                eventlet.sleep(RECONNECT_INTERVAL)
+
+    def _connected(self):
+        for handler in self._handlers:
+            handler.resync(self._client)
+
+    def _received(self, event):
+        for handler in self._handlers:
+            try:
+                handler.handle(self._client, event)
+            except Exception:
+                LOG.exception('Failed to handle LXD event %s', event)
+
+
+class StateCache(object):
+    """Cache the state of containers, kept up to date by LXD events.
+
+    The cache is only trusted while the events stream is connected. It
+    is rebuilt from a full listing every time the stream connects, and
+    a container is fetched again whenever an event mentions it. The
+    driver invalidates the containers it changes itself, as it may
+    look at them again before the events of the change are handled.
+
+    `get` and `names` fall back to asking LXD when the cache cannot
+    answer.
+    """
+
+    def __init__(self):
+        self._states = {}
+        # Bumped every time a container is invalidated and the cache is
+        # rebuilt, so that a fetch which started before then is not
+        # cached.
+        self._generation = 0
+        # What was invalidated while the listing of a resync is fetched,
+        # by name, with whether the container still exists.
+        self._invalidated = None
+        self._synced = False
+        self._observers = []
+
+    def add_observer(self, observer):
+        """Call observer(name, old, new) when a container changes state.
+
+        Only changes seen through events are reported.
+        """
+        self._observers.append(observer)
+
+    @property
+    def synced(self):
+        return self._synced
+
+    def _fetch(self, client, name):
+        try:
+            container = client.containers.get(name)
+        except lxd_exceptions.NotFound:
+            return None
+        state = container.state()
+        return CachedState(
+            state.status_code, state.memory, container.expanded_config)
+
+    def _refresh(self, client, name):
+        generation = self._generation
+        state = self._fetch(client, name)
+        if self._synced and self._generation == generation:
+            old = self._states.get(name)
+            if state is None:
+                self._states.pop(name, None)
+            else:
+                self._states[name] = state
+            for observer in self._observers:
+                observer(name, old, state)
+        return state
+
+    def get(self, client, name):
+        """Return the CachedState of a container, or None if it is gone."""
+        if self._synced:
+            state = self._states.get(name)
+            if state is not None:
+                return state
+        return self._refresh(client, name)
+
+    def names(self, client):
+        """Return the names of all containers."""
+        if self._synced:
+            return list(self._states)
+        return [c.name for c in client.containers.all()]
+
+    def invalidate(self, name, exists=True):
+        """Forget what is known about the state of a container."""
+        if self._invalidated is not None:
+            self._invalidated[name] = exists
+        elif not self._synced:
+            # Nothing is cached, nor will be until the next resync.
+            return
+        self._generation += 1
+        if exists:
+            self._states[name] = None
+        else:
+            self._states.pop(name, None)
+
+    def resync(self, client):
+        self._synced = False
+        self._invalidated = {}
+        try:
+            containers = common.list_containers(client, state=True)
+        finally:
+            invalidated, self._invalidated = self._invalidated, None
+        states = {}
+        for container in containers:
+            name = container['name']
+            state = container.get('state')
+            if state is None:
+                # Internal containers are not cached, and other
+                # containers without a state were deleted meanwhile.
+                if name.startswith(common.INTERNAL_PREFIX):
+                    states[name] = None
+                continue
+            states[name] = CachedState(
+                state['status_code'], state['memory'],
+                container['expanded_config'])
+        # Keep what was invalidated while the listing was fetched.
+        for name, exists in invalidated.items():
+            if exists:
+                states[name] = None
+            else:
+                states.pop(name, None)
+        self._generation += 1
+        self._states = states
+        self._synced = True
+
+    def handle(self, client, event):
+        if not self._synced:
+            return
+        # Operations only change containers once they are done.
+        if (event.get('type') == 'operation' and
+                (event.get('metadata') or {}).get('status_code')
+                not in _FINAL):
+            return
+        for name in container_names(event):
+            self._refresh(client, name)
+
+    def lost(self):
+        self._synced = False
+        self._states = {}
+
+
+class LifecycleEmitter(object):
+    """Turn container state changes into nova lifecycle events.
+
+    A change is only emitted once the container has not changed again
+    for LIFECYCLE_DELAY seconds. Events are then handed to `emit` from
+    a single green thread, through a queue of LIFECYCLE_QUEUE_SIZE
+    events. Events are dropped when the queue is full, as the periodic
+    power state sync still catches up with them.
+    """
+
+    def __init__(self, emit, uuid_of, delay=LIFECYCLE_DELAY,
+                 maxsize=LIFECYCLE_QUEUE_SIZE):
+        self._emit = emit
+        self._uuid_of = uuid_of
+        self._delay = delay
+        self._timers = {}
+        self._queue = queue.LightQueue(maxsize)
+        self._dispatcher = None
+
+    def start(self):
+        self._dispatcher = eventlet.spawn(self._dispatch)
+
+    def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        if self._dispatcher is not None:
+            self._dispatcher.kill()
+            self._dispatcher = None
+
+    def changed(self, name, old, new):
+        if name.startswith(common.INTERNAL_PREFIX):
+            return
+        transition = lifecycle_transition(old, new)
+        if transition is None:
+            return
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[name] = eventlet.spawn_after(
+            self._delay, self._enqueue, name, transition)
+
+    def _enqueue(self, name, transition):
+        self._timers.pop(name, None)
+        try:
+            self._queue.put_nowait((name, transition))
+        except queue.Full:
+            LOG.warning('Dropping lifecycle event %(transition)s of '
+                        '%(name)s, too many events are queued',
+                        {'transition': transition, 'name': name})
+
+    def _dispatch(self):
+        while True:
+            name, transition = self._queue.get()
+            self._emit_one(name, transition)
+
+    def _emit_one(self, name, transition):
+        try:
+            uuid = self._uuid_of(name)
+            if uuid is not None:
+                self._emit(virtevent.LifecycleEvent(uuid, transition))
+        except Exception:
+            LOG.exception('Failed to emit lifecycle event %(transition)s '
+                          'of %(name)s',
+                          {'transition': transition, 'name': name})
+
+
+class _Operation(object):
+    """The attributes of a finished LXD operation, as pylxd returns them."""
+
+    def __init__(self, metadata):
+        for key, value in metadata.items():
+            setattr(self, key, value)
+
+
+class _OperationResponse(object):
+    """A response to getting a failed LXD operation, for LXDAPIException.
+
+    LXD may already have forgotten the operation, so the response is
+    built from what is known about it rather than fetched again.
+    """
+
+    status_code = 200
+
+    def __init__(self, operation):
+        self._body = {'type': 'sync', 'status': 'Success',
+                      'status_code': 200, 'metadata': operation}
+        self.content = json.dumps(self._body).encode('utf-8')
+
+    def json(self):
+        return self._body
+
+
+class OperationTracker(object):
+    """Wait for LXD operations to finish.
+
+    While the events stream is connected, waiters sleep until the event
+    of their operation finishing arrives, instead of each holding an
+    HTTP request to LXD open for the whole operation. Otherwise they
+    fall back to the wait API of LXD.
+
+    An operation whose description contains a key of `timeouts` is
+    given that many seconds, and any other one `default_timeout`,
+    where a timeout of 0 or less means no deadline. An operation still
+    running at its deadline is cancelled, when LXD allows it, and
+    NovaException is raised.
+    """
+
+    def __init__(self, timeouts=None, default_timeout=-1):
+        self._timeouts = dict(
+            (key.lower(), int(value))
+            for key, value in (timeouts or {}).items())
+        self._default_timeout = default_timeout
+        self._waiters = {}
+        self._connected = False
+
+    def _timeout(self, operation):
+        description = (operation.get('description') or '').lower()
+        timeout = self._default_timeout
+        for key, value in self._timeouts.items():
+            if key in description:
+                timeout = value
+                break
+        return timeout if timeout > 0 else None
+
+    def _finished(self, client, operation_id, operation):
+        if operation['status_code'] == SUCCESS:
+            return _Operation(operation)
+        # Raised like pylxd does when an operation fails.
+        raise lxd_exceptions.LXDAPIException(_OperationResponse(operation))
+
+    def _expired(self, client, operation_id, operation, timeout):
+        LOG.warning('LXD operation %(id)s (%(description)s) did not finish '
+                    'within %(timeout)s seconds',
+                    {'id': operation_id, 'timeout': timeout,
+                     'description': operation.get('description')})
+        if operation.get('may_cancel'):
+            try:
+                client.api.operations[operation_id].delete()
+            except lxd_exceptions.LXDAPIException as e:
+                LOG.warning('Failed to cancel LXD operation %(id)s: '
+                            '%(error)s', {'id': operation_id, 'error': e})
+        msg = _('LXD operation %(id)s timed out after %(timeout)s '
+                'seconds') % {'id': operation_id, 'timeout': timeout}
+        raise exception.NovaException(msg)
+
+    def _wait_api(self, client, operation_id, operation, timeout):
+        params = {'timeout': timeout} if timeout else {}
+        operation = client.api.operations[operation_id].wait.get(
+            params=params).json()['metadata']
+        if operation['status_code'] not in _FINAL:
+            self._expired(client, operation_id, operation, timeout)
+        return operation
+
+    def wait(self, client, operation_id):
+        """Wait for an operation, and return it once it succeeded."""
+        operation_id = operation_id.split('/')[-1]
+        if not self._connected:
+            operation = client.api.operations[operation_id].get().json()[
+                'metadata']
+            timeout = self._timeout(operation)
+            if operation['status_code'] not in _FINAL:
+                operation = self._wait_api(
+                    client, operation_id, operation, timeout)
+            return self._finished(client, operation_id, operation)
+
+        done = self._waiters.setdefault(operation_id, greenevent.Event())
+        try:
+            # The operation may have finished before the waiter was
+            # registered.
+            operation = client.api.operations[operation_id].get().json()[
+                'metadata']
+            timeout = self._timeout(operation)
+            if operation['status_code'] not in _FINAL:
+                start = time.time()
+                finished = None
+                with eventlet.Timeout(timeout, False):
+                    finished = done.wait()
+                if finished is None:
+                    if self._connected:
+                        self._expired(
+                            client, operation_id, operation, timeout)
+                    # The events stream was lost meanwhile, so wait
+                    # for what is left of the deadline through the API.
+                    remaining = timeout and max(
+                        1, int(math.ceil(timeout - (time.time() - start))))
+                    finished = self._wait_api(
+                        client, operation_id, operation, remaining)
+                operation = finished
+        finally:
+            if self._waiters.get(operation_id) is done:
+                del self._waiters[operation_id]
+        return self._finished(client, operation_id, operation)
+
+    def resync(self, client):
+        self._connected = True
+
+    def handle(self, client, event):
+        if event.get('type') != 'operation':
+            return
+        operation = event.get('metadata') or {}
+        if operation.get('status_code') not in _FINAL:
+            return
+        done = self._waiters.pop(operation.get('id'), None)
+        if done is not None:
+            done.send(operation)
+
+    def lost(self):
+        self._connected = False
+        waiters, self._waiters = self._waiters, {}
+        for done in waiters.values():
+            done.send(None)
+
+
+class TrackedOperations(object):
+    """Stand in for the operations manager of a pylxd client.
+
+    pylxd waits for the operations of calls made with `wait=True`
+    through `client.operations`, so replacing it makes all of them go
+    through an OperationTracker.
+    """
+
+    def __init__(self, client, tracker):
+        self._client = client
+        self._tracker = tracker
+        self._manager = client.operations
+
+    def wait_for_operation(self, operation_id):
+        return self._tracker.wait(self._client, operation_id)
+
+    def __getattr__(self, name):
+        return getattr(self._manager, name)
@@ -12,12 +12,14 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import collections
 import os
 
 from nova import exception
 from nova import i18n
 from nova.virt import driver
 from oslo_config import cfg
+from oslo_utils import strutils
 from oslo_utils import units
 
 from nova.virt.lxd import common
@@ -26,11 +28,14 @@ from nova.virt.lxd import vif
 _ = i18n._
 CONF = cfg.CONF
 
+Limits = collections.namedtuple('Limits', ['vcpus', 'memory_mb'])
+
 
 def _base_config(instance, _):
     instance_attributes = common.InstanceAttributes(instance)
     return {
         'environment.product_name': 'OpenStack Nova',
+        common.INSTANCE_UUID_KEY: instance.uuid,
         'raw.lxc': 'lxc.console.logfile={}\n'.format(
             instance_attributes.console_path),
     }
@@ -69,6 +74,45 @@ def _isolated(instance, client):
             raise exception.NovaException(msg)
 
 
+def instance_limits(instance):
+    """Return the Limits which the profile of an instance sets."""
+    return Limits(max(instance.flavor.vcpus, 0), max(instance.memory_mb, 0))
+
+
+def _parse_cpu(value):
+    # Either a number of cpus, or a set of pinned cpus such as "0-3,6".
+    if value.isdigit():
+        return int(value)
+    count = 0
+    for cpus in value.split(','):
+        first, _sep, last = cpus.partition('-')
+        count += int(last or first) - int(first) + 1
+    return count
+
+
+def _parse_memory_mb(value):
+    if value.isdigit():
+        return int(value) // units.Mi
+    return strutils.string_to_bytes(value, return_int=True) // units.Mi
+
+
+def profile_limits(config):
+    """Return the Limits set by the config of a profile.
+
+    Limits which are not set, or which nova-lxd does not set itself,
+    such as a percentage of the host memory, count as 0.
+    """
+    limits = []
+    for key, parse in (('limits.cpu', _parse_cpu),
+                       ('limits.memory', _parse_memory_mb)):
+        value = config.get(key, '').strip()
+        try:
+            limits.append(parse(value) if value else 0)
+        except ValueError:
+            limits.append(0)
+    return Limits(*limits)
+
+
 _CONFIG_FILTER_MAP = [
     _base_config,
     _nesting,
@@ -0,0 +1,88 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+
+from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+
+from nova.virt.lxd import common
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+PREFIX = common.INTERNAL_PREFIX + 'golden-'
+IMAGE_KEY = 'user.nova-lxd.golden-image'
+
+
+def golden_name(image_ref):
+    return PREFIX + image_ref
+
+
+class GoldenContainers(object):
+    """Clone instance containers from a golden copy of their image.
+
+    Creating a container from an image unpacks the image every time,
+    which on the dir backend takes as long as copying every file in
+    it. With `[lxd] clone_from_golden`, the first container for an
+    image is a stopped golden container named with `PREFIX`, and
+    instance containers are copied from it. LXD copies containers with
+    a snapshot and clone on zfs and btrfs, and with reflinks on
+    filesystems that support them.
+
+    The golden container of an image is deleted with the image by the
+    image cache manager.
+    """
+
+    def __init__(self):
+        self._creating = common.SingleFlight()
+
+    def _ensure(self, client, image_ref):
+        name = golden_name(image_ref)
+        lock_path = os.path.join(CONF.instances_path, 'locks')
+        with lockutils.lock(
+                lock_path, external=True,
+                lock_file_prefix='lxd-golden-{}'.format(image_ref)):
+            if not client.containers.exists(name):
+                LOG.info('Creating golden container %(name)s for image '
+                         '%(image)s', {'name': name, 'image': image_ref})
+                config = common.internal_container_config(
+                    name, image_ref, {IMAGE_KEY: image_ref})
+                client.containers.create(config, wait=True)
+        return name
+
+    def clone(self, client, image_ref, name, profile, config=None):
+        """Create container `name` as a copy of the golden container.
+
+        The golden container is created first if image_ref does not
+        have one yet. `config` is added to the config of the copy.
+        """
+        golden = self._creating.do(image_ref, self._ensure, client, image_ref)
+        container_config = {
+            'name': name,
+            'profiles': [profile.name],
+            'source': {
+                'type': 'copy',
+                'source': golden,
+            },
+        }
+        container = client.containers.create(container_config, wait=True)
+        try:
+            common.adopt_container(container, profile, IMAGE_KEY, config)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                common.discard_container(container)
+        return container
@@ -0,0 +1,90 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import time
+
+import eventlet
+from nova import utils
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class HostSampler(object):
+    """Serve host metrics from samples taken ahead of time.
+
+    Each metric is read by a probe, a function without arguments. A
+    static probe, such as the CPU topology, is read once per process.
+    Other probes are read again every `interval` seconds by a green
+    thread, once they have been asked for, so that callers holding the
+    resource tracker lock are served from memory. Without the thread,
+    or when it falls behind, a probe older than `interval` is read by
+    its caller.
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._probes = {}
+        self._static = set()
+        self._values = {}
+        self._sampled_at = {}
+        self._running = False
+
+    def add_probe(self, name, probe, static=False):
+        self._probes[name] = probe
+        if static:
+            self._static.add(name)
+
+    def _sample(self, name):
+        value = self._probes[name]()
+        self._values[name] = value
+        self._sampled_at[name] = time.time()
+        return value
+
+    def _stale(self, name):
+        if name in self._static:
+            return False
+        # The green thread is given one more interval to catch up.
+        max_age = self._interval * (2 if self._running else 1)
+        return time.time() - self._sampled_at[name] >= max_age
+
+    def get(self, name):
+        """Return the latest sample of a metric."""
+        if name not in self._values or self._stale(name):
+            return self._sample(name)
+        return self._values[name]
+
+    def refresh(self):
+        """Sample every dynamic metric that has been asked for."""
+        for name in list(self._values):
+            if name in self._static:
+                continue
+            try:
+                self._sample(name)
+            except Exception:
+                LOG.exception('Failed to sample host metric %s', name)
+
+    def start(self):
+        if self._interval and not self._running:
+            self._running = True
+            utils.spawn_n(self._run)
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        while self._running:
+            eventlet.sleep(self._interval)
+            if self._running:
+                self.refresh()
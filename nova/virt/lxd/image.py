@@ -0,0 +1,420 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import bz2
+import contextlib
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zlib
+
+from oslo_log import log as logging
+from oslo_utils import units
+import six
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * units.Ki
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_BZIP2_MAGIC = b'BZh'
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+
+
+def _remaining(fileobj):
+    """Return the number of bytes left to read from a file object."""
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, io.UnsupportedOperation):
+        position = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(position, os.SEEK_SET)
+        return size - position
+
+
+def free_space(path):
+    """Return the bytes available to unprivileged users under path."""
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def metadata_tarball(metadata_yaml):
+    """Return an in-memory gzipped tarball holding metadata.yaml.
+
+    :param metadata_yaml: the encoded contents of metadata.yaml
+    :returns: a file object positioned at the start of the tarball
+    """
+    fileobj = io.BytesIO()
+    tarball = tarfile.open(fileobj=fileobj, mode='w:gz')
+    tarinfo = tarfile.TarInfo(name='metadata.yaml')
+    tarinfo.size = len(metadata_yaml)
+    tarball.addfile(tarinfo, io.BytesIO(metadata_yaml))
+    tarball.close()
+    fileobj.seek(0)
+    return fileobj
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body read lazily from file objects.
+
+    pylxd builds multipart image uploads by concatenating the metadata
+    and rootfs into a single bytes object, which costs as much memory as
+    the image itself. This object presents the same body as a sized,
+    readable stream so that requests sends it in bounded chunks.
+
+    :param parts: a sequence of (name, file object) tuples
+    """
+
+    def __init__(self, parts):
+        self.boundary = uuid.uuid4().hex
+        self._segments = []
+        for name, fileobj in parts:
+            preamble = (
+                '--{boundary}\r\n'
+                'Content-Disposition: form-data; name="{name}"; '
+                'filename="{name}"\r\n'
+                'Content-Type: application/octet-stream\r\n'
+                '\r\n'.format(boundary=self.boundary, name=name))
+            self._segments.append(io.BytesIO(preamble.encode('ascii')))
+            self._segments.append(fileobj)
+            self._segments.append(io.BytesIO(b'\r\n'))
+        epilogue = '--{}--\r\n'.format(self.boundary)
+        self._segments.append(io.BytesIO(epilogue.encode('ascii')))
+        self._length = sum(_remaining(s) for s in self._segments)
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for chunk in iter(lambda: self.read(CHUNK_SIZE), b''):
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._segments:
+            chunk = self._segments[0].read(size)
+            if not chunk:
+                self._segments.pop(0)
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+def upload(client, rootfs, metadata=None, public=False):
+    """Import an image into the LXD image store without buffering it.
+
+    When `metadata` is given, the image is uploaded as a split image
+    using a multipart request, otherwise `rootfs` is uploaded as a
+    unified image. A unified `rootfs` may also be an iterable of byte
+    chunks, in which case the body is sent chunk encoded.
+
+    :param client: the pylxd client
+    :param rootfs: the image data
+    :param metadata: an optional file object containing the metadata
+                     tarball for the image
+    :returns: the new pylxd image
+    """
+    headers = {}
+    if public:
+        headers['X-LXD-Public'] = '1'
+
+    if metadata is not None:
+        data = MultipartBody((('metadata', metadata), ('rootfs', rootfs)))
+        headers['Content-Type'] = data.content_type
+    else:
+        data = rootfs
+
+    response = client.api.images.post(data=data, headers=headers)
+    operation = client.operations.wait_for_operation(
+        response.json()['operation'])
+    return client.images.get(operation.metadata['fingerprint'])
+
+
+class _NullDecompressor(object):
+    """Stand-in decompressor for uncompressed streams."""
+
+    def decompress(self, data):
+        return data
+
+
+def _decompressor(head):
+    """Return a decompressor for a stream starting with `head`.
+
+    None is returned when the stream is compressed in a format this
+    python cannot decompress.
+    """
+    if head.startswith(_GZIP_MAGIC):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if head.startswith(_BZIP2_MAGIC):
+        return bz2.BZ2Decompressor()
+    if head.startswith(_XZ_MAGIC):
+        if lzma is None:
+            return None
+        return lzma.LZMADecompressor()
+    return _NullDecompressor()
+
+
+def _tar_header(block):
+    """Parse a 512 byte tar header block."""
+    if six.PY2:
+        return tarfile.TarInfo.frombuf(block)
+    return tarfile.TarInfo.frombuf(block, tarfile.ENCODING, 'surrogateescape')
+
+
+class TarMemberProbe(object):
+    """Look for a member of a (compressed) tarball as it is streamed.
+
+    Bytes are pushed in with `feed` as they arrive. Only the tar headers
+    are inspected; member contents are decompressed and discarded, and
+    nothing is decompressed once the member has been found or the
+    stream turns out not to be a tarball.
+
+    `found` is True or False once the answer is known, and None when
+    it could not be determined (e.g. an xz image on a python without
+    lzma), in which case callers must fall back to reading the file.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.found = False
+        self._done = False
+        self._head = b''
+        self._decompressor = None
+        self._buffer = b''
+        self._skip = 0
+
+    def feed(self, data):
+        if self._done:
+            return
+
+        if self._decompressor is None:
+            self._head += data
+            if len(self._head) < len(_XZ_MAGIC):
+                return
+            self._decompressor = _decompressor(self._head)
+            if self._decompressor is None:
+                self._finish(None)
+                return
+            data, self._head = self._head, b''
+
+        try:
+            self._buffer += self._decompressor.decompress(data)
+        except (IOError, EOFError, ValueError, zlib.error):
+            self._finish(False)
+            return
+        self._parse()
+
+    def close(self):
+        """Signal the end of the stream."""
+        if self._decompressor is None and self._head and not self._done:
+            self._decompressor = _decompressor(self._head)
+            if self._decompressor is None:
+                self._finish(None)
+                return
+            data, self._head = self._head, b''
+            self.feed(data)
+        self._finish(self.found)
+
+    def _finish(self, found):
+        self.found = found
+        self._done = True
+        self._buffer = b''
+        self._decompressor = None
+
+    def _parse(self):
+        while not self._done:
+            if self._skip:
+                skipped = min(self._skip, len(self._buffer))
+                self._buffer = self._buffer[skipped:]
+                self._skip -= skipped
+                if self._skip:
+                    return
+
+            if len(self._buffer) < tarfile.BLOCKSIZE:
+                return
+            block = self._buffer[:tarfile.BLOCKSIZE]
+            self._buffer = self._buffer[tarfile.BLOCKSIZE:]
+
+            if block == tarfile.NUL * tarfile.BLOCKSIZE:
+                # End of archive marker.
+                self._finish(False)
+                return
+            try:
+                member = _tar_header(block)
+            except tarfile.HeaderError:
+                self._finish(False)
+                return
+
+            name = member.name
+            while name.startswith('./'):
+                name = name[2:]
+            if name == self.name:
+                self._finish(True)
+                return
+
+            blocks, remainder = divmod(member.size, tarfile.BLOCKSIZE)
+            if remainder:
+                blocks += 1
+            self._skip = blocks * tarfile.BLOCKSIZE
+
+
+class ImageWriter(object):
+    """A download sink for glance images headed for LXD.
+
+    The writer is handed to `IMAGE_API.download` as its `data` argument.
+    Every chunk is written to `fileobj`, hashed into the LXD fingerprint
+    and fed to a probe for an embedded metadata.yaml, so that once the
+    download completes the image does not have to be read again.
+
+    :param fileobj: the file the image is written to
+    :param throttle: an optional callable, passed the length of each
+                     chunk before it is written, used to limit the
+                     download rate
+    """
+
+    def __init__(self, fileobj, throttle=None):
+        self._file = fileobj
+        self._throttle = throttle
+        self._sha256 = hashlib.sha256()
+        self._probe = TarMemberProbe('metadata.yaml')
+        self.size = 0
+
+    def write(self, chunk):
+        if self._throttle is not None:
+            self._throttle(len(chunk))
+        self._file.write(chunk)
+        self._sha256.update(chunk)
+        self._probe.feed(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        self._probe.close()
+
+    @property
+    def fingerprint(self):
+        """The sha256 of the image, as LXD computes it for unified images."""
+        return self._sha256.hexdigest()
+
+    @property
+    def has_metadata(self):
+        """Whether the image embeds metadata.yaml, or None if unknown."""
+        return self._probe.found
+
+
+class TransferScheduler(object):
+    """Limit the image downloads a compute host runs at the same time.
+
+    At most `max_transfers` transfers are let through `transfer` at
+    once, the rest queue up in arrival order. `throttle` keeps the
+    combined rate of every running transfer below `max_rate` bytes
+    per second, allowing a burst of at most one second's worth of
+    data. A limit of 0 disables it.
+
+    :param max_transfers: the number of transfers allowed at once
+    :param max_rate: the aggregate transfer rate, in bytes per second
+    """
+
+    def __init__(self, max_transfers=0, max_rate=0):
+        self.max_transfers = max_transfers
+        self.max_rate = max_rate
+        self._slots = (threading.Semaphore(max_transfers)
+                       if max_transfers else None)
+        self._lock = threading.Lock()
+        self._allowance = max_rate
+        self._last = time.time()
+        self._queued = 0
+        self._active = 0
+        self._transfers = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    @contextlib.contextmanager
+    def transfer(self, name):
+        """Hold a transfer slot for the duration of the block."""
+        with self._lock:
+            self._queued += 1
+            queued = self._queued
+        start = time.time()
+        try:
+            if self._slots is not None:
+                self._slots.acquire()
+        finally:
+            waited = time.time() - start
+            with self._lock:
+                self._queued -= 1
+        if queued > 1 or waited >= 1:
+            LOG.info('Image transfer %(name)s waited %(waited).1f seconds '
+                     'behind %(queued)d other transfers',
+                     {'name': name, 'waited': waited, 'queued': queued - 1})
+
+        with self._lock:
+            self._active += 1
+            self._transfers += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def throttle(self, size):
+        """Account for size bytes, sleeping to stay within max_rate."""
+        if not self.max_rate:
+            return
+        with self._lock:
+            now = time.time()
+            self._allowance = min(
+                self.max_rate,
+                self._allowance + (now - self._last) * self.max_rate)
+            self._last = now
+            self._allowance -= size
+            delay = -self._allowance / float(self.max_rate)
+        if delay > 0:
+            time.sleep(delay)
+
+    def stats(self):
+        """Return counters describing the transfers seen so far.
+
+        `queued` and `active` are the transfers currently waiting for
+        and holding a slot; `transfers`, `wait_time` and
+        `max_wait_time` cover every transfer started so far.
+        """
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'active': self._active,
+                'transfers': self._transfers,
+                'wait_time': self._wait_time,
+                'max_wait_time': self._max_wait_time,
+            }
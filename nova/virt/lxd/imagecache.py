@@ -0,0 +1,226 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import errno
+import os
+import tempfile
+import time
+
+from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import fileutils
+from oslo_utils import units
+from pylxd import exceptions as lxd_exceptions
+
+from nova.virt.lxd import common
+from nova.virt.lxd import golden
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+CACHE_INDEX = 'lxd-image-cache.json'
+
+synchronized = lockutils.synchronized_with_prefix('nova-lxd-')
+
+
+def _delete_container(client, name):
+    try:
+        client.containers.get(name).delete(wait=True)
+    except lxd_exceptions.LXDAPIException as e:
+        if e.response.status_code != 404:
+            raise
+
+
+class ImageCacheManager(object):
+    """Track and evict the glance images nova-lxd imports into LXD.
+
+    Every image imported by `_sync_glance_image_to_lxd` is aliased by
+    its glance image id. Those aliases are recorded, with the size and
+    glance checksum of the image and the last time an instance was
+    spawned from it, in an index kept next to the instances. The
+    checksums let an image uploaded to glance more than once be found
+    in the image store without downloading it again. `update` is run
+    periodically by the compute manager and deletes the least recently
+    used images that no container or instance references, once they
+    are older than `[lxd] image_cache_min_age`, until the cache fits
+    in `[lxd] image_cache_size_gb`.
+
+    Golden containers do not keep their image in use, and are deleted
+    along with it. Images which were not imported by nova-lxd, or
+    which have aliases that nova-lxd did not create, are never
+    touched.
+    """
+
+    def __init__(self):
+        self._images = None
+
+    @property
+    def path(self):
+        return os.path.join(
+            CONF.instances_path, CONF.image_cache_subdirectory_name,
+            CACHE_INDEX)
+
+    def _load(self):
+        if self._images is None:
+            try:
+                with open(self.path, 'rb') as index:
+                    self._images = jsonutils.load(index)
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self._images = {}
+            except ValueError:
+                LOG.warning('Ignoring corrupt LXD image cache index %s',
+                            self.path)
+                self._images = {}
+        return self._images
+
+    def _save(self):
+        dirname = os.path.dirname(self.path)
+        fileutils.ensure_tree(dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'w') as index:
+            jsonutils.dump(self._images, index)
+        os.rename(tmp_path, self.path)
+
+    @synchronized('image-cache')
+    def register(self, alias, lxd_image, checksum=None):
+        """Record an alias created for a glance image."""
+        images = self._load()
+        images[alias] = {
+            'fingerprint': lxd_image.fingerprint,
+            'size': lxd_image.size,
+            'checksum': checksum,
+            'last_used': time.time(),
+        }
+        self._save()
+
+    @synchronized('image-cache')
+    def lookup(self, checksum):
+        """Return the fingerprint of an image with a glance checksum."""
+        if not checksum:
+            return None
+        for entry in self._load().values():
+            if entry.get('checksum') == checksum:
+                return entry['fingerprint']
+        return None
+
+    @synchronized('image-cache')
+    def touch(self, alias):
+        """Mark an image as used by a new container.
+
+        The timestamp is only kept in memory until the next `update`.
+        """
+        images = self._load()
+        if alias in images:
+            images[alias]['last_used'] = time.time()
+
+    @synchronized('image-cache')
+    def update(self, client, all_instances):
+        """Evict unused images.
+
+        :param client: the pylxd client
+        :param all_instances: the instances on this host, as passed
+                              to `manage_image_cache`
+        """
+        images = self._load()
+        if not images:
+            return
+
+        present = {}
+        response = client.api.images.get(params={'recursion': 1})
+        for lxd_image in response.json()['metadata']:
+            present[lxd_image['fingerprint']] = lxd_image
+
+        # Forget about images that were deleted outside of nova-lxd.
+        for alias, entry in list(images.items()):
+            if entry['fingerprint'] not in present:
+                del images[alias]
+
+        if not CONF.remove_unused_base_images:
+            self._save()
+            return
+
+        used_aliases = set(instance.image_ref for instance in all_instances)
+        used_fingerprints = set()
+        golden_containers = collections.defaultdict(list)
+        for container in common.list_containers(client):
+            fingerprint = container['config'].get('volatile.base_image')
+            if not fingerprint:
+                continue
+            if container['name'].startswith(golden.PREFIX):
+                golden_containers[fingerprint].append(container['name'])
+            else:
+                used_fingerprints.add(fingerprint)
+
+        cached = {}
+        for alias, entry in images.items():
+            cached_image = cached.setdefault(entry['fingerprint'], {
+                'aliases': set(), 'size': entry['size'], 'last_used': 0})
+            cached_image['aliases'].add(alias)
+            cached_image['last_used'] = max(
+                cached_image['last_used'], entry['last_used'])
+
+        budget = CONF.lxd.image_cache_size_gb * units.Gi
+        now = time.time()
+
+        candidates = sorted(
+            (c['last_used'], fingerprint)
+            for fingerprint, c in cached.items()
+            if fingerprint not in used_fingerprints and
+            not c['aliases'] & used_aliases and
+            now - c['last_used'] >= CONF.lxd.image_cache_min_age)
+        # Images in use cannot be evicted, and do not count against the
+        # budget.
+        total = sum(cached[fingerprint]['size']
+                    for _, fingerprint in candidates)
+
+        for _, fingerprint in candidates:
+            if budget and total <= budget:
+                break
+
+            cached_image = cached[fingerprint]
+            aliases = set(
+                a['name'] for a in present[fingerprint].get('aliases', []))
+            if aliases - cached_image['aliases']:
+                LOG.debug('Not evicting image %(fingerprint)s, it has '
+                          'aliases not managed by nova: %(aliases)s',
+                          {'fingerprint': fingerprint,
+                           'aliases': ', '.join(
+                               aliases - cached_image['aliases'])})
+                continue
+
+            LOG.info('Removing unused image %(fingerprint)s (%(aliases)s) '
+                     'from the LXD image store',
+                     {'fingerprint': fingerprint,
+                      'aliases': ', '.join(sorted(cached_image['aliases']))})
+            try:
+                for name in golden_containers[fingerprint]:
+                    _delete_container(client, name)
+                client.images.get(fingerprint).delete(wait=True)
+            except lxd_exceptions.LXDAPIException as e:
+                if e.response.status_code != 404:
+                    LOG.warning('Failed to remove image %(fingerprint)s: '
+                                '%(reason)s',
+                                {'fingerprint': fingerprint, 'reason': e})
+                    continue
+
+            total -= cached_image['size']
+            for alias in cached_image['aliases']:
+                del images[alias]
+
+        self._save()
@@ -0,0 +1,128 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import json
+
+from oslo_utils import strutils
+
+IMAGE_PROPERTY = 'lxd_nocloud'
+
+
+def supported(instance):
+    """Whether the image of an instance takes metadata from NoCloud.
+
+    Only images whose `lxd_nocloud` property is true are, so that
+    images without a NoCloud datasource keep getting a config drive.
+    """
+    value = instance.system_metadata.get('image_' + IMAGE_PROPERTY)
+    return strutils.bool_from_string(value, default=False)
+
+
+def meta_data(inst_md):
+    """Return the NoCloud meta-data of an instance, as YAML.
+
+    It holds the OpenStack metadata of the config drive, with the keys
+    cloud-init reads from NoCloud added.
+
+    :param inst_md: the InstanceMetadata of the instance
+    """
+    metadata = json.loads(inst_md.lookup(
+        '/openstack/latest/meta_data.json').decode('utf-8'))
+    metadata['instance-id'] = metadata['uuid']
+    metadata['local-hostname'] = metadata['hostname']
+    public_keys = metadata.get('public_keys')
+    if public_keys:
+        metadata['public-keys'] = [
+            public_keys[name] for name in sorted(public_keys)]
+    # JSON values are valid YAML, and keep arbitrary strings quoted.
+    return ''.join(
+        '{}: {}\n'.format(key, json.dumps(metadata[key], sort_keys=True))
+        for key in sorted(metadata))
+
+
+def user_data(inst_md):
+    """Return the user data of an instance as text.
+
+    :param inst_md: the InstanceMetadata of the instance
+    :raises ValueError: if the user data is not valid UTF-8 text, as
+                        LXD config values are strings
+    """
+    if not inst_md.userdata_raw:
+        return None
+    try:
+        return inst_md.userdata_raw.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError('User data is not UTF-8 text')
+
+
+def _subnet_config(subnet):
+    config = []
+    prefix = subnet['cidr'].split('/')[1]
+    gateway = subnet['gateway'] and subnet['gateway']['address']
+    nameservers = [dns['address'] for dns in subnet['dns']]
+    for ip in subnet['ips']:
+        entry = {
+            'type': 'static',
+            'address': '{}/{}'.format(ip['address'], prefix),
+        }
+        if gateway:
+            entry['gateway'] = gateway
+        if nameservers:
+            entry['dns_nameservers'] = nameservers
+        config.append(entry)
+    if not config:
+        config.append({'type': 'dhcp6' if subnet['version'] == 6 else 'dhcp'})
+    return config
+
+
+def network_config(network_info):
+    """Return a version 1 cloud-init network config for network_info.
+
+    Interfaces are matched by MAC address and named eth0, eth1, ... in
+    the order of network_info.
+    """
+    interfaces = []
+    for index, vif in enumerate(network_info):
+        subnets = []
+        network = vif.get('network') or {}
+        for subnet in network.get('subnets', []):
+            subnets.extend(_subnet_config(subnet))
+        interfaces.append({
+            'type': 'physical',
+            'name': 'eth{}'.format(index),
+            'mac_address': vif['address'],
+            'subnets': subnets,
+        })
+    return {'version': 1, 'config': interfaces}
+
+
+def instance_config(inst_md, network_info):
+    """Return the container config keys carrying the instance metadata.
+
+    LXD hands the `user.meta-data`, `user.user-data` and
+    `user.network-config` keys of a container to cloud-init through its
+    NoCloud seed. LXD writes meta-data of its own and appends
+    `user.meta-data` to it, so the keys given here replace LXD's.
+
+    :param inst_md: the InstanceMetadata of the instance
+    :raises ValueError: if the user data cannot be passed to LXD
+    """
+    config = {'user.meta-data': meta_data(inst_md)}
+    data = user_data(inst_md)
+    if data is not None:
+        config['user.user-data'] = data
+    if network_info:
+        config['user.network-config'] = json.dumps(
+            network_config(network_info))
+    return config
@@ -0,0 +1,196 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import functools
+import os
+
+from oslo_concurrency import processutils
+from oslo_privsep import capabilities
+from oslo_privsep import priv_context
+
+from nova.virt.lxd import tracing
+
+# The privileged operations of nova-lxd run in a privsep daemon, which
+# is started through rootwrap the first time one of them is called and
+# then lives as long as nova-compute. Each call is a round trip on the
+# daemon's socket, rather than a sudo and a rootwrap startup.
+lxd_pctxt = priv_context.PrivContext(
+    'nova',
+    cfg_section='nova_lxd_privileged',
+    pypath=__name__ + '.lxd_pctxt',
+    capabilities=[capabilities.CAP_CHOWN,
+                  capabilities.CAP_DAC_OVERRIDE,
+                  capabilities.CAP_DAC_READ_SEARCH,
+                  capabilities.CAP_FOWNER,
+                  capabilities.CAP_NET_ADMIN,
+                  capabilities.CAP_SYS_ADMIN],
+)
+
+_calls = collections.Counter()
+
+
+def _entrypoint(func):
+    """Run func in the privsep daemon, and count the calls made to it."""
+    privileged = lxd_pctxt.entrypoint(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _calls[func.__name__] += 1
+        with tracing.timed('privsep', func.__name__):
+            return privileged(*args, **kwargs)
+    # The daemon looks the entrypoint up by name, and checks that it
+    # belongs to lxd_pctxt.
+    wrapper.__dict__.update(privileged.__dict__)
+    return wrapper
+
+
+def stats():
+    """Return the number of calls made to each privileged operation."""
+    return dict(_calls)
+
+
+def _walk(path):
+    yield path
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            yield os.path.join(root, name)
+
+
+@_entrypoint
+def chown(path, uid=-1, gid=-1, recursive=False):
+    """Change the owner of path, and of everything under it if recursive.
+
+    Symbolic links are changed themselves, and are not followed.
+    """
+    paths = _walk(path) if recursive else [path]
+    for entry in paths:
+        os.lchown(entry, uid, gid)
+
+
+@_entrypoint
+def chmod(path, mode, recursive=False):
+    """Change the mode of path, and of everything under it if recursive.
+
+    Symbolic links are skipped.
+    """
+    paths = _walk(path) if recursive else [path]
+    for entry in paths:
+        if not os.path.islink(entry):
+            os.chmod(entry, mode)
+
+
+@_entrypoint
+def mount(source, target, fstype=None, options=None):
+    cmd = ['mount']
+    if fstype:
+        cmd.extend(['-t', fstype])
+    if options:
+        cmd.extend(['-o', options])
+    cmd.extend([source, target])
+    processutils.execute(*cmd)
+
+
+@_entrypoint
+def umount(target):
+    processutils.execute('umount', target)
+
+
+@_entrypoint
+def zpool_attribute(pool, attribute):
+    """Return the output of `zpool list` for one attribute of a pool."""
+    return processutils.execute('zpool', 'list', '-o', attribute, '-H', pool)
+
+
+@_entrypoint
+def zfs_create(dataset, mountpoint, quota_gb):
+    processutils.execute(
+        'zfs', 'create',
+        '-o', 'mountpoint=%s' % mountpoint,
+        '-o', 'quota=%sG' % quota_gb,
+        dataset)
+
+
+@_entrypoint
+def zfs_destroy(dataset):
+    processutils.execute('zfs', 'destroy', dataset)
+
+
+@_entrypoint
+def btrfs_subvolume_create(path, quota_gb):
+    """Create a btrfs subvolume and limit its size."""
+    processutils.execute('btrfs', 'subvolume', 'create', path)
+    processutils.execute(
+        'btrfs', 'qgroup', 'limit', '%sg' % quota_gb, path)
+
+
+@_entrypoint
+def lvm_create_ext4(vg, name, size_gb):
+    """Create a logical volume and an ext4 filesystem on it."""
+    processutils.execute(
+        'lvcreate', '-L', '%sG' % size_gb, '-n', name, vg, attempts=3)
+    processutils.execute('mkfs', '-t', 'ext4', '/dev/%s/%s' % (vg, name))
+
+
+@_entrypoint
+def lvremove(path):
+    processutils.execute('lvremove', '-f', path)
+
+
+def _device_exists(dev):
+    return os.path.exists('/sys/class/net/%s' % dev)
+
+
+def _delete_net_dev(dev):
+    if _device_exists(dev):
+        processutils.execute('ip', 'link', 'delete', dev,
+                             check_exit_code=[0, 2, 254])
+
+
+def _set_device_mtu(dev, mtu):
+    if mtu:
+        with open('/sys/class/net/%s/mtu' % dev, 'w') as f:
+            f.write(str(mtu))
+
+
+@_entrypoint
+def delete_net_dev(dev):
+    """Delete a network device, if it exists."""
+    _delete_net_dev(dev)
+
+
+@_entrypoint
+def set_device_mtu(dev, mtu):
+    _set_device_mtu(dev, mtu)
+
+
+@_entrypoint
+def create_veth_pair(dev1_name, dev2_name, mtu=None):
+    """Create a pair of veth devices with the specified names.
+
+    Previous devices with those names are deleted first. The devices
+    are brought up, and their MTU is set if one is given.
+    """
+    for dev in (dev1_name, dev2_name):
+        _delete_net_dev(dev)
+    processutils.execute('ip', 'link', 'add', dev1_name, 'type', 'veth',
+                         'peer', 'name', dev2_name)
+    for dev in (dev1_name, dev2_name):
+        processutils.execute('ip', 'link', 'set', dev, 'up')
+        _set_device_mtu(dev, mtu)
+
+
+@_entrypoint
+def add_bridge_port(bridge, dev):
+    processutils.execute('brctl', 'addif', bridge, dev)
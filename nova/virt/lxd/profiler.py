@@ -0,0 +1,263 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import cProfile
+import collections
+import datetime
+import functools
+import os
+import signal
+import sys
+
+import eventlet
+from oslo_log import log as logging
+from oslo_utils import excutils
+from oslo_utils import fileutils
+import six
+
+from nova.virt.lxd import tracing
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+LOG = logging.getLogger(__name__)
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+TRACEMALLOC = 'tracemalloc'
+MODES = (CPROFILE, SAMPLING, TRACEMALLOC)
+
+# Seconds between two samples of the stack.
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 25
+TRACEMALLOC_TOP = 50
+
+# The sampler runs in a real thread, so that it keeps sampling while
+# the green thread it watches does not yield.
+_thread = eventlet.patcher.original('_thread' if six.PY3 else 'thread')
+_threading = eventlet.patcher.original('threading')
+_time = eventlet.patcher.original('time')
+
+
+def _collapse(frame):
+    """Return a stack in the collapsed format of flame graph tools."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(code.co_filename, code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """Count the stacks an OS thread is seen running.
+
+    All the green threads of nova-compute run in the same OS thread,
+    so the stacks counted are those of whichever green thread holds
+    it, including the ones the profiled call waits for.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.stacks = collections.Counter()
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = _threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+            del frame
+            _time.sleep(self._interval)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def _start_cprofile(profiler):
+    # Only one cProfile profiler can be active in a thread at a time.
+    if profiler._cprofile_busy:
+        LOG.debug('Not profiling with cProfile, as another call is.')
+        return None
+    profiler._cprofile_busy = True
+    profile = cProfile.Profile()
+    profile.enable()
+
+    def stop(path):
+        try:
+            profile.disable()
+            profile.dump_stats(path)
+        finally:
+            profiler._cprofile_busy = False
+    return stop
+
+
+def _start_sampling(profiler):
+    sampler = StackSampler(_thread.get_ident())
+    sampler.start()
+
+    def stop(path):
+        sampler.stop()
+        sampler.write(path)
+    return stop
+
+
+def _start_tracemalloc(profiler):
+    # Calls profiled concurrently share the tracing, which is stopped
+    # once the last of them is done, unless it was started elsewhere.
+    if not profiler._tracemalloc_users:
+        profiler._tracemalloc_started = not tracemalloc.is_tracing()
+        if profiler._tracemalloc_started:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler._tracemalloc_users += 1
+
+    def release():
+        profiler._tracemalloc_users -= 1
+        if (not profiler._tracemalloc_users and
+                profiler._tracemalloc_started):
+            tracemalloc.stop()
+
+    try:
+        before = tracemalloc.take_snapshot()
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            release()
+
+    def stop(path):
+        try:
+            after = tracemalloc.take_snapshot()
+        finally:
+            release()
+        with open(path, 'w') as f:
+            for stat in after.compare_to(
+                    before, 'lineno')[:TRACEMALLOC_TOP]:
+                f.write('{}\n'.format(stat))
+    return stop
+
+
+_COLLECTORS = collections.OrderedDict([
+    (CPROFILE, ('prof', _start_cprofile)),
+    (SAMPLING, ('stacks', _start_sampling)),
+    (TRACEMALLOC, ('tracemalloc', _start_tracemalloc)),
+])
+
+
+class Profiler(object):
+    """Profile driver methods on demand.
+
+    Methods decorated with `profiled` are profiled while the profiler
+    is active, with each of the configured modes, and a file is
+    written per call and mode to `directory`, named after the method,
+    the instance it was called for and the time of the call. The
+    profiler is active from the start when `enabled` is set, and can
+    be switched on and off with a signal. While it is not, a decorated
+    method costs a single attribute lookup more.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.modes = ()
+        self.active = False
+        self._cprofile_busy = False
+        self._tracemalloc_users = 0
+        self._tracemalloc_started = False
+
+    def configure(self, directory, modes, enabled=False):
+        self.directory = directory
+        self.modes = []
+        for mode in modes:
+            if mode not in _COLLECTORS:
+                LOG.warning('Unknown profiling mode %s ignored.', mode)
+            elif mode == TRACEMALLOC and tracemalloc is None:
+                LOG.warning('tracemalloc is not available in this version '
+                            'of Python, and is not used for profiling.')
+            else:
+                self.modes.append(mode)
+        if directory:
+            fileutils.ensure_tree(directory)
+        self.active = bool(directory and self.modes and enabled)
+
+    def toggle(self, signum=None, frame=None):
+        """Switch profiling on or off, if it is configured."""
+        if not self.directory or not self.modes:
+            LOG.warning('Profiling is not configured, see profile_dir.')
+            return
+        self.active = not self.active
+        LOG.info('Profiling of the LXD driver %s, writing to %s.',
+                 'started' if self.active else 'stopped', self.directory)
+
+    def install_signal(self, name):
+        """Toggle profiling when the process receives signal `name`."""
+        signal.signal(getattr(signal, name), self.toggle)
+
+    def _prefix(self, method, instance):
+        return os.path.join(self.directory, '{}-{}-{}.'.format(
+            method, instance or 'host',
+            datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S.%f')))
+
+    def run(self, method, instance, func, *args, **kwargs):
+        """Call func, profiled with each of the configured modes."""
+        # Failing to profile must not fail the call.
+        stops = []
+        for mode in self.modes:
+            extension, start = _COLLECTORS[mode]
+            try:
+                stop = start(self)
+            except Exception as e:
+                LOG.warning('Failed to profile %(method)s with %(mode)s: '
+                            '%(error)s',
+                            {'method': method, 'mode': mode, 'error': e})
+                continue
+            if stop is not None:
+                stops.append((extension, stop))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            prefix = self._prefix(method, instance)
+            for extension, stop in reversed(stops):
+                try:
+                    stop(prefix + extension)
+                except Exception as e:
+                    LOG.warning('Failed to write the profile of %(method)s: '
+                                '%(error)s', {'method': method, 'error': e})
+
+
+PROFILER = Profiler()
+
+
+def profiled(func):
+    """Profile a driver method while the profiler is active."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not PROFILER.active:
+            return func(self, *args, **kwargs)
+        return PROFILER.run(func.__name__,
+                            tracing.instance_uuid(args, kwargs),
+                            func, self, *args, **kwargs)
+    return wrapper
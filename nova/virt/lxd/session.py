@@ -14,6 +14,12 @@
 #    the License for the specific language governing permissions and
 #    limitations under the License.
 
+import collections
+import contextlib
+import select
+import socket
+import threading
+
 import nova.conf
 from nova import context as nova_context
 from nova import exception
@@ -22,19 +28,122 @@ from nova import rpc
 
 from oslo_log import log as logging
 from oslo_utils import excutils
+from six.moves import http_client
 
 from pylxd.deprecated import api
 from pylxd.deprecated import exceptions as lxd_exceptions
 
+from nova.virt.lxd import tracing
+
 _ = i18n._
 
 CONF = nova.conf.CONF
+CONF.import_opt('timeout', 'nova.virt.lxd.driver', group='lxd')
 LOG = logging.getLogger(__name__)
 
+# Idle clients kept for each LXD host.
+MAX_IDLE_CLIENTS = 8
+
+
+def _connection_dropped(client):
+    """Whether the keep-alive connection of a client was closed.
+
+    An idle HTTP connection has nothing to read, unless the server
+    closed it, so this needs no request to LXD.
+    """
+    connection = client.connection.connection
+    sock = connection and connection.sock
+    if sock is None:
+        return False
+    try:
+        readable, _w, _x = select.select([sock], [], [], 0)
+    except (socket.error, ValueError):
+        return True
+    return bool(readable)
+
+
+def _close(client):
+    connection = client.connection.connection
+    client.connection.connection = None
+    if connection is not None:
+        connection.close()
+
+
+class ClientPool(object):
+    """Reuse pylxd clients and their keep-alive connections.
+
+    Every client keeps its HTTP connection to LXD open, over the unix
+    socket or to a remote host. A client is checked out for the
+    duration of a `client` block, so that it is never used by two
+    threads or green threads at once, and is returned to the pool of
+    its host afterwards. A client whose connection failed is dropped,
+    and one whose connection was closed by LXD while idle reconnects.
+    """
+
+    def __init__(self, connect, max_idle=MAX_IDLE_CLIENTS):
+        self._connect = connect
+        self._max_idle = max_idle
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _checkout(self, host):
+        with self._lock:
+            idle = self._idle[host]
+            client = idle.pop() if idle else None
+        if client is None:
+            self._count('created')
+            return self._connect(host)
+        self._count('reused')
+        if _connection_dropped(client):
+            self._count('reconnected')
+            _close(client)
+        return client
+
+    def _checkin(self, host, client):
+        with self._lock:
+            idle = self._idle[host]
+            if len(idle) < self._max_idle:
+                idle.append(client)
+                return
+        _close(client)
+
+    @contextlib.contextmanager
+    def client(self, host=None):
+        """Check out a client of `host`, or of the local LXD."""
+        client = self._checkout(host)
+        try:
+            yield client
+        except (socket.error, http_client.HTTPException):
+            self._count('dropped')
+            _close(client)
+            raise
+        except Exception:
+            self._checkin(host, client)
+            raise
+        else:
+            self._checkin(host, client)
+
+    def stats(self):
+        """Return the pool statistics, and the idle clients per host."""
+        stats = dict(self._stats)
+        with self._lock:
+            stats['idle'] = dict(
+                (host, len(idle)) for host, idle in self._idle.items())
+        return stats
+
 
 class LXDAPISession(object):
     """The session to invoke the LXD API session."""
 
+    def __init__(self):
+        self._pool = ClientPool(self.get_session)
+        tracing.TRACER.add_stats('session_pool', self._pool.stats)
+
     def get_session(self, host=None):
         """Returns a connection to the LXD hypervisor
 
@@ -78,8 +187,8 @@ class LXDAPISession(object):
                      ' %(image)s', {'instance': instance.name,
                                     'image': instance.image_ref})
 
-            client = self.get_session(host=host)
-            (state, data) = client.container_init(config)
+            with self._pool.client(host) as client:
+                (state, data) = client.container_init(config)
             operation = data.get('operation')
             self.operation_wait(operation, instance, host=host)
             status, data = self.operation_info(operation, instance, host=host)
@@ -115,8 +224,11 @@ class LXDAPISession(object):
         """
         LOG.debug('wait_for_container for instance', instance=instance)
         try:
-            client = self.get_session(host=host)
-            if not client.wait_container_operation(operation_id, 200, -1):
+            timeout = CONF.lxd.timeout if CONF.lxd.timeout > 0 else -1
+            with self._pool.client(host) as client:
+                done = client.wait_container_operation(
+                    operation_id, 200, timeout)
+            if not done:
                 msg = _('Container creation timed out')
                 raise exception.NovaException(msg)
         except lxd_exceptions.APIError as ex:
@@ -135,8 +247,8 @@ class LXDAPISession(object):
     def operation_info(self, operation_id, instance, host=None):
         LOG.debug('operation_info called for instance', instance=instance)
         try:
-            client = self.get_session(host=host)
-            return client.operation_info(operation_id)
+            with self._pool.client(host) as client:
+                return client.operation_info(operation_id)
         except lxd_exceptions.APIError as ex:
             msg = _('Failed to communicate with LXD API %(instance)s:'
                     ' %(reason)s') % {'instance': instance.image_ref,
@@ -168,8 +280,8 @@ class LXDAPISession(object):
                      '%(image)s', {'instance': instance_name,
                                    'image': instance.image_ref})
 
-            client = self.get_session()
-            (state, data) = client.container_migrate(instance_name)
+            with self._pool.client() as client:
+                (state, data) = client.container_migrate(instance_name)
 
             LOG.info('Successfully initialized migration for instance '
                      '%(instance)s with %(image)s',
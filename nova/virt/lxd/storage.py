@@ -16,10 +16,10 @@ import os
 
 from oslo_utils import fileutils
 from nova import exception
-from nova import utils
 from nova.virt import driver
 
 from nova.virt.lxd import common
+from nova.virt.lxd import privsep
 
 
 def attach_ephemeral(client, block_device_info, lxd_config, instance):
@@ -41,12 +41,9 @@ def attach_ephemeral(client, block_device_info, lxd_config, instance):
             if storage_driver == 'zfs':
                 zfs_pool = lxd_config['config']['storage.zfs_pool_name']
 
-                utils.execute(
-                    'zfs', 'create',
-                    '-o', 'mountpoint=%s' % storage_dir,
-                    '-o', 'quota=%sG' % instance.ephemeral_gb,
-                          '%s/%s-ephemeral' % (zfs_pool, instance.name),
-                    run_as_root=True)
+                privsep.zfs_create(
+                    '%s/%s-ephemeral' % (zfs_pool, instance.name),
+                    storage_dir, instance.ephemeral_gb)
             elif storage_driver == 'btrfs':
                 # We re-use the same btrfs subvolumes that LXD uses,
                 # so the ephemeral storage path is updated in the profile
@@ -58,13 +55,8 @@ def attach_ephemeral(client, block_device_info, lxd_config, instance):
                 profile.devices[storage_name]['source'] = storage_dir
                 profile.save()
 
-                utils.execute(
-                    'btrfs', 'subvolume', 'create', storage_dir,
-                    run_as_root=True)
-                utils.execute(
-                    'btrfs', 'qgroup', 'limit',
-                    '%sg' % instance.ephemeral_gb, storage_dir,
-                    run_as_root=True)
+                privsep.btrfs_subvolume_create(
+                    storage_dir, instance.ephemeral_gb)
             elif storage_driver == 'lvm':
                 fileutils.ensure_tree(storage_dir)
 
@@ -73,23 +65,15 @@ def attach_ephemeral(client, block_device_info, lxd_config, instance):
                                         ephemeral['virtual_name'])
                 lvm_path = '/dev/%s/%s' % (lvm_pool, lvm_volume)
 
-                cmd = (
-                    'lvcreate', '-L', '%sG' % instance.ephemeral_gb,
-                    '-n', lvm_volume, lvm_pool)
-                utils.execute(*cmd, run_as_root=True, attempts=3)
-
-                utils.execute('mkfs', '-t', 'ext4',
-                              lvm_path, run_as_root=True)
-                cmd = ('mount', '-t', 'ext4', lvm_path, storage_dir)
-                utils.execute(*cmd, run_as_root=True)
+                privsep.lvm_create_ext4(
+                    lvm_pool, lvm_volume, instance.ephemeral_gb)
+                privsep.mount(lvm_path, storage_dir, fstype='ext4')
             else:
                 reason = _('Unsupport LXD storage detected. Supported'
                            ' storage drivers are zfs and btrfs.')
                 raise exception.NovaException(reason)
 
-            utils.execute(
-                'chown', storage_id,
-                storage_dir, run_as_root=True)
+            privsep.chown(storage_dir, uid=int(storage_id))
 
 
 def detach_ephemeral(block_device_info, lxd_config, instance):
@@ -103,15 +87,13 @@ def detach_ephemeral(block_device_info, lxd_config, instance):
             if storage_driver == 'zfs':
                 zfs_pool = lxd_config['config']['storage.zfs_pool_name']
 
-                utils.execute(
-                    'zfs', 'destroy',
-                    '%s/%s-ephemeral' % (zfs_pool, instance.name),
-                    run_as_root=True)
+                privsep.zfs_destroy(
+                    '%s/%s-ephemeral' % (zfs_pool, instance.name))
             if storage_driver == 'lvm':
                 lvm_pool = lxd_config['config']['storage.lvm_vg_name']
 
                 lvm_path = '/dev/%s/%s-%s' % (
                     lvm_pool, instance.name, ephemeral['virtual_name'])
 
-                utils.execute('umount', lvm_path, run_as_root=True)
-                utils.execute('lvremove', '-f', lvm_path, run_as_root=True)
+                privsep.umount(lvm_path)
+                privsep.lvremove(lvm_path)
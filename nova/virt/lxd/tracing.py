@@ -0,0 +1,268 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import contextlib
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+import eventlet
+from nova import utils
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in milliseconds.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+              10000, 30000, 60000, float('inf'))
+RECENT_CALLS = 100
+DUMP_INTERVAL = 60
+
+# Path segments of the LXD API which are kept in the names of calls.
+# Any other segment is the name of an object, and is replaced by '*'
+# so that there is one histogram per kind of call.
+_API_WORDS = frozenset([
+    '1.0', 'aliases', 'certificates', 'console', 'containers', 'events',
+    'exec', 'export', 'files', 'images', 'logs', 'metadata', 'networks',
+    'operations', 'profiles', 'resources', 'secret', 'snapshots', 'state',
+    'storage-pools', 'volumes', 'wait', 'websocket'])
+
+
+class Histogram(object):
+    """Count latencies in the buckets of BUCKETS_MS."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def add(self, duration_ms):
+        for i, bound in enumerate(BUCKETS_MS):
+            if duration_ms <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total_ms += duration_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum_ms': round(self.total_ms, 3),
+            'buckets': [[str(bound), count] for bound, count
+                        in zip(BUCKETS_MS, self.counts)],
+        }
+
+
+class Tracer(object):
+    """Aggregate the latency of driver methods and of the calls they make.
+
+    Driver methods decorated with `traced` are always timed, and set
+    the method and instance the calls made from their thread are
+    tagged with. Calls to the LXD API and to privileged operations are
+    sampled: each is recorded with a probability of `sample_rate`, so
+    that a low rate keeps the overhead low on busy hosts. A rate of 0
+    turns tracing off altogether.
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self._histograms = collections.defaultdict(Histogram)
+        self._recent = collections.deque(maxlen=RECENT_CALLS)
+        self._stats = {}
+        self._context = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def sampled(self):
+        return self.enabled and random.random() < self.sample_rate
+
+    @property
+    def context(self):
+        return getattr(self._context, 'value', (None, None))
+
+    @contextlib.contextmanager
+    def tagged(self, method, instance):
+        previous = self.context
+        self._context.value = (method, instance)
+        try:
+            yield
+        finally:
+            self._context.value = previous
+
+    def record(self, kind, name, duration, status=None, size=None):
+        duration_ms = duration * 1000
+        method, instance = self.context
+        with self._lock:
+            self._histograms['{}:{}'.format(kind, name)].add(duration_ms)
+            if kind != 'driver':
+                self._recent.append({
+                    'kind': kind,
+                    'name': name,
+                    'duration_ms': round(duration_ms, 3),
+                    'status': status,
+                    'size': size,
+                    'method': method,
+                    'instance': instance,
+                })
+
+    def add_stats(self, name, stats):
+        """Include what stats() returns in snapshots, under name."""
+        self._stats[name] = stats
+
+    def snapshot(self):
+        # The stats callables take their own locks.
+        stats = dict((name, func()) for name, func in self._stats.items())
+        with self._lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'histograms': dict(
+                    (name, histogram.to_dict())
+                    for name, histogram in self._histograms.items()),
+                'recent': list(self._recent),
+                'stats': stats,
+            }
+
+    def dump(self, path):
+        """Write a snapshot of the metrics to path, as JSON."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.rename(tmp_path, path)
+
+    def start_dumping(self, path, interval=DUMP_INTERVAL):
+        def _dump_forever():
+            while True:
+                eventlet.sleep(interval)
+                try:
+                    self.dump(path)
+                except (IOError, OSError) as e:
+                    LOG.warning('Failed to write LXD metrics to %(path)s: '
+                                '%(error)s', {'path': path, 'error': e})
+        utils.spawn_n(_dump_forever)
+
+
+TRACER = Tracer()
+
+
+def instance_uuid(args, kwargs):
+    """Return the uuid of the instance a driver method was called for."""
+    instance = kwargs.get('instance')
+    if instance is None:
+        for arg in args:
+            if hasattr(arg, 'uuid') and hasattr(arg, 'flavor'):
+                instance = arg
+                break
+    return getattr(instance, 'uuid', None)
+
+
+def traced(func):
+    """Time a driver method, and tag the calls it makes with it."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not TRACER.enabled:
+            return func(self, *args, **kwargs)
+        with TRACER.tagged(func.__name__, instance_uuid(args, kwargs)):
+            start = time.time()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                TRACER.record('driver', func.__name__, time.time() - start)
+    return wrapper
+
+
+@contextlib.contextmanager
+def timed(kind, name):
+    """Record the latency of a sampled call."""
+    if not TRACER.sampled():
+        yield
+        return
+    start = time.time()
+    status = 'ok'
+    try:
+        yield
+    except Exception as e:
+        status = type(e).__name__
+        raise
+    finally:
+        TRACER.record(kind, name, time.time() - start, status=status)
+
+
+def api_name(path):
+    return '/'.join(
+        segment if segment in _API_WORDS else '*'
+        for segment in path)
+
+
+class TracedAPI(object):
+    """Trace the requests made through a pylxd API node.
+
+    `client.api` is replaced by a TracedAPI, and every node reached
+    from it is wrapped in turn, so that all the requests pylxd makes
+    for the client are traced.
+    """
+
+    _METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+    def __init__(self, node, path=('1.0',)):
+        self._node = node
+        self._path = path
+
+    def _child(self, node, name):
+        if isinstance(node, type(self._node)):
+            return TracedAPI(node, self._path + (str(name),))
+        return node
+
+    def __getattr__(self, name):
+        if name in self._METHODS:
+            return self._traced(name, getattr(self._node, name))
+        return self._child(getattr(self._node, name), name)
+
+    def __getitem__(self, item):
+        return self._child(self._node[item], item)
+
+    def _traced(self, method, request):
+        @functools.wraps(request)
+        def wrapper(*args, **kwargs):
+            if not TRACER.sampled():
+                return request(*args, **kwargs)
+            name = '{} /{}'.format(method.upper(), api_name(self._path))
+            start = time.time()
+            status = size = None
+            try:
+                response = request(*args, **kwargs)
+                status = response.status_code
+                if not kwargs.get('stream'):
+                    size = len(response.content)
+                return response
+            except Exception as e:
+                status = getattr(getattr(e, 'response', None),
+                                 'status_code', type(e).__name__)
+                raise
+            finally:
+                TRACER.record('lxd', name, time.time() - start,
+                              status=status, size=size)
+        return wrapper
+
+
+def trace_client(client):
+    """Trace the LXD API requests made through a pylxd client."""
+    client.api = TracedAPI(client.api)
+    return client
@@ -17,11 +17,12 @@ from oslo_log import log as logging
 
 from nova import conf
 from nova import exception
-from nova import utils
 from nova.network import linux_net
 from nova.network import model as network_model
 from nova.network import os_vif_util
 
+from nova.virt.lxd import privsep
+
 import os_vif
 
 
@@ -46,19 +47,11 @@ def _create_veth_pair(dev1_name, dev2_name, mtu=None):
     """Create a pair of veth devices with the specified names,
     deleting any previous devices with those names.
     """
-    for dev in [dev1_name, dev2_name]:
-        linux_net.delete_net_dev(dev)
-
-    utils.execute('ip', 'link', 'add', dev1_name, 'type', 'veth', 'peer',
-                  'name', dev2_name, run_as_root=True)
-
-    for dev in [dev1_name, dev2_name]:
-        utils.execute('ip', 'link', 'set', dev, 'up', run_as_root=True)
-        linux_net._set_device_mtu(dev, mtu)
+    privsep.create_veth_pair(dev1_name, dev2_name, mtu)
 
 
 def _add_bridge_port(bridge, dev):
-    utils.execute('brctl', 'addif', bridge, dev, run_as_root=True)
+    privsep.add_bridge_port(bridge, dev)
 
 
 def _is_no_op_firewall():
@@ -168,7 +161,7 @@ def _post_unplug_wiring_delete_veth(instance, vif):
             linux_net.delete_ovs_vif_port(vif['network']['bridge'],
                                           v1_name, True)
         else:
-            linux_net.delete_net_dev(v1_name)
+            privsep.delete_net_dev(v1_name)
     except processutils.ProcessExecutionError:
         LOG.exception("Failed to delete veth for vif",
                       vif=vif)
@@ -255,13 +248,13 @@ class LXDGenericVifDriver(object):
         if not linux_net.device_exists(v1_name):
             _create_veth_pair(v1_name, v2_name, mtu)
         else:
-            linux_net._set_device_mtu(v1_name, mtu)
+            privsep.set_device_mtu(v1_name, mtu)
 
     def unplug_tap(self, instance, vif):
         """Unplug a VIF_TYPE_TAP virtual interface."""
         dev = get_vif_devname(vif)
         try:
-            linux_net.delete_net_dev(dev)
+            privsep.delete_net_dev(dev)
         except processutils.ProcessExecutionError:
             LOG.exception("Failed while unplugging vif",
                           instance=instance)
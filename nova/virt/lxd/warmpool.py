@@ -0,0 +1,171 @@
+# Copyright 2017 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import threading
+import uuid
+
+from nova import exception
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+from pylxd import exceptions as lxd_exceptions
+
+from nova.virt.lxd import common
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+PREFIX = common.INTERNAL_PREFIX + 'warm-'
+IMAGE_KEY = 'user.nova-lxd.warm-image'
+
+
+def _targets():
+    """Return the configured number of warm containers per image."""
+    targets = {}
+    for image_ref, count in CONF.lxd.warm_pool.items():
+        try:
+            targets[image_ref] = int(count)
+        except ValueError:
+            LOG.warning('Ignoring invalid warm pool size %(count)s for '
+                        'image %(image)s',
+                        {'count': count, 'image': image_ref})
+    return targets
+
+
+class WarmPool(object):
+    """A pool of stopped containers created ahead of time.
+
+    For every image in `[lxd] warm_pool`, the configured number of
+    containers is created from the image and left stopped. Such a
+    container is named with `PREFIX` and records its image in its
+    config, so the pool survives restarts of nova-compute. Instead of
+    creating a container, `spawn` claims one from the pool by renaming
+    it after the instance and handing it the instance profile.
+
+    `refill` tops the pool back up, and removes the containers of
+    images that were dropped from the configuration or deleted from
+    glance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refilling = threading.Lock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def _containers(self, client):
+        """Return the names of the pooled containers for each image."""
+        pooled = collections.defaultdict(list)
+        for container in common.list_containers(client):
+            if container['name'].startswith(PREFIX):
+                image_ref = container['config'].get(IMAGE_KEY)
+                pooled[image_ref].append(container['name'])
+        return pooled
+
+    def claim(self, client, image_ref, name, profile, config=None):
+        """Take a container for image_ref out of the pool.
+
+        The container is renamed to `name`, its configuration is
+        replaced by `profile` and `config` is added to it. None is
+        returned when the pool has no container for the image.
+        """
+        if not _targets().get(image_ref):
+            return None
+
+        with self._lock:
+            candidates = self._containers(client).get(image_ref, [])
+            for candidate in candidates:
+                try:
+                    container = client.containers.get(candidate)
+                    container.rename(name, wait=True)
+                except lxd_exceptions.LXDAPIException as e:
+                    # Most likely claimed by another process.
+                    LOG.debug('Could not claim warm container %(name)s: '
+                              '%(reason)s',
+                              {'name': candidate, 'reason': e})
+                    continue
+                break
+            else:
+                self.misses[image_ref] += 1
+                LOG.debug('Warm pool miss for image %s', image_ref)
+                return None
+
+        try:
+            common.adopt_container(container, profile, IMAGE_KEY, config)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                common.discard_container(container)
+        self.hits[image_ref] += 1
+        LOG.debug('Warm pool hit for image %(image)s: %(name)s',
+                  {'image': image_ref, 'name': candidate})
+        return container
+
+    def _create(self, client, image_ref):
+        config = common.internal_container_config(
+            PREFIX + uuid.uuid4().hex, image_ref, {IMAGE_KEY: image_ref})
+        client.containers.create(config, wait=True)
+
+    def _delete(self, client, names):
+        for name in names:
+            try:
+                client.containers.get(name).delete(wait=True)
+            except lxd_exceptions.LXDAPIException as e:
+                if e.response.status_code != 404:
+                    LOG.warning('Failed to delete warm container %(name)s: '
+                                '%(reason)s', {'name': name, 'reason': e})
+
+    def refill(self, client, ensure_image):
+        """Bring the pool back to its configured size.
+
+        :param client: the pylxd client
+        :param ensure_image: a callable making sure an image ref is in
+                             the LXD image store, raising ImageNotFound
+                             if it was deleted from glance
+        """
+        if not self._refilling.acquire(False):
+            # A refill is already under way.
+            return
+        try:
+            targets = _targets()
+            pooled = self._containers(client)
+
+            for image_ref in set(pooled) - set(targets):
+                LOG.info('Removing warm containers for image %s', image_ref)
+                self._delete(client, pooled[image_ref])
+
+            for image_ref, target in targets.items():
+                existing = pooled.get(image_ref, [])
+                try:
+                    ensure_image(image_ref)
+                except exception.ImageNotFound:
+                    LOG.info('Image %s no longer exists, removing its warm '
+                             'containers', image_ref)
+                    self._delete(client, existing)
+                    continue
+
+                if len(existing) > target:
+                    self._delete(client, existing[target:])
+                for _ in range(target - len(existing)):
+                    self._create(client, image_ref)
+        except Exception:
+            LOG.exception('Failed to refill the warm container pool')
+        finally:
+            self._refilling.release()
+
+    def stats(self):
+        """Return the pool hits and misses for every image."""
+        return {image_ref: {'hits': self.hits[image_ref],
+                            'misses': self.misses[image_ref]}
+                for image_ref in set(self.hits) | set(self.misses)}